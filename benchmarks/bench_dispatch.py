@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""Micro-benchmark for DelegationOnboardBot.process_op
+
+Replays a synthetic op stream against 1k, 10k and 100k tracked accounts
+and reports ops/s of the dispatcher and of the old list based membership
+test.
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot, OP_TYPES
+from delegationonboardbot.store import StateStore
+from delegationonboardbot.record import AccountRecord
+
+N_OPS = 200000
+TRACKED_FRACTION = 0.01
+OP_MIX = [("vote", 60), ("custom_json", 25), ("comment", 8), ("transfer", 6), ("delegate_vesting_shares", 1)]
+
+
+def empty_account():
+    return AccountRecord(weight=300)
+
+
+def make_op(op_type, account, block_num):
+    op = {"type": op_type, "block_num": block_num, "timestamp": datetime(2020, 6, 1, tzinfo=timezone.utc)}
+    if op_type == "vote":
+        op.update({"voter": account, "author": "someauthor", "permlink": "post", "weight": 10000})
+    elif op_type == "custom_json":
+        op.update({"id": "follow", "required_auths": [], "required_posting_auths": [account],
+                   "json": '["follow",{"follower":"%s","following":"someauthor","what":["blog"]}]' % account})
+    elif op_type == "comment":
+        # only replies, so that no beneficiary lookup is triggered
+        op.update({"author": account, "permlink": "re-post", "parent_author": "someauthor", "parent_permlink": "post"})
+    elif op_type == "transfer":
+        op.update({"from": account, "to": "someone", "amount": "0.001 HIVE", "memo": ""})
+    elif op_type == "delegate_vesting_shares":
+        op.update({"delegator": "somedelegator", "delegatee": account, "vesting_shares": "0.000000 VESTS"})
+    return op
+
+
+def make_ops(tracked, n_ops):
+    random.seed(42)
+    op_types = [op_type for op_type, weight in OP_MIX for i in range(weight)]
+    ops = []
+    for i in range(n_ops):
+        if random.random() < TRACKED_FRACTION:
+            account = random.choice(tracked)
+        else:
+            account = "user%d" % random.randint(0, 2000000)
+        ops.append(make_op(random.choice(op_types), account, i // 50))
+    return ops
+
+
+def make_bot(accounts, data_file):
+    bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+    bot.config = {"muteAccount": "muteacc", "delegationAccount": "delegationacc", "referrerAccount": "dappacc"}
+    bot.accounts = accounts
+    bot.store = StateStore(data_file)
+    bot.unresolved_posts = {}
+    bot.op_handlers = dict((op_type, getattr(bot, "handle_" + op_type)) for op_type in OP_TYPES)
+    return bot
+
+
+def legacy_dispatch(accounts, ops):
+    active_accounts = {}
+    for op in ops:
+        if op["type"] == "vote":
+            account = op["voter"]
+        elif op["type"] == "transfer":
+            account = op["from"]
+        elif op["type"] == "comment":
+            account = op["author"]
+        elif op["type"] == "custom_json":
+            account = op["required_posting_auths"][0]
+        else:
+            continue
+        if account not in list(accounts.keys()):
+            continue
+        active_accounts[account] = op["timestamp"].replace(tzinfo=None)
+    return active_accounts
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    for n_accounts in [1000, 10000, 100000]:
+        tracked = ["onboarded%d" % i for i in range(n_accounts)]
+        accounts = dict((name, empty_account()) for name in tracked)
+        ops = make_ops(tracked, N_OPS)
+        bot = make_bot(accounts, os.path.join(tmp_dir, "bench_%d.sqlite" % n_accounts))
+        active_accounts = {}
+        start = time.time()
+        for op in ops:
+            bot.process_op(op, active_accounts)
+        duration = time.time() - start
+        print("%6d accounts: process_op %10.0f ops/s" % (n_accounts, len(ops) / duration))
+
+        # the old code path is too slow for the full op stream
+        legacy_ops = ops[:max(1000, N_OPS * 1000 // n_accounts // 10)]
+        start = time.time()
+        legacy_dispatch(accounts, legacy_ops)
+        duration = time.time() - start
+        print("%6d accounts: list()   %10.0f ops/s" % (n_accounts, len(legacy_ops) / duration))
+
+
+if __name__ == "__main__":
+    main()
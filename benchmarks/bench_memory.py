@@ -0,0 +1,48 @@
+#!/usr/bin/python
+"""Compares memory and on-disk size of account dicts and AccountRecord
+
+Builds 100k accounts in the dict layout of older versions and as
+AccountRecord objects, and reports the traced memory, the pickle size of
+the dicts and the size of the binary snapshot.
+"""
+import os
+import pickle
+import tempfile
+import tracemalloc
+from datetime import datetime
+from delegationonboardbot.record import AccountRecord, write_snapshot
+
+N_ACCOUNTS = 100000
+
+
+def make_dict(i):
+    return {"timestamp": datetime(2020, 6, 1, 12, i % 60), "weight": 300, "muted": False, "rc": 1.5e10 + i,
+            "hp": 5.0 + i / 1000.0, "delegated_hp": 30.0, "delegation_timestamp": datetime(2020, 7, 1, 8, i % 60),
+            "rc_comments": 12.5 + i / 100.0, "delegation_revoked": False}
+
+
+def make_record(i):
+    return AccountRecord(**make_dict(i))
+
+
+def measure(factory):
+    tracemalloc.start()
+    accounts = dict(("onboarded%d" % i, factory(i)) for i in range(N_ACCOUNTS))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return accounts, size
+
+
+def main():
+    dicts, dict_memory = measure(make_dict)
+    records, record_memory = measure(make_record)
+    snapshot_file = os.path.join(tempfile.mkdtemp(), "accounts.snapshot")
+    write_snapshot(snapshot_file, records)
+    print("%d accounts" % N_ACCOUNTS)
+    print("dict:          %8.1f MB in memory, %8.1f MB pickled" % (dict_memory / 1e6, len(pickle.dumps(dicts)) / 1e6))
+    print("AccountRecord: %8.1f MB in memory, %8.1f MB snapshot" % (record_memory / 1e6,
+                                                                   os.path.getsize(snapshot_file) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
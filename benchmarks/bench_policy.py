@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""Benchmark for the bulk policy evaluation
+
+Evaluates the grant and revoke rules over 10k, 100k and 1M random accounts
+with the per account checks of the original bot, with the pure python
+fallback and with numpy over policy columns, and checks that all of them
+reach the same decisions. The columns are kept up to date by the bot, their
+build time is shown separately.
+"""
+import random
+import time
+from delegationonboardbot import policy
+from delegationonboardbot.record import AccountRecord
+
+CONFIG = {"maxUserHP": 50, "minPostRC": 10, "delegationLength": 28}
+DAY = 24 * 60 * 60
+
+
+def random_account(now):
+    acc = AccountRecord(weight=300, hp=random.choice([0, 5, 49, 50, 51, 200]), rc_comments=random.uniform(0, 20),
+                        muted=random.random() < 0.05, delegation_revoked=random.random() < 0.2)
+    if random.random() < 0.5:
+        acc.delegated_hp = 30
+        # some delegations expire exactly now
+        acc.delegation_epoch = int(now - random.choice([random.uniform(0, 40), CONFIG["delegationLength"]]) * DAY)
+    return acc
+
+
+def baseline_policy(accounts, names, config, now):
+    """The checks of check_delegation_age, check_max_hp, check_muted and check_account_on_activity"""
+    grant = []
+    revoke = {}
+    for name in names:
+        acc = accounts[name]
+        if acc.delegated_hp == 0 or acc.delegation_revoked:
+            if acc.delegated_hp > 0 or acc.delegation_revoked or acc.hp > config["maxUserHP"]:
+                continue
+            if acc.rc_comments < config["minPostRC"]:
+                grant.append(name)
+            continue
+        if config["delegationLength"] > 0 and (now - acc.delegation_epoch) / DAY > config["delegationLength"]:
+            revoke[name] = policy.REVOKE_LENGTH
+        elif config["maxUserHP"] > 0 and acc.hp > config["maxUserHP"]:
+            revoke[name] = policy.REVOKE_MAX_HP
+        elif acc.muted:
+            revoke[name] = policy.REVOKE_MUTED
+    return grant, revoke
+
+
+def timed(label, n_accounts, func, *args):
+    start = time.time()
+    result = func(*args)
+    print("%7d accounts: %-15s %8.1f ms" % (n_accounts, label, (time.time() - start) * 1000))
+    return result
+
+
+def build_columns(accounts):
+    columns = policy.PolicyColumns(len(accounts))
+    for name, acc in accounts.items():
+        columns.update(name, acc)
+    return columns
+
+
+def check(label, result, expected):
+    if sorted(result[0]) != sorted(expected[0]) or result[1] != expected[1]:
+        raise AssertionError("%s policy evaluation differs from the original checks" % label)
+
+
+def main():
+    random.seed(42)
+    now = time.time()
+    for n_accounts in [10000, 100000, 1000000]:
+        accounts = dict(("onboarded%d" % i, random_account(now)) for i in range(n_accounts))
+        names = list(accounts.keys())
+        expected = timed("original checks", n_accounts, baseline_policy, accounts, names, CONFIG, now)
+        check("python", timed("python", n_accounts, policy.evaluate_policy_python, accounts, names, CONFIG, now),
+              expected)
+        if policy.np is None:
+            continue
+        columns = timed("build columns", n_accounts, build_columns, accounts)
+        check("numpy", timed("numpy", n_accounts, policy.evaluate_policy, accounts, None, CONFIG, now, columns),
+              expected)
+        print("%7d accounts: %d grants, %d revokes" % (n_accounts, len(expected[0]), len(expected[1])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+"""End-to-end benchmark of the block processing
+
+Replays a synthetic block archive against 1k, 10k and 100k tracked accounts
+with delegationonboardbot.replay and reports blocks/s and ops/s. A recorded
+archive and account snapshot can be benchmarked instead:
+
+    python -m benchmarks.bench_replay blocks.jsonl.gz data.sqlite config.json
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from delegationonboardbot.delegationonboardbot import OP_TYPES
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.replay import ReplayBot, ArchiveStream, replay, load_accounts
+
+N_BLOCKS = 20 * 60 * 4
+OPS_PER_BLOCK = 40
+TRACKED_FRACTION = 0.01
+OP_MIX = [("vote", 60), ("custom_json", 25), ("comment", 8), ("transfer", 6), ("delegate_vesting_shares", 1)]
+CONFIG = {"delegationAccount": "delegationacc", "referrerAccount": "dappacc", "adminAccount": "adminacc",
+          "delegationAmount": 30, "delegationLength": 28, "beneficiaryRemoval": True, "minPostRC": 10,
+          "muteAccount": "muteacc", "hpWarning": 100, "maxUserHP": 50, "notifyUser": True, "delegationMsg": "",
+          "delegationLengthMsg": "", "delegationMuteMsg": "", "delegationBeneficiaryMsg": "", "delegationMaxMsg": "",
+          "print_log_at_block": N_BLOCKS}
+
+
+def raw_op(op_type, account, block_num):
+    if op_type == "vote":
+        value = {"voter": account, "author": "someauthor", "permlink": "post", "weight": 10000}
+    elif op_type == "custom_json":
+        value = {"id": "follow", "required_auths": [], "required_posting_auths": [account],
+                 "json": '["follow",{"follower":"%s","following":"someauthor","what":["blog"]}]' % account}
+    elif op_type == "comment":
+        value = {"author": account, "permlink": "post-%d" % block_num, "parent_author": "", "parent_permlink": "hive",
+                 "title": "", "body": "", "json_metadata": ""}
+    elif op_type == "transfer":
+        value = {"from": account, "to": "someone", "amount": "0.001 HIVE", "memo": ""}
+    else:
+        value = {"delegator": "somedelegator", "delegatee": account, "vesting_shares": "0.000000 VESTS"}
+    return {"type": op_type + "_operation", "value": value}
+
+
+def write_synthetic_archive(archive_file, tracked):
+    random.seed(42)
+    op_types = [op_type for op_type, weight in OP_MIX for i in range(weight)]
+    start_time = datetime(2020, 6, 1)
+    with gzip.open(archive_file, "wt") as f:
+        for i in range(N_BLOCKS):
+            block_num = 40000000 + i
+            transactions = []
+            for j in range(OPS_PER_BLOCK):
+                if random.random() < TRACKED_FRACTION:
+                    account = random.choice(tracked)
+                else:
+                    account = "user%d" % random.randint(0, 2000000)
+                transactions.append({"operations": [raw_op(random.choice(op_types), account, block_num)]})
+            block = {"block_num": block_num, "timestamp": (start_time + timedelta(seconds=3 * i)).strftime("%Y-%m-%dT%H:%M:%S"),
+                     "transactions": transactions}
+            f.write(json.dumps(block) + "\n")
+
+
+def run(archive_file, accounts, config):
+    bot = ReplayBot(config, accounts)
+    stream = ArchiveStream(archive_file, OP_TYPES)
+    start = time.time()
+    samples, blocks = replay(bot, stream)
+    duration = time.time() - start
+    print("%6d accounts: %8.0f blocks/s %10.0f ops/s (%d granted, %d revoked)" % (
+        len(accounts), blocks / duration, bot.op_count / duration, bot.granted, bot.revoked))
+
+
+def main():
+    if len(sys.argv) > 3:
+        config = json.loads(open(sys.argv[3]).read())
+        run(sys.argv[1], load_accounts(sys.argv[2]), config)
+        return
+    tmp_dir = tempfile.mkdtemp()
+    for n_accounts in [1000, 10000, 100000]:
+        tracked = ["onboarded%d" % i for i in range(n_accounts)]
+        archive_file = os.path.join(tmp_dir, "blocks_%d.jsonl.gz" % n_accounts)
+        write_synthetic_archive(archive_file, tracked)
+        # every second account needs a delegation on activity
+        accounts = dict((name, AccountRecord(weight=300, rc_comments=20 * (i % 2))) for i, name in enumerate(tracked))
+        run(archive_file, accounts, CONFIG)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+"""Benchmark of the startup
+
+Measures for 10k and 100k accounts how long DelegationOnboardBot.__init__
+takes with the normal and with the fast startup, against a local stub node
+which answers the RPC calls and the referrer API. Half of the accounts have
+a delegation. The stub node delays every request by the given latency
+(0 and 50 ms by default, or the seconds given as argument), the fast
+startup is also timed until its background reconciliation has finished.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from beem import Hive
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.mutes import MuteTracker
+from delegationonboardbot.record import AccountRecord, write_snapshot
+from delegationonboardbot.store import StateStore
+from tests.fixture_server import FixtureServer
+
+HEAD_BLOCK_NUM = 50000000
+# any valid key, the bot only unlocks the wallet
+WIF = "5KQwrPbwdL6PhXujxW37FSSQZ1JiwsST4cqQzDeyXtP79zkvFD3"
+CONFIG = {"delegationAccount": "delegationacc", "referrerAccount": "dappacc", "adminAccount": "adminacc",
+          "delegationAmount": 30, "delegationLength": 28, "beneficiaryRemoval": True, "minPostRC": 10,
+          "muteAccount": "muteacc", "hpWarning": 100, "maxUserHP": 50, "notifyUser": True, "delegationMsg": "",
+          "delegationLengthMsg": "", "delegationMuteMsg": "", "delegationBeneficiaryMsg": "", "delegationMaxMsg": "",
+          "print_log_at_block": 100, "wallet_password": "bench", "no_broadcast": True}
+RESOURCES = ["resource_history_bytes", "resource_new_accounts", "resource_market_bytes", "resource_state_bytes",
+             "resource_execution_time"]
+
+
+def nai(amount, precision, asset):
+    return {"amount": str(amount), "precision": precision, "nai": asset}
+
+
+def hive_amount(amount):
+    return nai(amount, 3, "@@000000021")
+
+
+def vests_amount(amount):
+    return nai(amount, 6, "@@000000037")
+
+
+def hbd_amount(amount):
+    return nai(amount, 3, "@@000000013")
+
+
+def chain_account(name):
+    auth = {"weight_threshold": 1, "account_auths": [],
+            "key_auths": [["STM6LLegbAgLAy28EHrffBVuANFWcFgmqRMW13wBmTExqFE9SCkg4", 1]]}
+    never = "1970-01-01T00:00:00"
+    return {"name": name, "owner": auth, "active": auth, "posting": auth, "memo_key": auth["key_auths"][0][0],
+            "json_metadata": "", "posting_json_metadata": "", "proxy": "", "last_owner_update": never,
+            "last_account_update": never, "created": "2020-01-01T00:00:00", "mined": False,
+            "recovery_account": "hive", "last_account_recovery": never, "reset_account": "null",
+            "comment_count": 0, "lifetime_vote_count": 0, "post_count": 0, "can_vote": True,
+            "voting_manabar": {"current_mana": "0", "last_update_time": 0},
+            "downvote_manabar": {"current_mana": "0", "last_update_time": 0},
+            "balance": hive_amount(500000000), "savings_balance": hive_amount(0), "hbd_balance": hbd_amount(0),
+            "savings_hbd_balance": hbd_amount(0), "vesting_shares": vests_amount(1000000000000000),
+            "delegated_vesting_shares": vests_amount(100000000000000), "received_vesting_shares": vests_amount(0),
+            "vesting_withdraw_rate": vests_amount(0), "next_vesting_withdrawal": "1969-12-31T23:59:59",
+            "withdrawn": 0, "to_withdraw": 0, "withdraw_routes": 0, "proxied_vsf_votes": [0, 0, 0, 0],
+            "witnesses_voted_for": 0, "last_post": never, "last_root_post": never, "last_vote_time": never,
+            "post_voting_power": vests_amount(1000000000000000), "reward_hbd_balance": hbd_amount(0),
+            "reward_hive_balance": hive_amount(0), "reward_vesting_balance": vests_amount(0),
+            "reward_vesting_hive": hive_amount(0), "savings_withdraw_requests": 0, "sbd_seconds": "0",
+            "savings_sbd_seconds": "0", "hbd_seconds": "0", "hbd_seconds_last_update": never,
+            "hbd_last_interest_payment": never, "savings_hbd_seconds": "0", "savings_hbd_seconds_last_update": never,
+            "savings_hbd_last_interest_payment": never, "pending_claimed_accounts": 0, "open_recurrent_transfers": 0,
+            "is_smt": False, "delayed_votes": [], "governance_vote_expiration_ts": never}
+
+
+class StubNode(FixtureServer):
+    """ Answers the RPC calls of the startup and the referrer API like a Hive node and hiveonboard.com
+
+        :param list referred: referrer items, newest first
+        :param list delegations: vesting delegations of delegationAccount, sorted by delegatee
+        :param float latency: delay of every response in seconds
+    """
+    def __init__(self, referred, delegations, latency=0.):
+        self.referred = referred
+        self.delegations = delegations
+        self.delegatees = [d["delegatee"] for d in delegations]
+        self.latency = latency
+        FixtureServer.__init__(self)
+
+    def handle_get(self, path):
+        time.sleep(self.latency)
+        offset, limit = [int(p.split("=")[1]) for p in sorted(path.split("?")[1].split("&"), reverse=True)]
+        return 200, {"items": self.referred[offset:offset + limit]}
+
+    def handle_post(self, path, body):
+        time.sleep(self.latency)
+        request = json.loads(body)
+        method, params = request["method"], request.get("params")
+        if method == "call":
+            method, params = "%s.%s" % (params[0], params[1]), params[2]
+        return 200, {"jsonrpc": "2.0", "id": request.get("id"), "result": self.result(method, params)}
+
+    def result(self, method, params):
+        if method == "database_api.get_config":
+            return {"HIVE_CHAIN_ID": "beeab0de" + "0" * 56, "HIVE_BLOCKCHAIN_VERSION": "1.27.0",
+                    "HIVE_ADDRESS_PREFIX": "STM", "HIVE_BLOCK_INTERVAL": 3}
+        if method == "database_api.get_dynamic_global_properties":
+            return {"head_block_number": HEAD_BLOCK_NUM, "last_irreversible_block_num": HEAD_BLOCK_NUM - 20,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+                    "total_vesting_fund_hive": hive_amount(150000000000),
+                    "total_vesting_shares": vests_amount(300000000000000000)}
+        if method == "database_api.find_accounts":
+            return {"accounts": [chain_account(name) for name in params["accounts"]]}
+        if method == "rc_api.find_rc_accounts":
+            return {"rc_accounts": []}
+        if method == "rc_api.get_resource_pool":
+            return {"resource_pool": dict((r, {"pool": "1000000000000"}) for r in RESOURCES)}
+        if method == "rc_api.get_resource_params":
+            curve = {"coeff_a": "12000000000000000000", "coeff_b": "1000000000", "shift": 49}
+            return {"resource_params": dict((r, {"price_curve_params": curve,
+                                                 "resource_dynamics_params": {"resource_unit": 1}})
+                                            for r in RESOURCES)}
+        if method == "database_api.list_vesting_delegations":
+            start = bisect_left(self.delegatees, params["start"][1])
+            return {"delegations": self.delegations[start:start + params["limit"]]}
+        if method == "database_api.find_vesting_delegation_expirations":
+            return {"delegations": []}
+        if method == "condenser_api.get_following":
+            return []
+        return {}
+
+
+def random_account(timestamp):
+    acc = AccountRecord(timestamp=timestamp, weight=300, hp=random.choice([0, 5, 100]),
+                        rc_comments=random.uniform(0, 20))
+    if random.random() < 0.5:
+        acc.delegated_hp = 15
+        acc.delegation_timestamp = datetime.utcnow() - timedelta(days=random.uniform(0, 27))
+    return acc
+
+
+def prepare(data_dir, accounts, referred):
+    """Writes the state of a bot which was stopped at the last checkpoint"""
+    data_file = os.path.join(data_dir, "data.sqlite")
+    store = StateStore(data_file)
+    last_block_num = HEAD_BLOCK_NUM - 100
+    with store.transaction():
+        store.store_accounts(accounts)
+        store.set("last_block_num", last_block_num)
+        store.set("snapshot_block_num", last_block_num)
+        store.set("referrer_cursor", {"timestamp": float(referred[0]["timestamp"]), "offset": 0})
+    MuteTracker(store, CONFIG["muteAccount"]).resync([], last_block_num)
+    store.close()
+    write_snapshot(os.path.join(data_dir, "accounts.snapshot"), accounts)
+    return data_file
+
+
+def start(node, data_file, fast_start):
+    config = dict(CONFIG, onboardApi=node.url + "/api/referrer/%s")
+    hive = Hive(node=node.url, num_retries=0, keys=[WIF])
+    start_time = time.time()
+    bot = DelegationOnboardBot(config, data_file, hive, broadcast_instance=hive, fast_start=fast_start,
+                               lookup_instance=hive)
+    init_duration = time.time() - start_time
+    ready_duration = None
+    if fast_start:
+        bot.start_background_reconcile(Hive(node=node.url, num_retries=0, keys=[WIF]))
+        while not bot.ready:
+            time.sleep(0.001)
+            bot.finish_startup()
+        ready_duration = time.time() - start_time
+    bot.store.close()
+    return init_duration, ready_duration
+
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    latencies = [float(sys.argv[1])] if len(sys.argv) > 1 else [0., 0.05]
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    for n_accounts in [10000, 100000]:
+        names = ["onboarded%d" % i for i in range(n_accounts)]
+        created = datetime(2020, 6, 1)
+        accounts = dict((name, random_account(created + timedelta(minutes=i))) for i, name in enumerate(names))
+        referred = [{"account": name, "timestamp": (i + 1591000000) * 1000, "weight": 300}
+                    for i, name in reversed(list(enumerate(names)))]
+        delegations = [{"delegator": CONFIG["delegationAccount"], "delegatee": name,
+                        "vesting_shares": vests_amount(int(accounts[name].delegated_hp * 2000 * 1e6)),
+                        "min_delegation_time": accounts[name].delegation_timestamp.strftime("%Y-%m-%dT%H:%M:%S")}
+                       for name in sorted(names) if accounts[name].delegated_hp > 0]
+        for latency in latencies:
+            node = StubNode(referred, delegations, latency)
+            for fast_start in [False, True]:
+                data_dir = tempfile.mkdtemp(dir=tmp_dir)
+                data_file = prepare(data_dir, accounts, referred)
+                init_duration, ready_duration = start(node, data_file, fast_start)
+                line = "%6d accounts, %3d ms latency, %-6s startup: __init__ %8.1f ms" % (
+                    n_accounts, latency * 1000, "fast" if fast_start else "normal", init_duration * 1000)
+                if ready_duration is not None:
+                    line += ", ready after %8.1f ms" % (ready_duration * 1000)
+                print("%s (%d requests)" % (line, len(node.requests)))
+                node.requests = []
+            node.close()
+
+
+if __name__ == "__main__":
+    main()
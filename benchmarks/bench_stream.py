@@ -0,0 +1,181 @@
+#!/usr/bin/python
+"""Compares op extraction with and without op type filtering
+
+A block fixture with a mainnet like op mix is streamed once with all op
+types and once with the op types handled by the bot. Both results are
+passed through DelegationOnboardBot.process_op.
+
+The same blocks are then served by a local stub node and streamed over
+RPC, once with beem's Blockchain.stream (one get_block call per block, as
+the bot did before) and once with BlockStream (block_api.get_block_range).
+Every response of the stub node can be delayed by a latency in seconds,
+which is given as argument (default 0).
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from beem import Hive
+from beem.blockchain import Blockchain
+from delegationonboardbot.delegationonboardbot import OP_TYPES
+from delegationonboardbot.stream import block_ops, BlockStream
+from benchmarks.bench_dispatch import empty_account, make_bot
+from tests.fixture_server import FixtureServer
+
+N_BLOCKS = 2000
+N_RPC_BLOCKS = 500
+START_BLOCK = 50000000
+OPS_PER_BLOCK = 60
+OP_MIX = [
+    ("vote_operation", 35, {"voter": "", "author": "someauthor", "permlink": "post", "weight": 10000}),
+    ("custom_json_operation", 30, {"id": "sm_find_match", "required_auths": [], "required_posting_auths": [""],
+                                   "json": '{"match_type":"Ranked","mana_cap":99,"ranked":true}'}),
+    ("comment_operation", 4, {"author": "", "permlink": "re-post", "parent_author": "someauthor",
+                              "parent_permlink": "post", "title": "", "body": "a reply " * 40,
+                              "json_metadata": '{"app":"peakd/2022.05.1"}'}),
+    ("transfer_operation", 5, {"from": "", "to": "someone", "memo": "",
+                               "amount": {"amount": "1", "precision": 3, "nai": "@@000000021"}}),
+    ("claim_reward_balance_operation", 8, {"account": "",
+                                           "reward_hive": {"amount": "0", "precision": 3, "nai": "@@000000021"},
+                                           "reward_hbd": {"amount": "0", "precision": 3, "nai": "@@000000013"},
+                                           "reward_vests": {"amount": "1", "precision": 6, "nai": "@@000000037"}}),
+    ("limit_order_create_operation", 10, {"owner": "", "orderid": 1, "fill_or_kill": False,
+                                          "amount_to_sell": {"amount": "1", "precision": 3, "nai": "@@000000021"},
+                                          "min_to_receive": {"amount": "1", "precision": 3, "nai": "@@000000013"},
+                                          "expiration": "2020-06-01T00:00:00"}),
+    ("comment_options_operation", 3, {"author": "", "permlink": "post", "max_accepted_payout":
+                                      {"amount": "1000000000", "precision": 3, "nai": "@@000000013"},
+                                      "percent_hbd": 10000, "allow_votes": True, "allow_curation_rewards": True,
+                                      "extensions": []}),
+    ("account_update2_operation", 5, {"account": "", "json_metadata": "", "posting_json_metadata":
+                                      '{"profile":{"name":"someone","about":"' + "x" * 200 + '"}}',
+                                      "extensions": []}),
+]
+
+
+def account_field(value):
+    for key in ["voter", "author", "from", "account", "owner"]:
+        if key in value:
+            return key
+    return None
+
+
+def make_blocks(n_blocks):
+    random.seed(42)
+    mix = [entry for entry in OP_MIX for i in range(entry[1])]
+    blocks = []
+    for block_num in range(n_blocks):
+        transactions = []
+        for i in range(OPS_PER_BLOCK):
+            op_type, weight, template = random.choice(mix)
+            value = dict(template)
+            account = "user%d" % random.randint(0, 2000000)
+            if op_type == "custom_json_operation":
+                value["required_posting_auths"] = [account]
+            else:
+                value[account_field(value)] = account
+            transactions.append({"operations": [{"type": op_type, "value": value}]})
+        blocks.append({"timestamp": "2020-06-01T00:00:00", "transactions": transactions,
+                       "transaction_ids": ["%040x" % (block_num * OPS_PER_BLOCK + i) for i in range(OPS_PER_BLOCK)]})
+    return blocks
+
+
+def run(bot, blocks, op_names):
+    n_ops = 0
+    active_accounts = {}
+    start = time.time()
+    for block_num, block in enumerate(blocks):
+        for op in block_ops(block, block_num, op_names):
+            bot.process_op(op, active_accounts)
+            n_ops += 1
+    return n_ops, time.time() - start
+
+
+class StubNode(FixtureServer):
+    """ Serves blocks from START_BLOCK on through block_api.get_block and block_api.get_block_range
+
+        :param list blocks: blocks as returned by make_blocks
+        :param float latency: delay of every response in seconds
+    """
+    def __init__(self, blocks, latency=0.):
+        self.blocks = [self.signed_block(block, START_BLOCK + i) for i, block in enumerate(blocks)]
+        self.latency = latency
+        self.calls = 0
+        FixtureServer.__init__(self)
+
+    def signed_block(self, block, block_num):
+        # the header fields which beem's Block expects
+        block = dict(block, previous="%08x" % (block_num - 1) + "0" * 32, block_id="%08x" % block_num + "0" * 32,
+                     witness="somewitness", transaction_merkle_root="0" * 40, extensions=[],
+                     witness_signature="0" * 130, signing_key="STM6LLegbAgLAy28EHrffBVuANFWcFgmqRMW13wBmTExqFE9SCkg4")
+        block["transactions"] = [dict(trx, ref_block_num=0, ref_block_prefix=0, expiration="2020-06-01T00:00:30",
+                                      extensions=[], signatures=[]) for trx in block["transactions"]]
+        return block
+
+    def handle_post(self, path, body):
+        time.sleep(self.latency)
+        requests = json.loads(body)
+        results = []
+        for request in ([requests] if isinstance(requests, dict) else requests):
+            self.calls += 1
+            method, params = request["method"], request.get("params")
+            if method == "call":
+                method, params = "%s.%s" % (params[0], params[1]), params[2]
+            results.append({"jsonrpc": "2.0", "id": request.get("id"), "result": self.result(method, params)})
+        return 200, results[0] if isinstance(requests, dict) else results
+
+    def result(self, method, params):
+        if method == "database_api.get_config":
+            return {"HIVE_CHAIN_ID": "beeab0de" + "0" * 56, "HIVE_BLOCKCHAIN_VERSION": "1.27.0",
+                    "HIVE_ADDRESS_PREFIX": "STM", "HIVE_BLOCK_INTERVAL": 3}
+        if method == "database_api.get_dynamic_global_properties":
+            head_block_num = START_BLOCK + len(self.blocks) - 1
+            return {"head_block_number": head_block_num, "last_irreversible_block_num": head_block_num,
+                    "time": "2020-06-01T00:00:00"}
+        if method == "block_api.get_block":
+            return {"block": self.blocks[params["block_num"] - START_BLOCK]}
+        if method == "block_api.get_block_range":
+            start = params["starting_block_num"] - START_BLOCK
+            return {"blocks": self.blocks[start:start + params["count"]]}
+        return {}
+
+
+def run_rpc(bot, ops):
+    n_ops = 0
+    active_accounts = {}
+    start = time.time()
+    for op in ops:
+        bot.process_op(op, active_accounts)
+        n_ops += 1
+    return n_ops, time.time() - start
+
+
+def main():
+    blocks = make_blocks(N_BLOCKS)
+    accounts = dict(("onboarded%d" % i, empty_account()) for i in range(10000))
+    bot = make_bot(accounts, os.path.join(tempfile.mkdtemp(), "bench_stream.sqlite"))
+    n_chain_ops = N_BLOCKS * OPS_PER_BLOCK
+    for name, op_names in [("all op types", None), ("filtered", set(OP_TYPES))]:
+        n_ops, duration = run(bot, blocks, op_names)
+        print("%-12s: %8d op dicts, %10.0f chain ops/s, %8.0f blocks/s" % (name, n_ops, n_chain_ops / duration,
+                                                                          N_BLOCKS / duration))
+
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.
+    node = StubNode(blocks[:N_RPC_BLOCKS], latency)
+    hive = Hive(node=node.url, num_retries=0)
+    stop_block = START_BLOCK + N_RPC_BLOCKS - 1
+    print("over RPC, %d ms latency:" % (latency * 1000))
+    for name, ops in [("beem stream", Blockchain(mode="head", blockchain_instance=hive).stream(start=START_BLOCK,
+                                                                                                stop=stop_block)),
+                      ("block range", BlockStream(hive, OP_TYPES).stream(START_BLOCK, stop_block))]:
+        node.calls = 0
+        n_ops, duration = run_rpc(bot, ops)
+        print("%-12s: %8d op dicts, %10.0f chain ops/s, %8.0f blocks/s, %5d RPC calls" % (
+            name, n_ops, N_RPC_BLOCKS * OPS_PER_BLOCK / duration, N_RPC_BLOCKS / duration, node.calls))
+    node.close()
+
+
+if __name__ == "__main__":
+    main()
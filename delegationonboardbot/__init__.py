@@ -2,5 +2,23 @@
 from .version import version as __version__
 __all__ = [
     'utils',
+    'store',
+    'stream',
+    'broadcast',
+    'lookup',
+    'index',
+    'record',
+    'policy',
+    'chain',
+    'nodes',
+    'replay',
+    'profiling',
+    'metrics',
+    'journal',
+    'tenants',
+    'mutes',
+    'query',
+    'scheduler',
+    'capacity',
     'delegationonboardbot'
     ]
\ No newline at end of file
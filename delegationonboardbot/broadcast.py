@@ -0,0 +1,235 @@
+#!/usr/bin/python
+import logging
+import queue
+import threading
+from beem.amount import Amount
+from beem.transactionbuilder import TransactionBuilder
+from beemapi.exceptions import MissingRequiredActiveAuthority, UnnecessarySignatureDetected
+from beembase import operations
+
+logger = logging.getLogger(__name__)
+
+# the chain has already included a transaction with the same id
+DUPLICATE_ERROR = "duplicate transaction"
+# error messages which mean that the node has rejected the transaction
+REJECTED_ERRORS = ["assert exception", "missing required", "irrelevant signature", "missing authority"]
+
+
+class Broadcaster(object):
+    """ Broadcasts delegations and transfers in a background thread
+
+        Broadcasts are put into a bounded queue, so that block processing
+        only blocks when the queue is full. Queued ops are packed into
+        transactions, which are broadcasted when max_ops ops or max_size
+        bytes are collected or when flush is called. The outcome of each op
+        is handed back through process_results, which calls the callback of
+        the op on the calling thread.
+
+        :param Account account: account which signs the broadcasts, its
+            blockchain instance should not be used by other threads
+        :param str wallet_password: password of the beem wallet
+        :param int queue_size: maximum number of queued broadcasts
+        :param int max_ops: maximum number of ops in one transaction
+        :param int max_size: maximum size of the serialized ops of one
+            transaction in bytes
+    """
+    def __init__(self, account, wallet_password, queue_size=1000, max_ops=50, max_size=60000):
+        self.account = account
+        self.wallet_password = wallet_password
+        self.max_ops = max_ops
+        self.max_size = max_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue()
+        # flush requests are counted, so that ops which are queued before a flush
+        # request are never missed by the worker
+        self.flush_lock = threading.Lock()
+        self.flush_requests = 0
+        self.thread = threading.Thread(target=self.worker, name="broadcaster")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def set_account(self, account):
+        """Replaces the signing account, e.g. to switch to another Hive instance"""
+        self.account = account
+
+    def delegate(self, delegatee, vests, callback=None):
+        """Queues a delegation of vests to delegatee"""
+        self.queue.put(("delegate_vesting_shares", (delegatee, vests), callback))
+
+    def transfer(self, to, amount, asset, memo, callback=None):
+        """Queues a transfer"""
+        self.queue.put(("transfer", (to, amount, asset, memo), callback))
+
+    def pending(self):
+        """Returns the number of queued broadcasts"""
+        return self.queue.qsize()
+
+    def flush(self):
+        """Broadcasts all queued ops without waiting for a full transaction"""
+        with self.flush_lock:
+            self.flush_requests += 1
+
+    def build_op(self, op_type, args):
+        blockchain = self.account.blockchain
+        if op_type == "delegate_vesting_shares":
+            return operations.Delegate_vesting_shares(**{
+                "delegator": self.account["name"],
+                "delegatee": args[0],
+                "vesting_shares": Amount(args[1], blockchain.vest_token_symbol, blockchain_instance=blockchain),
+                "prefix": blockchain.prefix,
+            })
+        elif op_type == "transfer":
+            return operations.Transfer(**{
+                "from": self.account["name"],
+                "to": args[0],
+                "amount": Amount(args[1], args[2], blockchain_instance=blockchain),
+                "memo": args[3],
+                "prefix": blockchain.prefix,
+                "json_str": not bool(blockchain.config["use_condenser"]),
+            })
+        raise ValueError("Unknown op type %s" % op_type)
+
+    def sign(self, ops):
+        """Returns the signed transaction of ops as dict"""
+        wallet = self.account.blockchain.wallet
+        if wallet.locked():
+            wallet.unlock(self.wallet_password)
+        tx = TransactionBuilder(blockchain_instance=self.account.blockchain)
+        tx.appendOps(ops)
+        tx.appendSigner(self.account["name"], "active")
+        signed = tx.sign()
+        trx = tx.json()
+        trx["transaction_id"] = signed.id
+        return trx
+
+    def broadcast(self, trx):
+        """Broadcasts a signed transaction, a duplicate of an included transaction counts as success"""
+        tx = TransactionBuilder(tx=dict((k, v) for k, v in trx.items() if k != "transaction_id"),
+                                blockchain_instance=self.account.blockchain)
+        try:
+            tx.broadcast()
+        except Exception as e:
+            if DUPLICATE_ERROR not in str(e).lower():
+                raise
+
+    def rejected(self, error):
+        """Returns True when error means that the node has rejected the transaction"""
+        if isinstance(error, (MissingRequiredActiveAuthority, UnnecessarySignatureDetected)):
+            return True
+        msg = str(error).lower()
+        return any(reason in msg for reason in REJECTED_ERRORS)
+
+    def included(self, trx):
+        """Returns True when the node knows trx from its mempool or from a block"""
+        try:
+            status = self.account.blockchain.rpc.find_transaction(
+                {"transaction_id": trx["transaction_id"], "expiration": trx["expiration"]},
+                api="transaction_status")
+        except Exception as e:
+            logger.warning("Could not look up transaction %s: %s" % (trx["transaction_id"], str(e)))
+            return False
+        return status is not None and status.get("status", "").startswith("within_")
+
+    def broadcast_batch(self, batch):
+        """ Broadcasts all ops of batch in one transaction
+
+            When the transaction fails without a clear rejection, e.g. on a
+            timeout, it may still have been included. The transaction is
+            then looked up on the next node and, when it is unknown, the
+            same signed transaction is broadcasted again, which the chain
+            rejects as duplicate when it was included meanwhile. Only when
+            the node rejects the transaction, each op is broadcasted on its
+            own, so that only the failing ops are reported as failed.
+        """
+        try:
+            trx = self.sign([op for op, callback in batch])
+        except Exception as e:
+            logger.warning("Could not sign a transaction with %d ops: %s" % (len(batch), str(e)))
+            for op, callback in batch:
+                self.results.put((callback, False, e))
+            return
+        try:
+            self.broadcast(trx)
+            error = None
+        except Exception as e:
+            error = e
+        if error is not None and not self.rejected(error):
+            # the transaction may have been applied although the response was lost
+            try:
+                self.account.blockchain.rpc.next()
+            except Exception as next_error:
+                logger.warning("Could not switch to the next node: %s" % str(next_error))
+            if self.included(trx):
+                error = None
+            else:
+                try:
+                    self.broadcast(trx)
+                    error = None
+                except Exception as e:
+                    error = e
+            if error is not None and not self.rejected(error):
+                logger.warning("Transaction with %d ops failed: %s" % (len(batch), str(error)))
+                for op, callback in batch:
+                    self.results.put((callback, False, error))
+                return
+        if error is None:
+            for op, callback in batch:
+                self.results.put((callback, True, None))
+            return
+        if len(batch) == 1:
+            logger.warning("%s failed: %s" % (str(batch[0][0]), str(error)))
+            self.results.put((batch[0][1], False, error))
+            return
+        logger.warning("Transaction with %d ops was rejected, retrying them one by one: %s" % (len(batch),
+                                                                                            str(error)))
+        for op, callback in batch:
+            self.broadcast_batch([(op, callback)])
+
+    def send(self, batch):
+        self.broadcast_batch(batch)
+        for i in range(len(batch)):
+            self.queue.task_done()
+
+    def worker(self):
+        batch = []
+        batch_size = 0
+        flushed = 0
+        while True:
+            flush_requests = self.flush_requests
+            try:
+                op_type, args, callback = self.queue.get(timeout=0.5)
+                try:
+                    op = self.build_op(op_type, args)
+                    op_size = len(bytes(op))
+                    if len(batch) > 0 and batch_size + op_size > self.max_size:
+                        self.send(batch)
+                        batch = []
+                        batch_size = 0
+                    batch.append((op, callback))
+                    batch_size += op_size
+                except Exception as e:
+                    logger.warning("Could not build %s %s: %s" % (op_type, str(args[0]), str(e)))
+                    self.results.put((callback, False, e))
+                    self.queue.task_done()
+            except queue.Empty:
+                pass
+            flush = flush_requests > flushed and self.queue.empty()
+            if len(batch) >= self.max_ops or (flush and len(batch) > 0):
+                self.send(batch)
+                batch = []
+                batch_size = 0
+            if flush:
+                flushed = flush_requests
+
+    def process_results(self):
+        """Calls the callbacks of all finished broadcasts"""
+        while not self.results.empty():
+            callback, ok, error = self.results.get()
+            if callback is not None:
+                callback(ok)
+
+    def wait(self):
+        """Waits until all queued broadcasts are finished and processes their results"""
+        self.flush()
+        self.queue.join()
+        self.process_results()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+# days until the HP of a removed delegation returns to the delegator
+RETURN_DAYS = 5
+
+
+def delegation_size(acc, comment_rc_costs, hive_per_vests, min_post_rc, min_hp, max_hp, margin=0.2):
+    """ Returns the HP which covers the RC deficit of acc for min_post_rc comments
+
+        The deficit is (min_post_rc - rc_comments) comments, 1 VESTS gives
+        1e6 RC. margin is added on top, the result is kept between min_hp and max_hp.
+
+        :param AccountRecord acc: refreshed account
+        :param float comment_rc_costs: RC costs of one comment
+        :param float hive_per_vests: HIVE per VESTS
+    """
+    deficit_rc = max(min_post_rc - acc.rc_comments, 0) * comment_rc_costs
+    hp = deficit_rc / 1e6 * hive_per_vests * (1 + margin)
+    return min(max(hp, min_hp), max_hp)
+
+
+class CapacityPlanner(object):
+    """ Ledger of the committed and the available HP of the delegation account
+
+        The available HP is the undelegated HP of the delegation account,
+        which is set from the chain (own vesting shares minus all delegated
+        vesting shares, including removed delegations whose HP has not
+        returned yet), minus the queued delegations. Each grant lowers it
+        until it is set again.
+
+        The committed HP of the tracked accounts and their expiring
+        delegations, summed up per day, are updated when the delegation of
+        an account changes. Together with the returning HP of removed
+        delegations, which is set from the chain, they give the projection
+        of the available HP.
+
+        :param float grant_window_days: number of days over which the granted HP per day is measured
+    """
+    def __init__(self, grant_window_days=7):
+        self.grant_window_days = grant_window_days
+        self.undelegated_hp = None
+        # (epoch, HP) of removed delegations which return to the delegation account
+        self.returning = []
+        self.committed_hp = 0.
+        self.pending_hp = 0.
+        # account -> (delegated HP, expiry day or None)
+        self.committed = {}
+        # expiry day -> HP
+        self.expiring = {}
+        # (epoch, HP) of the recent grants
+        self.grants = deque()
+
+    def update(self, account, hp, expiry=None):
+        """Sets the active delegation of account, expiry is the epoch when it is removed, 0 HP removes it"""
+        old = self.committed.pop(account, None)
+        if old is not None:
+            self.committed_hp -= old[0]
+            if old[1] is not None:
+                self.expiring[old[1]] -= old[0]
+                if self.expiring[old[1]] <= 1e-9:
+                    del self.expiring[old[1]]
+        if hp <= 0:
+            return
+        day = None if expiry is None else int(expiry // DAY)
+        self.committed[account] = (hp, day)
+        self.committed_hp += hp
+        if day is not None:
+            self.expiring[day] = self.expiring.get(day, 0.) + hp
+
+    def reserve(self, hp):
+        """Counts a queued delegation until its broadcast has finished"""
+        self.pending_hp += hp
+
+    def release(self, hp):
+        self.pending_hp = max(self.pending_hp - hp, 0.)
+
+    def set_account(self, undelegated_hp, returning):
+        """Sets the undelegated HP and the (epoch, HP) of the returning delegations of the delegation account"""
+        self.undelegated_hp = undelegated_hp
+        self.returning = list(returning)
+
+    def record_grant(self, now, hp):
+        if self.undelegated_hp is not None:
+            self.undelegated_hp -= hp
+        self.grants.append((now, hp))
+        while len(self.grants) > 0 and self.grants[0][0] < now - self.grant_window_days * DAY:
+            self.grants.popleft()
+
+    @property
+    def available_hp(self):
+        """Own HP which is neither delegated nor queued, None while the undelegated HP is unknown"""
+        if self.undelegated_hp is None:
+            return None
+        return self.undelegated_hp - self.pending_hp
+
+    def returning_hp(self, now, days):
+        """Returns the HP which returns within days from removed and from expiring delegations"""
+        end = now + days * DAY
+        last_day = int((end - RETURN_DAYS * DAY) // DAY)
+        return sum(hp for timestamp, hp in self.returning if now < timestamp <= end) + \
+            sum(hp for day, hp in self.expiring.items() if day <= last_day)
+
+    def granted_hp_per_day(self, now):
+        start = now - self.grant_window_days * DAY
+        return sum(hp for timestamp, hp in self.grants if timestamp >= start) / self.grant_window_days
+
+    def projected_available_hp(self, now, days):
+        """Returns the available HP in days when the grants continue at the measured rate"""
+        if self.undelegated_hp is None:
+            return None
+        return self.available_hp + self.returning_hp(now, days) - self.granted_hp_per_day(now) * days
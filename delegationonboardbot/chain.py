@@ -0,0 +1,69 @@
+#!/usr/bin/python
+import logging
+from beem.amount import Amount
+from beem.rc import RC
+
+logger = logging.getLogger(__name__)
+
+
+class ChainParams(object):
+    """ Cache of the chain parameters which are needed on the op path
+
+        The vesting fund, the total vesting shares, the head block and the RC
+        costs of a comment are read once and refreshed when the head block
+        has moved by ttl_blocks blocks. HP/VESTS conversions are done
+        locally from the cached values.
+
+        :param Hive hive: Hive instance
+        :param int ttl_blocks: number of blocks after which the cache is refreshed
+    """
+    def __init__(self, hive, ttl_blocks=1200):
+        self.hive = hive
+        self.ttl_blocks = ttl_blocks
+        self.refresh_block_num = None
+        self.refresh()
+
+    @classmethod
+    def from_values(cls, total_vesting_fund_hive, total_vesting_shares, comment_rc_costs, head_block_num=0):
+        """Returns a cache with fixed values, which is never refreshed"""
+        params = cls.__new__(cls)
+        params.hive = None
+        params.ttl_blocks = None
+        params.total_vesting_fund_hive = total_vesting_fund_hive
+        params.total_vesting_shares = total_vesting_shares
+        params.comment_rc_costs = comment_rc_costs
+        params.head_block_num = head_block_num
+        params.refresh_block_num = head_block_num
+        return params
+
+    def refresh(self):
+        """Reads all parameters from the node"""
+        self.hive.refresh_data("dynamic_global_properties", force_refresh=True)
+        props = self.hive.get_dynamic_global_properties()
+        self.total_vesting_fund_hive = float(Amount(props["total_vesting_fund_hive"], blockchain_instance=self.hive))
+        self.total_vesting_shares = float(Amount(props["total_vesting_shares"], blockchain_instance=self.hive))
+        self.head_block_num = props["head_block_number"]
+        rc = RC(blockchain_instance=self.hive)
+        self.comment_rc_costs = rc.comment(tx_size=4000, permlink_length=40, parent_permlink_length=0)
+        self.refresh_block_num = self.head_block_num
+
+    def update(self, block_num):
+        """ Sets the head block and refreshes the cache when it is older than ttl_blocks
+
+            When the refresh fails, the old values are kept and the refresh
+            is retried on the next call.
+        """
+        if block_num > self.head_block_num:
+            self.head_block_num = block_num
+        if self.hive is None or self.head_block_num - self.refresh_block_num < self.ttl_blocks:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Could not refresh chain parameters: %s" % str(e))
+
+    def vests_to_hp(self, vests):
+        return float(vests) * self.total_vesting_fund_hive / self.total_vesting_shares
+
+    def hp_to_vests(self, hp):
+        return float(hp) * self.total_vesting_shares / self.total_vesting_fund_hive
@@ -1,28 +1,52 @@
 #!/usr/bin/python
 from beem import Hive
-from beem.comment import Comment
 from beem.account import Account
 from beem.amount import Amount
 from beem.blockchain import Blockchain
 from beem.nodelist import NodeList
-from beem.exceptions import ContentDoesNotExistsException
-from beem.utils import addTzInfo, resolve_authorperm, construct_authorperm, derive_permlink, formatTimeString
-from datetime import datetime, timedelta, date
-from beem.rc import RC
+from beem.utils import formatTimeString
+from datetime import datetime
 import time
-import shelve
-from prettytable import PrettyTable
 import json
 import logging
 import logging.config
 import argparse
+import atexit
 import os
+import signal
 import sys
-from delegationonboardbot.utils import print_block_log, check_config, store_data, read_data
+from delegationonboardbot.utils import print_block_log, check_config, get_current_rc_mana, get_beneficiaries, create_session
+from delegationonboardbot.store import StateStore
+from delegationonboardbot.broadcast import Broadcaster
+from delegationonboardbot.lookup import Lookups, fetch_accounts, fetch_beneficiaries, fetch_capacity
+from delegationonboardbot.stream import BlockStream, ParallelBlockStream
+from delegationonboardbot.index import ExpiryIndex
+from delegationonboardbot.record import AccountRecord, read_snapshot, write_snapshot, datetime_to_epoch
+from delegationonboardbot.chain import ChainParams
+from delegationonboardbot.nodes import NodePool
+from delegationonboardbot.profiling import start_profile, write_profile
+from delegationonboardbot.policy import evaluate_policy, PolicyColumns, REVOKE_LENGTH, REVOKE_MAX_HP, REVOKE_MUTED, REVOKE_BENEFICIARY
+from delegationonboardbot.metrics import Metrics, LabeledMetrics, MetricsServer, instrument_rpc
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.mutes import MuteTracker
+from delegationonboardbot.query import AccountQuery, QueryServer, print_accounts
+from delegationonboardbot.scheduler import BlockScheduler, Maintenance
+from delegationonboardbot.capacity import CapacityPlanner, delegation_size
+from delegationonboardbot.tenants import TenantGroup, tenant_configs, tenant_data_file
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# op types which are handled by DelegationOnboardBot.process_op
+OP_TYPES = ["comment", "comment_options", "vote", "transfer", "custom_json", "delegate_vesting_shares",
+            "create_claimed_account"]
+
+
+def exit_on_sigterm(signum, frame):
+    """Exits through SystemExit, so that the atexit handlers also run when the bot is terminated"""
+    sys.exit(128 + signum)
+
 
 def setup_logging(
     default_path='logging.json',
@@ -42,19 +66,44 @@ def setup_logging(
 
 
 class DelegationOnboardBot:
-    def __init__(self, config, data_file, hived_instance):
+    def __init__(self, config, data_file, hived_instance, broadcast_instance=None, fast_start=False, metrics=None,
+                 lookup_instance=None):
         self.config = config
         self.data_file = data_file
-        data_db = read_data(data_file)
-        if "accounts" in data_db:
-            accounts = data_db["accounts"]
-        else:
-            accounts = {}        
+        self.snapshot_file = os.path.join(os.path.dirname(data_file), "accounts.snapshot")
+        self.store = StateStore(data_file)
+        accounts = self.load_accounts()
+        # account changes and delegation broadcasts since the last checkpoint
+        self.journal = Journal(os.path.join(os.path.dirname(data_file), "journal.log"),
+                               sync_records=self.config.get("journal_sync_records", 1000))
+        self.dirty_accounts = set()
+        self.open_intents = {}
+        self.block_num = None
+        self.last_block_num = self.store.get("last_block_num")
+        self.recover(accounts)
+        self.last_block_num = self.store.get("last_block_num")
+        self.checkpoint_block_num = self.last_block_num
         self.hive = hived_instance
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.metrics.describe("blocks_total", "Processed blocks")
+        self.metrics.describe("ops_total", "Processed ops by op type")
+        self.metrics.describe("head_lag_blocks", "Blocks between the head block and the last processed block at the start of a run")
+        self.metrics.describe("rpc_latency_seconds", "RPC call latency by method")
+        self.metrics.describe("store_commit_seconds", "Commit latency of the sqlite store")
+        self.metrics.describe("broadcast_queue_depth", "Queued broadcasts")
+        self.metrics.describe("lookup_queue_depth", "Queued account and comment lookups")
+        self.metrics.describe("revocations_total", "Removed delegations by reason")
+        self.metrics.describe("committed_hp", "HP which is delegated to referred accounts")
+        self.metrics.describe("available_hp", "Undelegated HP of delegationAccount minus the queued delegations")
+        self.metrics.describe("projected_available_hp", "Available HP at the end of the capacity horizon")
+        self.store.metrics = self.metrics
+        self.op_handlers = dict((op_type, getattr(self, "handle_" + op_type)) for op_type in OP_TYPES)
         
         # add log stats
-        self.log_data = {"start_time": 0, "last_block_num": None, "new_commands": 0, "stop_block_num": 0,
-                         "stop_block_num": 0, "time_for_blocks": 0} 
+        self.log_data = {"start_time": 0, "last_block_num": None, "new_commands": 0, "start_block_num": 0,
+                         "stop_block_num": 0, "time_for_blocks": 0, "op_count": 0}
         config_cnt = 0
         necessary_fields = ["delegationAccount", "referrerAccount", "adminAccount", "delegationAmount", "delegationLength",
                             "beneficiaryRemoval", "minPostRC", "muteAccount", "hpWarning", "maxUserHP",
@@ -64,11 +113,28 @@ class DelegationOnboardBot:
         
         check_config(self.config, necessary_fields, self.hive)
         self.hive.wallet.unlock(self.config["wallet_password"])           
-        self.onboard_api = "https://hiveonboard.com/api/referrer/%s" % self.config["referrerAccount"]
-        self.blockchain = Blockchain(mode='head', blockchain_instance=self.hive)
-        self.muted_acc = Account(self.config["muteAccount"], blockchain_instance=self.hive)
-        self.delegation_acc = Account(self.config["delegationAccount"], blockchain_instance=self.hive)
-        self.muted_accounts = self.muted_acc.get_mutings(limit=1000)
+        self.onboard_api = self.config.get("onboardApi", "https://hiveonboard.com/api/referrer/%s") % self.config["referrerAccount"]
+        self.session = create_session()
+        self.catchup_stream = None
+        self.chain = None
+        self.broadcaster = None
+        self.lookups = None
+        self.set_hive(hived_instance, broadcast_instance, lookup_instance)
+        self.metrics.set_callback("broadcast_queue_depth", self.broadcaster.pending)
+        self.metrics.set_callback("lookup_queue_depth", self.lookups.pending)
+        self.pending_accounts = set()
+        # posts (author, permlink) -> block_num, whose beneficiaries were not checked yet
+        self.unresolved_posts = {}
+        # posts (author, permlink) whose beneficiaries are looked up right now
+        self.beneficiary_lookups = set()
+        # with fast_start, no delegation is changed before the background reconciliation has finished
+        self.ready = not fast_start
+        self.startup_future = None
+        self.startup_hive = None
+        self.deferred_grants = {}
+        self.deferred_removals = {}
+        self.mute_tracker = MuteTracker(self.store, self.config["muteAccount"])
+        self.add_maintenance_tasks()
 
         active_key = False
         for key in self.delegation_acc["active"]["key_auths"]:
@@ -80,104 +146,493 @@ class DelegationOnboardBot:
         if not active_key:
             logger.warn("Active key from %s is not stored into the beempy wallet." % self.delegation_acc["name"])
 
-        rc = RC(blockchain_instance=self.hive)
-        self.comment_rc_costs = rc.comment(tx_size=4000, permlink_length=40, parent_permlink_length=0)
-        self.accounts = self.get_referrer(accounts)
-        self.update_delegations()
-        self.check_muted(self.muted_accounts)
-        self.check_delegation_age()
-        self.check_max_hp()
+        self.chain = ChainParams(self.hive, ttl_blocks=self.config.get("chain_params_ttl", 1200))
+        if fast_start:
+            self.accounts = accounts
+            self.build_index()
+            logger.info("Fast start with %d accounts, reconciliation is done in the background" % len(self.accounts))
+        else:
+            self.accounts = self.get_referrer(accounts)
+            self.build_index()
+            self.reconcile()
+            self.print_account_info()
+            self.store.store_accounts(self.accounts)
+            self.checkpoint(self.last_block_num)
+
+    def load_accounts(self):
+        """ Loads the accounts from the snapshot file when it was written at the last checkpoint
+
+            Otherwise the accounts are read from the store.
+        """
+        last_block_num = self.store.get("last_block_num")
+        self.snapshot_valid = last_block_num is not None and self.store.get("snapshot_block_num") == last_block_num
+        if self.snapshot_valid:
+            try:
+                accounts = read_snapshot(self.snapshot_file)
+                logger.info("%d accounts were read from %s" % (len(accounts), self.snapshot_file))
+                return accounts
+            except (IOError, ValueError) as e:
+                logger.warning("Could not read %s: %s" % (self.snapshot_file, str(e)))
+        return self.store.load_accounts()
+
+    def save_snapshot(self, block_num):
+        """Checkpoints the state at block_num and writes all accounts into the snapshot file"""
+        self.checkpoint(block_num)
+        write_snapshot(self.snapshot_file, self.accounts)
+        self.store.set("snapshot_block_num", block_num)
+        self.snapshot_valid = True
+
+    def recover(self, accounts):
+        """ Applies the journal which was left by an unclean shutdown to accounts and the store
+
+            The journaled account records are applied in order, so that a
+            recovery which is interrupted and repeated gives the same state.
+            last_block_num is set to the last journaled block. Delegation
+            broadcasts without a result may or may not be on chain, they are
+            corrected by the next reconciliation.
+        """
+        records = self.journal.read()
+        if len(records) == 0:
+            return
+        changed = {}
+        last_block_num = None
+        for record in records:
+            if record["type"] == "account":
+                changed[record["account"]] = AccountRecord.unpack(bytes.fromhex(record["record"]))
+            elif record["type"] == "block":
+                last_block_num = record["block_num"]
+            elif record["type"] == "intent":
+                self.open_intents[record["account"]] = record
+            elif record["type"] == "result":
+                self.open_intents.pop(record["account"], None)
+        accounts.update(changed)
+        with self.store.transaction():
+            self.store.store_accounts(changed)
+            if last_block_num is not None and (self.last_block_num is None or last_block_num > self.last_block_num):
+                self.store.set("last_block_num", last_block_num)
+            # the snapshot does not contain the recovered changes
+            self.store.set("snapshot_block_num", None)
+        self.snapshot_valid = False
+        self.journal.reset(list(self.open_intents.values()))
+        logger.info("Recovered %d changed accounts up to block %s from %s" % (len(changed), str(last_block_num),
+                                                                             self.journal.journal_file))
+        for intent in self.open_intents.values():
+            logger.warning("Result of %s for %s is unknown, it is checked by the next reconciliation" % (
+                intent["op"], intent["account"]))
+
+    def save_account(self, account):
+        """Journals a changed account, it is written into the store at the next checkpoint"""
+        self.dirty_accounts.add(account)
+        self.journal.append({"type": "account", "block_num": self.block_num, "account": account,
+                             "record": self.accounts[account].pack().hex()})
+
+    def journal_intent(self, op, account):
+        """Journals a delegation broadcast before it is queued, the journal is synced right away"""
+        intent = {"type": "intent", "block_num": self.block_num, "op": op, "account": account}
+        self.open_intents[account] = intent
+        self.journal.append(intent)
+        self.journal.sync()
+
+    def journal_result(self, account, ok):
+        self.open_intents.pop(account, None)
+        self.journal.append({"type": "result", "block_num": self.block_num, "account": account, "ok": ok})
+
+    def journal_block(self, block_num):
+        """Marks all ops up to block_num as processed and syncs the journal"""
+        self.journal.append({"type": "block", "block_num": block_num})
+        self.journal.sync()
+
+    def checkpoint(self, block_num):
+        """ Writes the changed accounts and last_block_num into the store and compacts the journal
+
+            Only the broadcasts without a result are kept in the journal.
+        """
+        with self.store.transaction():
+            self.store.store_accounts(dict((account, self.accounts[account]) for account in self.dirty_accounts))
+            if block_num is not None:
+                self.store.set("last_block_num", block_num)
+        self.dirty_accounts = set()
+        self.journal.reset(list(self.open_intents.values()))
+        self.checkpoint_block_num = block_num
+
+    def invalidate_snapshot(self):
+        """Marks the snapshot as outdated before the first account is changed"""
+        if self.snapshot_valid:
+            self.store.set("snapshot_block_num", None)
+            self.snapshot_valid = False
+
+    def start_background_reconcile(self, hive_instance):
+        """ Fetches the referred accounts, the delegations and the mutings in a background thread
+
+            hive_instance must not be used by other threads. The results
+            are applied by finish_startup on the main thread.
+        """
+        self.startup_hive = hive_instance
+        self.startup_executor = ThreadPoolExecutor(max_workers=1)
+        self.startup_future = self.startup_executor.submit(self.fetch_startup_data,
+                                                           self.store.get("referrer_cursor", {"timestamp": 0, "offset": 0}),
+                                                           not self.mute_tracker.in_sync(self.last_block_num))
+
+    def fetch_startup_data(self, cursor, fetch_mutings):
+        items, cursor = self.try_fetch_referrer(cursor)
+        delegations = self.get_all_delegations(hive=self.startup_hive)
+        mutings = None
+        if fetch_mutings:
+            mutings = self.get_all_mutings(hive=self.startup_hive)
+        return items, cursor, delegations, mutings
+
+    def finish_startup(self):
+        """Applies the results of the background reconciliation when it is done"""
+        if self.ready or self.startup_future is None or not self.startup_future.done():
+            return
+        try:
+            items, cursor, delegations, mutings = self.startup_future.result()
+        except Exception as e:
+            logger.warning("Background reconciliation failed, it is retried within %d blocks: %s" % (
+                self.config.get("startup_retry_interval", 20), str(e)))
+            self.startup_executor.shutdown(wait=False)
+            self.startup_future = None
+            return
+        self.startup_executor.shutdown(wait=False)
+        self.startup_future = None
+        with self.store.transaction():
+            new_accounts = self.add_referred_accounts(self.accounts, items)
+            self.store.set("referrer_cursor", cursor)
+            for account in new_accounts:
+                self.save_account(account)
+                self.index_account(account)
+            self.ready = True
+            self.reconcile(delegations, mutings)
+            # decisions which were made while the reconciliation was running
+            grants, revokes = evaluate_policy(self.accounts, list(self.deferred_grants.keys()), self.config, self.now(),
+                                              self.policy_columns)
+            for account in grants:
+                timestamp, msg = self.deferred_grants[account]
+                self.add_delegation(account, timestamp, msg)
+            for account in self.deferred_removals:
+                acc = self.accounts[account]
+                if acc.delegated_hp > 0 and not acc.delegation_revoked:
+                    msg, reason = self.deferred_removals[account]
+                    self.remove_delegation(account, msg, reason)
+        logger.info("Background reconciliation finished, %d new accounts, %d deferred grants, %d deferred removals" % (
+            len(new_accounts), len(self.deferred_grants), len(self.deferred_removals)))
+        self.deferred_grants = {}
+        self.deferred_removals = {}
         self.print_account_info()
-        store_data(self.data_file, "accounts", self.accounts)
+
+    def retry_background_reconcile(self):
+        """Restarts the background reconciliation after it has failed"""
+        if self.ready or self.startup_future is not None or self.startup_hive is None:
+            return
+        logger.info("Restarting the background reconciliation")
+        self.start_background_reconcile(self.startup_hive)
+
+    def add_maintenance_tasks(self):
+        """Registers the checks which run_checks runs on their own block cadence"""
+        self.maintenance = Maintenance(self)
+        self.maintenance.add("retry_background_reconcile", self.config.get("startup_retry_interval", 20))
+        self.maintenance.add("check_delegation_age", self.config.get("expiry_check_interval", 20))
+        self.maintenance.add("check_max_hp", self.config.get("max_hp_check_interval", 20))
+        self.maintenance.add("check_for_sufficient_hp", self.config.get("hp_check_interval", 200))
+
+    def set_hive(self, hived_instance, broadcast_instance=None, lookup_instance=None):
+        """ Switches all components to new Hive instances
+
+            Is used when the node ranking changes, so that the bot does not
+            need to be restarted. Queued broadcasts and lookups are kept.
+        """
+        self.hive = hived_instance
+        instrument_rpc(self.hive, self.metrics)
+        self.blockchain = Blockchain(mode='head', blockchain_instance=self.hive)
+        self.block_stream = BlockStream(self.hive, OP_TYPES, batch_size=self.config.get("stream_batch_size", 50))
+        self.delegation_acc = Account(self.config["delegationAccount"], blockchain_instance=self.hive)
+        if self.chain is not None:
+            self.chain.hive = self.hive
+        # broadcasts are done in their own thread, which should use its own Hive instance
+        if broadcast_instance is None:
+            broadcast_instance = self.hive
+        instrument_rpc(broadcast_instance, self.metrics)
+        broadcast_acc = Account(self.config["delegationAccount"], blockchain_instance=broadcast_instance)
+        if self.broadcaster is None:
+            self.broadcaster = Broadcaster(broadcast_acc, self.config["wallet_password"],
+                                           queue_size=self.config.get("broadcast_queue_size", 1000),
+                                           max_ops=self.config.get("broadcast_max_ops", 50))
+        else:
+            self.broadcaster.set_account(broadcast_acc)
+        # account refreshes and comment lookups are done in their own thread, too
+        if lookup_instance is None:
+            lookup_instance = self.hive
+        instrument_rpc(lookup_instance, self.metrics)
+        if self.lookups is None:
+            self.lookups = Lookups(lookup_instance, queue_size=self.config.get("lookup_queue_size", 1000))
+        else:
+            self.lookups.set_hive(lookup_instance)
+
+    def now(self):
+        """Returns the current time as epoch seconds"""
+        return time.time()
 
     def print_account_info(self):
         revoked = 0
         delegated = 0
         delegated_hp = 0
         for acc in self.accounts:
-            if self.accounts[acc]["delegated_hp"] > 0:
+            if self.accounts[acc].delegated_hp > 0:
                 delegated += 1
-                delegated_hp += self.accounts[acc]["delegated_hp"]
-            if self.accounts[acc]["delegation_revoked"] > 0:
+                delegated_hp += self.accounts[acc].delegated_hp
+            if self.accounts[acc].delegation_revoked:
                 revoked += 1
         logger.info("%d accounts have been created with referrer %s" % (len(self.accounts), self.config["referrerAccount"]))
         logger.info("%d accounts have received a delegation (%.3f HP)" % (delegated, delegated_hp))
         logger.info("%d accounts have been revoked" % revoked)
 
-    def get_referrer(self, accounts):
-        limit = 20
-        offset = 0
-        last_result = []
-        cnt = 0
+    def get_referrer_page(self, offset, page_size):
+        r = self.session.get(self.onboard_api, params={"offset": offset, "limit": page_size}, timeout=30)
+        r.raise_for_status()
+        items = r.json()["items"]
+        if items is None:
+            return []
+        if not isinstance(items, list) or \
+                any(not isinstance(item, dict) or "account" not in item or "timestamp" not in item or "weight" not in item
+                    for item in items):
+            raise ValueError("Unexpected referrer page at offset %d" % offset)
+        return items
+
+    def fetch_referrer(self, cursor):
+        """ Fetches all referred accounts which are newer than cursor
+
+            The newest timestamp and the number of seen items are stored in
+            the returned cursor, so that only pages with new accounts are
+            fetched again. Returns (items, cursor).
+        """
+        page_size = self.config.get("referrer_page_size", 20)
+        cursor = dict(cursor)
         result = []
-        while last_result is not None and len(last_result) == limit or cnt == 0:
-            cnt += 1        
-            r = requests.get(self.onboard_api + '?offset=%d' % (offset))
-            if r.ok:
-                last_result = r.json()["items"]
-                if last_result is not None and len(last_result) > 0:
-                    result += last_result
-                    offset += limit
+        offset = 0
+        items = self.get_referrer_page(offset, page_size)
+        newest_first = len(items) < 2 or float(items[0]["timestamp"]) >= float(items[-1]["timestamp"])
+        if not newest_first and cursor["offset"] > len(items):
+            # oldest items come first, continue one page before the known end
+            offset = max(cursor["offset"] - page_size, 0)
+            items = self.get_referrer_page(offset, page_size)
+        while len(items) > 0:
+            result += items
+            offset += len(items)
+            if newest_first and float(items[-1]["timestamp"]) <= cursor["timestamp"]:
+                # all following items are known already
+                break
+            items = self.get_referrer_page(offset, page_size)
         for r in result:
+            cursor["timestamp"] = max(cursor["timestamp"], float(r["timestamp"]))
+        if not newest_first:
+            cursor["offset"] = max(cursor["offset"], offset)
+        return result, cursor
+
+    def add_referred_accounts(self, accounts, items):
+        """Adds the accounts of referrer items to accounts and returns the names of the new ones"""
+        new_accounts = []
+        for r in items:
             if r["account"] in accounts:
                 continue
-            accounts[r["account"]] = {"timestamp": None, "weight": None, "muted": False, "rc": 0, "hp": 0,
-                                      "delegated_hp": 0, "delegation_timestamp": None, "rc_comments": 0,
-                                      "delegation_revoked": False}
-            accounts[r["account"]]["timestamp"] = datetime.utcfromtimestamp(float(r["timestamp"]) / 1000.0)
-            accounts[r["account"]]["weight"] = r["weight"]
+            accounts[r["account"]] = AccountRecord(timestamp=datetime.utcfromtimestamp(float(r["timestamp"]) / 1000.0),
+                                                   weight=r["weight"])
+            new_accounts.append(r["account"])
+        return new_accounts
+
+    def try_fetch_referrer(self, cursor):
+        """ Returns fetch_referrer(cursor)
+
+            When the API cannot be reached or returns an unexpected response,
+            no items and the given cursor are returned, so that the cached
+            accounts are used until the next fetch.
+        """
+        try:
+            return self.fetch_referrer(cursor)
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.warning("Could not fetch referred accounts from %s: %s" % (self.onboard_api, str(e)))
+            return [], cursor
+
+    def get_referrer(self, accounts):
+        """Adds all accounts which were created with the referrer to accounts"""
+        items, cursor = self.try_fetch_referrer(self.store.get("referrer_cursor", {"timestamp": 0, "offset": 0}))
+        self.add_referred_accounts(accounts, items)
+        self.store.set("referrer_cursor", cursor)
         return accounts
 
-    def update_delegations(self):
-        delegations = self.delegation_acc.get_vesting_delegations(start_account='', limit=1000, account=None)
-        for d in delegations:
-            if d["delegatee"] in self.accounts:
-                self.accounts[d["delegatee"]]["delegated_hp"] = self.hive.vests_to_hp(float(Amount(d["vesting_shares"], blockchain_instance=self.hive)))
-                self.accounts[d["delegatee"]]["delegation_timestamp"] = formatTimeString(d["min_delegation_time"]).replace(tzinfo=None)
+    def get_all_delegations(self, page_size=1000, hive=None):
+        """Returns all vesting delegations of delegationAccount, paging through list_vesting_delegations"""
+        if hive is None:
+            hive = self.hive
+        delegator = self.config["delegationAccount"]
+        delegations = []
+        start_account = ""
+        while True:
+            page = hive.rpc.list_vesting_delegations({"start": [delegator, start_account], "limit": page_size,
+                                                           "order": "by_delegation"}, api="database")["delegations"]
+            page = [d for d in page if d["delegator"] == delegator]
+            if len(delegations) > 0 and len(page) > 0 and page[0]["delegatee"] == start_account:
+                # the start entry is included in the next page
+                page = page[1:]
+            delegations += page
+            if len(page) == 0 or len(page) < page_size - 1:
+                return delegations
+            start_account = page[-1]["delegatee"]
 
-    def check_max_hp(self):
-        if self.config["maxUserHP"] <= 0:
-            return
+    def get_all_mutings(self, page_size=1000, hive=None):
+        """Returns all accounts muted by muteAccount, paging through get_following"""
+        if hive is None:
+            hive = self.hive
+        mutings = []
+        start_account = ""
+        while True:
+            page = hive.rpc.get_following(self.config["muteAccount"], start_account, "ignore", page_size,
+                                               api="condenser")
+            if page is None:
+                return mutings
+            page = [f["following"] for f in page]
+            if len(mutings) > 0 and len(page) > 0 and page[0] == start_account:
+                page = page[1:]
+            mutings += page
+            if len(page) == 0 or len(page) < page_size - 1:
+                return mutings
+            start_account = page[-1]
+
+    def sync_mutes(self, muting_list=None):
+        """ Returns the accounts muted by muteAccount
+
+            The mute list is fetched only when the mute tracker has missed
+            blocks, otherwise its set is returned. A given muting_list
+            replaces the set of the mute tracker.
+        """
+        if muting_list is None and not self.mute_tracker.in_sync(self.last_block_num):
+            muting_list = self.get_all_mutings()
+        if muting_list is not None:
+            block_num = self.last_block_num
+            if block_num is None:
+                block_num = self.blockchain.get_current_block_num()
+            self.mute_tracker.resync(muting_list, block_num)
+            logger.info("Mute list of %s was fetched, %d muted accounts" % (self.config["muteAccount"], len(muting_list)))
+        return self.mute_tracker.muted
+
+    def reconcile(self, delegation_list=None, muting_list=None):
+        """ Compares the delegations and the mute list on chain with the local state
+
+            All differences are corrected in one pass and the changed
+            accounts are stored together. Delegations are fetched when they
+            are not given, the mute list only when the mute tracker has missed blocks.
+        """
+        if delegation_list is None:
+            delegation_list = self.get_all_delegations()
+        muting_list = self.sync_mutes(muting_list)
+        delegations = {}
+        for d in delegation_list:
+            delegations[d["delegatee"]] = d
+        mutings = set(muting_list)
+        changed = {}
+        newly_muted = []
         for account in self.accounts:
-            if self.accounts[account]["delegated_hp"] == 0:
-                continue
-            if self.accounts[account]["delegation_revoked"]:
+            if account in self.pending_accounts:
                 continue
-            if self.accounts[account]["hp"] > self.config["maxUserHP"]:
-                self.remove_delegation(account)
-                self.notify_account(account, self.config["delegationMaxMsg"])
+            acc = self.accounts[account]
+            if account in delegations:
+                d = delegations[account]
+                delegated_hp = self.chain.vests_to_hp(float(Amount(d["vesting_shares"], blockchain_instance=self.hive)))
+                if abs(acc.delegated_hp - delegated_hp) > 0.001 or acc.delegation_revoked or acc.delegation_epoch is None:
+                    acc.delegated_hp = delegated_hp
+                    acc.delegation_timestamp = formatTimeString(d["min_delegation_time"]).replace(tzinfo=None)
+                    acc.delegation_revoked = False
+                    changed[account] = acc
+            elif acc.delegated_hp > 0 and not acc.delegation_revoked:
+                acc.delegated_hp = 0
+                acc.delegation_revoked = True
+                changed[account] = acc
+            if account in mutings and not acc.muted:
+                newly_muted.append(account)
+            elif account not in mutings and acc.muted:
+                acc.muted = False
+                changed[account] = acc
+        with self.store.transaction():
+            for account in changed:
+                self.save_account(account)
+                self.index_account(account)
+            self.check_muted(newly_muted)
+        # broadcasts which were journaled before a crash are resolved by now
+        for account in list(self.open_intents):
+            if account not in self.pending_accounts:
+                self.journal_result(account, None)
+        logger.info("Reconciliation: %d delegations, %d muted accounts, %d accounts corrected, %d newly muted" % (
+            len(delegations), len(mutings), len(changed), len(newly_muted)))
+        self.sweep()
 
-    def check_delegation_age(self):
-        if self.config["delegationLength"] <= 0:
-            return
+    def sweep(self):
+        """Evaluates the revoke rules for all accounts at once and removes the delegations"""
+        revoke_msgs = {REVOKE_LENGTH: self.config["delegationLengthMsg"], REVOKE_MAX_HP: self.config["delegationMaxMsg"],
+                       REVOKE_MUTED: self.config["delegationMuteMsg"]}
+        grants, revokes = evaluate_policy(self.accounts, None, self.config, self.now(), self.policy_columns)
+        for account in revokes:
+            self.remove_delegation(account, revoke_msgs[revokes[account]], revokes[account])
+        logger.info("Sweep: %d of %d accounts need a delegation removal" % (len(revokes), len(self.accounts)))
+
+    def index_account(self, account):
+        """Updates the delegation expiry index, the max HP bucket, the capacity ledger and the policy columns for an account"""
+        acc = self.accounts[account]
+        self.policy_columns.update(account, acc)
+        active = acc.delegated_hp > 0 and not acc.delegation_revoked
+        expiry = None
+        if active and self.config["delegationLength"] > 0 and acc.delegation_epoch is not None:
+            expiry = acc.delegation_epoch + self.config["delegationLength"] * 24 * 60 * 60
+            self.expiry_index.update(account, expiry)
+        else:
+            self.expiry_index.remove(account)
+        self.planner.update(account, acc.delegated_hp if active else 0, expiry)
+        if active and self.config["maxUserHP"] > 0 and acc.hp > self.config["maxUserHP"]:
+            self.over_max_hp.add(account)
+        else:
+            self.over_max_hp.discard(account)
+
+    def build_index(self):
+        self.expiry_index = ExpiryIndex()
+        self.over_max_hp = set()
+        self.planner = CapacityPlanner()
+        self.policy_columns = PolicyColumns(max(len(self.accounts), 1024))
         for account in self.accounts:
-            if self.accounts[account]["delegated_hp"] == 0:
-                continue
-            if self.accounts[account]["delegation_revoked"]:
-                continue
-            if (datetime.utcnow() - self.accounts[account]["delegation_timestamp"]).total_seconds() / 60 / 60 / 24 > self.config["delegationLength"]:
-                self.remove_delegation(account)
-                self.notify_account(account, self.config["delegationLengthMsg"])
+            self.index_account(account)
+
+    def check_max_hp(self):
+        """Removes delegations from all accounts in the max HP bucket"""
+        for account in list(self.over_max_hp):
+            self.over_max_hp.discard(account)
+            self.remove_delegation(account, self.config["delegationMaxMsg"], REVOKE_MAX_HP)
+
+    def check_delegation_age(self):
+        """Removes all delegations whose delegationLength has expired"""
+        for account in self.expiry_index.pop_due(self.now()):
+            self.remove_delegation(account, self.config["delegationLengthMsg"], REVOKE_LENGTH)
 
     def check_muted(self, muted_accounts):
         for acc in muted_accounts:
             if acc not in self.accounts:
                 continue
-            if not self.accounts[acc]["muted"]:
-                self.accounts[acc]["muted"] = True
-                store_data(self.data_file, "accounts", self.accounts)
-                if self.accounts[acc]["delegated_hp"] > 0 and not self.accounts[acc]["delegation_revoked"]:
-                    self.remove_delegation(acc)
-                    self.notify_account(acc, self.config["delegationMuteMsg"])
+            if not self.accounts[acc].muted:
+                self.accounts[acc].muted = True
+                self.save_account(acc)
+                self.index_account(acc)
+                if self.accounts[acc].delegated_hp > 0 and not self.accounts[acc].delegation_revoked:
+                    self.remove_delegation(acc, self.config["delegationMuteMsg"], REVOKE_MUTED)
+
+    def check_unmuted(self, unmuted_accounts):
+        for acc in unmuted_accounts:
+            if acc in self.accounts and self.accounts[acc].muted:
+                self.accounts[acc].muted = False
+                self.save_account(acc)
+                self.index_account(acc)
 
     def notify_admin(self, msg):
         if self.config["no_broadcast"]:
             logger.info("no_broadcast=True, Would send to %s the following message: %s" % (self.config["adminAccount"], msg))
             return
-        if self.delegation_acc.blockchain.wallet.locked():
-            self.delegation_acc.blockchain.wallet.unlock(self.config["wallet_password"])
         logger.info("Send to %s the following message: %s" % (self.config["adminAccount"], msg))
-        self.delegation_acc.transfer(self.config["adminAccount"], 0.001, "HIVE", memo=msg)
+        self.broadcaster.transfer(self.config["adminAccount"], 0.001, "HIVE", msg)
 
     def notify_account(self, account, msg):
         if not self.config["notifyUser"]:
@@ -186,208 +641,433 @@ class DelegationOnboardBot:
         if self.config["no_broadcast"]:
             logger.info("no_broadcast=True, Would send to %s the following message: %s" % (account, msg))
             return
-        if self.delegation_acc.blockchain.wallet.locked():
-            self.delegation_acc.blockchain.wallet.unlock(self.config["wallet_password"])        
         logger.info("Send to %s the following message: %s" % (account, msg))
-        self.delegation_acc.transfer(account, 0.001, "HIVE", memo=msg)
+        self.broadcaster.transfer(account, 0.001, "HIVE", msg)
 
-    def check_account_on_activity(self, account, timestamp):
-        if account not in self.accounts:
-            return
-        acc = Account(account, blockchain_instance=self.hive)
-        self.accounts[account]["rc"] = acc.get_rc_manabar()["current_mana"]
-        self.accounts[account]["hp"] = acc.get_token_power(only_own_vests=True)
-        self.accounts[account]["rc_comments"] = self.accounts[account]["rc"] / self.comment_rc_costs
-        store_data(self.data_file, "accounts", self.accounts)
-        if self.accounts[account]["delegated_hp"] > 0:
-            return
-        if self.accounts[account]["delegation_revoked"]:
-            return
-        if self.accounts[account]["hp"] > self.config["maxUserHP"]:
-            return
-        if self.accounts[account]["rc_comments"] < self.config["minPostRC"]:
-            ok = self.add_delegation(account, timestamp)
-            if ok:
-                self.notify_account(account, self.config["delegationMsg"])
+    def refresh_accounts(self, account_names, callback=None, batch_size=1000):
+        """ Updates rc, hp and rc_comments of the given accounts in the background
 
-    def check_beneficiaries(self, author, permlink):
-        if author not in self.accounts:
-            return
-        if self.accounts[author]["delegated_hp"] == 0:
+            The accounts are fetched by the lookup thread, see fetch_accounts.
+            The results are applied on the bot thread, callback is called
+            afterwards with the names of the refreshed accounts.
+        """
+        account_names = [account for account in account_names if account in self.accounts]
+        if len(account_names) == 0:
             return
-        if self.accounts[author]["delegation_revoked"]:
+        self.lookups.submit(fetch_accounts, (account_names, batch_size),
+                            lambda result, error: self.on_accounts_fetched(account_names, result, error, callback))
+
+    def on_accounts_fetched(self, account_names, result, error, callback=None):
+        if error is not None:
+            # the accounts are refreshed again with their next activity
+            logger.warning("Could not refresh %d accounts: %s" % (len(account_names), str(error)))
             return
+        accounts, rc_accounts = result
+        for acc in accounts:
+            vests = float(Amount(acc["vesting_shares"], blockchain_instance=self.hive))
+            self.accounts[acc["name"]].hp = self.chain.vests_to_hp(vests)
+        for rc_acc in rc_accounts:
+            self.accounts[rc_acc["account"]].rc = get_current_rc_mana(rc_acc)
+        for account in account_names:
+            self.accounts[account].rc_comments = self.accounts[account].rc / self.chain.comment_rc_costs
+            self.save_account(account)
+            self.index_account(account)
+        if callback is not None:
+            callback(account_names)
+
+    def needs_beneficiary_check(self, author):
         if not self.config["beneficiaryRemoval"]:
+            return False
+        if author not in self.accounts:
+            return False
+        if self.accounts[author].delegated_hp == 0:
+            return False
+        if self.accounts[author].delegation_revoked:
+            return False
+        return True
+
+    def check_beneficiaries(self, author, beneficiaries):
+        if not self.needs_beneficiary_check(author):
             return
-        comment = None
-        cnt = 0
-        while comment is None and cnt < 10:
-            cnt += 1
-            try:
-                comment = Comment(construct_authorperm(author, permlink), blockchain_instance=self.hive)
-            except:
-                comment = None
-                time.sleep(3)
         referrer_ok = False
-        for bene in comment["beneficiaries"]:
-            if bene["account"] == self.config["referrerAccount"] and bene["weight"] == self.accounts[author]["weight"]:
+        for bene in beneficiaries:
+            if bene["account"] == self.config["referrerAccount"] and bene["weight"] == self.accounts[author].weight:
                 referrer_ok = True
         if not referrer_ok:
-            self.remove_delegation(author)
-            self.notify_account(author, self.config["delegationBeneficiaryMsg"])
+            self.remove_delegation(author, self.config["delegationBeneficiaryMsg"], REVOKE_BENEFICIARY)
+
+    def queue_unresolved_posts(self):
+        """Posts without a comment_options op in the streamed blocks are looked up later"""
+        next_try = self.now() + self.config.get("beneficiary_retry_delay", 30)
+        for author, permlink in self.unresolved_posts:
+            self.store.queue_beneficiary_check(author, permlink, next_try)
+        self.unresolved_posts = {}
+
+    def process_beneficiary_queue(self):
+        """ Queues the lookup of the beneficiaries of the queued posts which are due
+
+            The posts are fetched by the lookup thread, each one only once at
+            a time. The results are applied by on_beneficiaries_fetched.
+        """
+        for author, permlink, attempts in self.store.get_due_beneficiary_checks(self.now()):
+            if (author, permlink) in self.beneficiary_lookups:
+                continue
+            if not self.needs_beneficiary_check(author):
+                self.store.remove_beneficiary_check(author, permlink)
+                continue
+            self.beneficiary_lookups.add((author, permlink))
+            self.lookups.submit(fetch_beneficiaries, (author, permlink),
+                                lambda result, error, author=author, permlink=permlink, attempts=attempts:
+                                self.on_beneficiaries_fetched(author, permlink, attempts, result, error))
+
+    def on_beneficiaries_fetched(self, author, permlink, attempts, beneficiaries, error):
+        """Checks the fetched beneficiaries, failed lookups are retried with an exponential backoff"""
+        self.beneficiary_lookups.discard((author, permlink))
+        if error is not None:
+            attempts += 1
+            if attempts >= self.config.get("beneficiary_max_attempts", 10):
+                logger.warning("Could not check beneficiaries of @%s/%s: %s" % (author, permlink, str(error)))
+                self.store.remove_beneficiary_check(author, permlink)
+            else:
+                retry_delay = self.config.get("beneficiary_retry_delay", 30)
+                self.store.queue_beneficiary_check(author, permlink, self.now() + retry_delay * 2 ** attempts, attempts)
+            return
+        self.store.remove_beneficiary_check(author, permlink)
+        self.check_beneficiaries(author, beneficiaries)
 
     def check_for_sufficient_hp(self):
-        data_db = read_data(self.data_file)
-        if "hp_warning_send" in data_db:
-            hp_warning_send = data_db["hp_warning_send"]
-        else:
-            hp_warning_send = False
-        hp = self.delegation_acc.get_token_power(only_own_vests=True)
-        if hp_warning_send and hp > self.config["hpWarning"]:
+        """ Warns adminAccount when the available HP of delegationAccount is or will be below hpWarning
+
+            The undelegated HP and the returning HP of removed delegations are
+            read from the node by the lookup thread, the expiring delegations
+            come from the capacity ledger. The projection covers
+            capacity_horizon_days.
+        """
+        self.lookups.submit(fetch_capacity, (self.config["delegationAccount"], ), self.on_capacity_fetched)
+
+    def on_capacity_fetched(self, result, error):
+        if error is not None:
+            # the last known capacity is kept until the next check
+            logger.warning("Could not fetch the HP of %s: %s" % (self.config["delegationAccount"], str(error)))
+            return
+        acc, expirations = result
+        vests = float(Amount(acc["vesting_shares"], blockchain_instance=self.hive)) - \
+            float(Amount(acc["delegated_vesting_shares"], blockchain_instance=self.hive))
+        returning = [(datetime_to_epoch(formatTimeString(e["expiration"])),
+                      self.chain.vests_to_hp(float(Amount(e["vesting_shares"], blockchain_instance=self.hive))))
+                     for e in expirations]
+        self.planner.set_account(self.chain.vests_to_hp(vests), returning)
+        horizon = self.config.get("capacity_horizon_days", 7)
+        available = self.planner.available_hp
+        projected = self.planner.projected_available_hp(self.now(), horizon)
+        self.metrics.set("committed_hp", self.planner.committed_hp)
+        self.metrics.set("available_hp", available)
+        self.metrics.set("projected_available_hp", projected)
+        hp_warning_send = self.store.get("hp_warning_send", False)
+        low = min(available, projected) < self.config["hpWarning"]
+        if hp_warning_send and not low:
             hp_warning_send = False
-        elif not hp_warning_send and hp < self.config["hpWarning"]:
+        elif not hp_warning_send and low:
             if not self.config["no_broadcast"]:
                 hp_warning_send = True
-            self.notify_admin("Warning: HIVE POWER of @%s is below %.3f HP" % (self.config["delegationAccount"], self.config["hpWarning"]))
-        store_data(self.data_file, "hp_warning_send", hp_warning_send)
+            if available < self.config["hpWarning"]:
+                self.notify_admin("Warning: available HIVE POWER of @%s is %.3f HP, below %.3f HP" % (
+                    self.config["delegationAccount"], available, self.config["hpWarning"]))
+            else:
+                self.notify_admin("Warning: available HIVE POWER of @%s will drop to %.3f HP within %d days, below %.3f HP" % (
+                    self.config["delegationAccount"], projected, horizon, self.config["hpWarning"]))
+        self.store.set("hp_warning_send", hp_warning_send)
 
-    def remove_delegation(self, account):
-        
+    def delegation_hp(self, account):
+        """Returns delegationAmount or, with rc_sizing, the HP which covers the RC deficit of account"""
+        if not self.config.get("rc_sizing", False):
+            return self.config["delegationAmount"]
+        return delegation_size(self.accounts[account], self.chain.comment_rc_costs, self.chain.vests_to_hp(1),
+                               self.config["minPostRC"], self.config.get("min_delegation_amount", 1),
+                               self.config["delegationAmount"], self.config.get("rc_sizing_margin", 0.2))
+
+    def remove_delegation(self, account, msg=None, reason=None):
+        """ Queues the removal of the delegation to account
+
+            msg is sent to the account after the delegation was removed,
+            reason is one of the REVOKE_* values from policy.
+            Returns False when nothing was queued.
+        """
+        if account in self.pending_accounts:
+            return False
+        if not self.ready:
+            self.deferred_removals[account] = (msg, reason)
+            return False
         if self.config["no_broadcast"]:
             logger.info("no_broadcast = True, Would remove delegation from %s" % (account))
+            if msg is not None:
+                self.notify_account(account, msg)
             return False
-        if self.delegation_acc.blockchain.wallet.locked():
-            self.delegation_acc.blockchain.wallet.unlock(self.config["wallet_password"])        
         logger.info("remove delegation from %s" % (account))
-        try:
-            self.delegation_acc.delegate_vesting_shares(account, 0)
-        except Exception as e:
-            logger.warn(str(e))
-            self.notify_admin("Could not undelegate HP from %s" % (account))
-            return False
-        self.accounts[account]["delegation_revoked"] = True
-        store_data(self.data_file, "accounts", self.accounts)
+        self.pending_accounts.add(account)
+        self.journal_intent("remove_delegation", account)
+        self.broadcaster.delegate(account, 0, lambda ok: self.on_delegation_removed(account, ok, msg, reason))
         return True
 
-    def add_delegation(self, account, timestamp):
+    def on_delegation_removed(self, account, ok, msg, reason=None):
+        self.pending_accounts.discard(account)
+        self.journal_result(account, ok)
+        if not ok:
+            self.metrics.inc("broadcast_failures_total", labels=(("op", "remove_delegation"), ))
+            self.notify_admin("Could not undelegate HP from %s" % (account))
+            # the next sweep retries the removal
+            self.index_account(account)
+            return
+        self.metrics.inc("revocations_total", labels=(("reason", reason or "unknown"), ))
+        self.store.store_revocation(account, reason or "unknown", self.now())
+        self.accounts[account].delegation_revoked = True
+        self.save_account(account)
+        self.index_account(account)
+        if msg is not None:
+            self.notify_account(account, msg)
+
+    def add_delegation(self, account, timestamp, msg=None):
+        """ Queues a delegation to account, see delegation_hp for its size
+
+            msg is sent to the account after the delegation was broadcasted.
+            Returns False when nothing was queued, also when the available
+            HP of delegationAccount is not sufficient.
+        """
+        if account in self.pending_accounts:
+            return False
+        if not self.ready:
+            self.deferred_grants[account] = (timestamp, msg)
+            return False
+        hp = self.delegation_hp(account)
         if self.config["no_broadcast"]:
-            logger.info("no_broadcast = True, Would add delegation of %.2f HP to %s" % (self.config["delegationAmount"], account))
+            logger.info("no_broadcast = True, Would add delegation of %.2f HP to %s" % (hp, account))
             return False
-        if self.delegation_acc.blockchain.wallet.locked():
-            self.delegation_acc.blockchain.wallet.unlock(self.config["wallet_password"])        
-        logger.info("add delegation of %.2f HP to %s" % (self.config["delegationAmount"], account))
-        try:
-            self.delegation_acc.delegate_vesting_shares(account, self.hive.hp_to_vests(self.config["delegationAmount"]))
-        except Exception as e:
-            logger.warn(str(e))
-            self.notify_admin("Could not delegate %.2f HP to %s" % (self.config["delegationAmount"], account))
+        available = self.planner.available_hp
+        if available is not None and available < hp:
+            logger.warning("Only %.3f HP are available, the delegation of %.2f HP to %s is not added" % (available, hp, account))
             return False
-        self.accounts[account]["delegated_hp"] = self.config["delegationAmount"]
-        self.accounts[account]["delegation_timestamp"] = timestamp
-        self.accounts[account]["delegation_revoked"] = False
-        store_data(self.data_file, "accounts", self.accounts)
+        logger.info("add delegation of %.2f HP to %s" % (hp, account))
+        self.pending_accounts.add(account)
+        self.planner.reserve(hp)
+        self.journal_intent("add_delegation", account)
+        self.broadcaster.delegate(account, self.chain.hp_to_vests(hp),
+                                  lambda ok: self.on_delegation_added(account, timestamp, ok, msg, hp))
         return True
 
-    def run(self, start_block, stop_block):
+    def on_delegation_added(self, account, timestamp, ok, msg, hp=None):
+        if hp is None:
+            hp = self.config["delegationAmount"]
+        self.pending_accounts.discard(account)
+        self.planner.release(hp)
+        self.journal_result(account, ok)
+        if not ok:
+            self.metrics.inc("broadcast_failures_total", labels=(("op", "add_delegation"), ))
+            self.notify_admin("Could not delegate %.2f HP to %s" % (hp, account))
+            return
+        self.metrics.inc("delegations_total")
+        self.planner.record_grant(self.now(), hp)
+        self.accounts[account].delegated_hp = hp
+        self.accounts[account].delegation_timestamp = timestamp
+        self.accounts[account].delegation_revoked = False
+        self.save_account(account)
+        self.index_account(account)
+        if msg is not None:
+            self.notify_account(account, msg)
+
+    def enable_catchup(self, hive_instances):
+        """Fetches the blocks of catch-up ranges concurrently with the given Hive instances"""
+        for hive in hive_instances:
+            instrument_rpc(hive, self.metrics)
+        self.catchup_stream = ParallelBlockStream(hive_instances, OP_TYPES,
+                                                  batch_size=self.config.get("stream_batch_size", 50))
+
+    def prepare_run(self, current_block):
+        """Unlocks the wallet and updates the chain parameters, returns False when the wallet stays locked"""
         if self.hive.wallet.locked():
             self.hive.wallet.unlock(self.config["wallet_password"])
         if self.hive.wallet.locked():
             logger.error("Could not unlock wallet. Please check wallet_passowrd in config")
+            return False
+        self.chain.update(current_block)
+        return True
+
+    def run(self, start_block, stop_block, catchup=False, head_block_num=None):
+        """Processes the blocks from start_block to stop_block, head_block_num is fetched when it is not given"""
+        if head_block_num is None:
+            head_block_num = self.blockchain.get_current_block_num()
+        current_block = head_block_num
+        if not self.prepare_run(current_block):
             return
-                
-        current_block = self.blockchain.get_current_block_num()
         if stop_block is None or stop_block > current_block:
             stop_block = current_block
         
         if start_block is None:
             start_block = current_block
-            last_block_num = current_block - 1
+        self.metrics.set("head_block_num", current_block)
+        self.metrics.set("head_lag_blocks", current_block - start_block + 1)
+        if catchup and self.catchup_stream is not None:
+            block_stream = self.catchup_stream
         else:
-            last_block_num = start_block - 1
+            block_stream = self.block_stream
         
-        self.check_delegation_age()
-        self.check_max_hp()
-        self.check_for_sufficient_hp()
-        store_data(self.data_file, "accounts", self.accounts)        
+        self.run_checks()
 
         self.log_data["start_block_num"] = start_block
-        for op in self.blockchain.stream(start=start_block, stop=stop_block):
-            self.log_data = print_block_log(self.log_data, op, self.config["print_log_at_block"])
-            last_block_num = op["block_num"]
-            timestamp = op["timestamp"].replace(tzinfo=None)
-            
-            if op["type"] == "comment":
-                account = op["author"]
-                if account not in list(self.accounts.keys()):
-                    continue
-                self.check_account_on_activity(account, timestamp)
-                if op["parent_author"] == "":
-                    self.check_beneficiaries(op["author"], op["permlink"])
-            elif op["type"] == "vote":
-                account = op["voter"]
-                if account not in list(self.accounts.keys()):
-                    continue                
-                self.check_account_on_activity(account, timestamp)
-            elif op["type"] == "transfer":
-                account = op["from"]
-                if account not in list(self.accounts.keys()):
-                    continue                
-                self.check_account_on_activity(account, timestamp)
-            elif op["type"] == "custom_json":
-
-                if len(op["required_posting_auths"]) > 0:
-                    account = op["required_posting_auths"][0]
-                elif len(op["required_auths"]) > 0:
-                    account = op["required_auths"][0]
-                if op["id"] == "follow":
-                    if op["json"] == "":
-                        continue
-                    json_data = json.loads(op["json"])
-                    if "what" not in json_data:
-                        continue
-                    if len(json_data["what"]) == 0:
-                        continue
-                    if json_data["what"][0] != "ignore":
-                        continue
-                    if account == self.config["muteAccount"] and json_data["following"] in self.accounts:
-                        self.check_muted([json_data["following"]])
-                        
-                if account not in list(self.accounts.keys()):
-                    continue
-                
-                self.check_account_on_activity(account, timestamp)
-            elif op["type"] == "delegate_vesting_shares":
-                if op["delegator"] != self.config["delegationAccount"]:
-                    continue
-                account = op["delegatee"]
-                if account not in list(self.accounts.keys()):
-                    continue
-                delegated_hp = self.hive.vests_to_hp(float(Amount(op["vesting_shares"], blockchain_instance=self.hive)))
-                self.accounts[account]["delegated_hp"] = delegated_hp
-                self.accounts[account]["delegation_timestamp"] = timestamp
-                if delegated_hp > 0 and self.accounts[account]["delegation_revoked"]:
-                    self.accounts[account]["delegation_revoked"] = False
-                elif delegated_hp == 0 and not self.accounts[account]["delegation_revoked"]:
-                    self.accounts[account]["delegation_revoked"] = True
-                store_data(self.data_file, "accounts", self.accounts)
-
-            elif op["type"] == "create_claimed_account":
-                if op["json_metadata"] == "":
-                    continue
-                meta_data = json.loads(op["json_metadata"])
-                if "beneficiaries" not in meta_data:
-                    continue
-                for entry in meta_data["beneficiaries"]:
-                    if entry["label"] == "referrer" and entry["name"] == self.config["referrerAccount"]:
-                        self.accounts[op["new_account_name"]] = {"timestamp": None, "weight": None, "muted": False, "rc": 0, "hp": 0,
-                                                                 "delegated_hp": 0, "delegation_timestamp": None, "rc_comments": 0,
-                                                                 "delegation_revoked": False}
-                        self.accounts[op["new_account_name"]]["weight"] = entry["weight"]
-                        self.accounts[op["new_account_name"]]["timestamp"] = op["timestamp"].replace(tzinfo=None)
-                        store_data(self.data_file, "accounts", self.accounts)
-                            
+        self.log_data["stop_block_num"] = stop_block
+        with self.store.transaction():
+            active_accounts = {}
+            last_block_num = self.process_stream(block_stream, start_block, stop_block, active_accounts)
+            self.process_active_accounts(active_accounts)
+        self.finish_run(last_block_num)
         return last_block_num
 
+    def finish_run(self, last_block_num):
+        """Journals the end of a block range, checkpoints when it is due and broadcasts the queued ops"""
+        if last_block_num is not None and (self.last_block_num is None or last_block_num > self.last_block_num):
+            self.last_block_num = last_block_num
+            self.mute_tracker.checkpoint(last_block_num)
+            self.journal_block(last_block_num)
+            if self.checkpoint_block_num is None or last_block_num - self.checkpoint_block_num >= self.config.get("checkpoint_interval", 20):
+                self.checkpoint(last_block_num)
+        self.broadcaster.flush()
+
+    def close(self):
+        self.journal.close()
+
+    def run_checks(self):
+        """Handles finished broadcasts and lookups and runs the due maintenance checks before a block range is streamed"""
+        self.invalidate_snapshot()
+        self.finish_startup()
+        self.process_results()
+        self.maintenance.run_due(self.last_block_num)
+
+    def process_results(self):
+        """Calls the callbacks of the finished broadcasts and lookups"""
+        self.broadcaster.process_results()
+        self.lookups.process_results()
+
+    def process_active_accounts(self, active_accounts):
+        """ Checks beneficiaries and queues the refresh of the active accounts after a block range was streamed
+
+            Delegations are added by grant_delegations when the refresh is done.
+        """
+        self.queue_unresolved_posts()
+        self.process_beneficiary_queue()
+        # every active account is refreshed only once per block range
+        timestamps = dict((account, active_accounts[account]) for account in active_accounts if account in self.accounts)
+        self.refresh_accounts(list(timestamps.keys()), lambda names: self.grant_delegations(names, timestamps))
+
+    def grant_delegations(self, account_names, timestamps):
+        """Adds delegations to the refreshed accounts which need one, timestamps are their last activities"""
+        grants, revokes = evaluate_policy(self.accounts, account_names, self.config, self.now(), self.policy_columns)
+        for account in grants:
+            self.add_delegation(account, timestamps[account], self.config["delegationMsg"])
+
+    def process_stream(self, block_stream, start_block, stop_block, active_accounts):
+        """Processes all ops of a block range and returns the last processed block number"""
+        flush_blocks = self.config.get("broadcast_flush_blocks", 10)
+        flush_block_num = start_block + flush_blocks
+        # counted locally and added to the metrics once per block range
+        op_counts = {}
+        for op in block_stream.stream(start_block, stop_block):
+            self.log_data = print_block_log(self.log_data, op, self.config["print_log_at_block"])
+            if op["block_num"] >= flush_block_num:
+                self.journal.sync()
+                self.broadcaster.flush()
+                flush_block_num = op["block_num"] + flush_blocks
+            self.block_num = op["block_num"]
+            self.process_results()
+            self.process_op(op, active_accounts)
+            op_counts[op["type"]] = op_counts.get(op["type"], 0) + 1
+        for op_type in op_counts:
+            self.metrics.inc("ops_total", op_counts[op_type], labels=(("type", op_type), ))
+        if block_stream.last_block_num is not None and block_stream.last_block_num >= start_block:
+            self.metrics.inc("blocks_total", block_stream.last_block_num - start_block + 1)
+            self.metrics.set("last_block_num", block_stream.last_block_num)
+        return block_stream.last_block_num
+
+    def process_op(self, op, active_accounts):
+        """ Dispatches a streamed op to its handler
+
+            Active tracked accounts are collected in active_accounts
+            (account name -> timestamp of the last activity).
+        """
+        handler = self.op_handlers.get(op["type"])
+        if handler is not None:
+            handler(op, active_accounts)
+
+    def handle_comment(self, op, active_accounts):
+        account = op["author"]
+        if account not in self.accounts:
+            return
+        active_accounts[account] = op["timestamp"].replace(tzinfo=None)
+        if op["parent_author"] == "" and self.needs_beneficiary_check(account):
+            # resolved by a comment_options op of the same block range, or looked up later
+            self.unresolved_posts[(account, op["permlink"])] = op["block_num"]
+
+    def handle_comment_options(self, op, active_accounts):
+        if (op["author"], op["permlink"]) not in self.unresolved_posts:
+            return
+        del self.unresolved_posts[(op["author"], op["permlink"])]
+        self.check_beneficiaries(op["author"], get_beneficiaries(op["extensions"]))
+
+    def handle_vote(self, op, active_accounts):
+        if op["voter"] in self.accounts:
+            active_accounts[op["voter"]] = op["timestamp"].replace(tzinfo=None)
+
+    def handle_transfer(self, op, active_accounts):
+        if op["from"] in self.accounts:
+            active_accounts[op["from"]] = op["timestamp"].replace(tzinfo=None)
+
+    def handle_custom_json(self, op, active_accounts):
+        if len(op["required_posting_auths"]) > 0:
+            account = op["required_posting_auths"][0]
+        elif len(op["required_auths"]) > 0:
+            account = op["required_auths"][0]
+        else:
+            return
+        if account == self.config["muteAccount"] and op["id"] == "follow":
+            muted, unmuted = self.mute_tracker.process_op(op)
+            self.check_muted(muted)
+            self.check_unmuted(unmuted)
+        if account in self.accounts:
+            active_accounts[account] = op["timestamp"].replace(tzinfo=None)
+
+    def handle_delegate_vesting_shares(self, op, active_accounts):
+        if op["delegator"] != self.config["delegationAccount"]:
+            return
+        account = op["delegatee"]
+        if account not in self.accounts:
+            return
+        delegated_hp = self.chain.vests_to_hp(float(Amount(op["vesting_shares"], blockchain_instance=self.hive)))
+        self.accounts[account].delegated_hp = delegated_hp
+        self.accounts[account].delegation_timestamp = op["timestamp"].replace(tzinfo=None)
+        if delegated_hp > 0 and self.accounts[account].delegation_revoked:
+            self.accounts[account].delegation_revoked = False
+        elif delegated_hp == 0 and not self.accounts[account].delegation_revoked:
+            self.accounts[account].delegation_revoked = True
+        self.save_account(account)
+        self.index_account(account)
+
+    def handle_create_claimed_account(self, op, active_accounts):
+        if op["json_metadata"] == "":
+            return
+        meta_data = json.loads(op["json_metadata"])
+        if "beneficiaries" not in meta_data:
+            return
+        for entry in meta_data["beneficiaries"]:
+            if entry["label"] == "referrer" and entry["name"] == self.config["referrerAccount"]:
+                account = op["new_account_name"]
+                self.accounts[account] = AccountRecord(timestamp=op["timestamp"].replace(tzinfo=None),
+                                                       weight=entry["weight"])
+                self.save_account(account)
+                self.index_account(account)
+
+def create_hive(nodes, offset=0):
+    """Returns a Hive instance which starts with nodes[offset] and fails over to the following nodes"""
+    offset = offset % len(nodes)
+    return Hive(node=nodes[offset:] + nodes[:offset], num_retries=5, call_num_retries=3, timeout=15)
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -395,6 +1075,9 @@ def main():
     parser.add_argument("--logconfig", help="Logger Config file in JSON format", default='logger.json')
     parser.add_argument("--datadir", help="Data storage dir", default='.')
     parser.add_argument('--list-accounts', action='store_true')
+    parser.add_argument('--profile', help="Profiles the bot and prints op latencies and stage times on exit", action='store_true')
+    parser.add_argument('--fast-start', help="Starts streaming right away with the cached node list and account snapshot, "
+                        "the reconciliation is done in the background", action='store_true')
     args = parser.parse_args()
     
     setup_logging(default_path=args.logconfig)
@@ -404,79 +1087,177 @@ def main():
     config = json.loads(open(os.path.abspath(args.config)).read())
     datadir = args.datadir
 
+    data_file = os.path.join(datadir, 'data.sqlite')
+    if args.list_accounts:
+        # read-only and without migration, so that the accounts can be listed while the bot is running
+        if "tenants" in config:
+            data_files = [(name, tenant_data_file(datadir, name, create=False)) for name in sorted(config["tenants"])]
+        else:
+            data_files = [(None, data_file)]
+        for tenant, list_data_file in data_files:
+            if not os.path.isfile(list_data_file):
+                if tenant is not None:
+                    logger.warning("Tenant %s has no state, %s is created when the bot is started" % (
+                        tenant, list_data_file))
+                else:
+                    logger.warning("%s does not exist, it is created when the bot is started" % list_data_file)
+                continue
+            print_accounts(AccountQuery(list_data_file).accounts())
+        return
+
+    store = StateStore(data_file)
+    if store.migrate_shelve(os.path.join(datadir, 'data.db')):
+        logger.info("data.db was migrated to %s" % data_file)
+
     nodelist = NodeList()
-    nodelist.update_nodes()
-    hive = Hive(node=nodelist.get_hive_nodes(), num_retries=5, call_num_retries=3, timeout=15)
-    blockchain = Blockchain(blockchain_instance=hive)
+    cached_nodes = store.get("node_list")
+    if args.fast_start and cached_nodes and ("nodes" not in config or set(cached_nodes) == set(config["nodes"])):
+        # the nodes are probed again after the first run
+        nodes = cached_nodes
+        node_pool = NodePool(nodes, max_head_lag=config.get("node_max_head_lag", 20))
+    else:
+        nodelist.update_nodes()
+        node_pool = NodePool(config.get("nodes", nodelist.get_hive_nodes()),
+                             max_head_lag=config.get("node_max_head_lag", 20))
+        node_pool.probe()
+        nodes = node_pool.ranked()
+        store.set("node_list", nodes)
+    hive = create_hive(nodes)
     logger.info(str(hive))
-    data_file = os.path.join(datadir, 'data.db')
-    bot = DelegationOnboardBot(
-        config,
-        data_file,
-        hive
-    )
-    
-    data_db = read_data(data_file)
-    if "last_block_num" in data_db:
-        last_block_num = data_db["last_block_num"]
+    broadcast_hive = create_hive(nodes)
+    if "tenants" in config:
+        # one shared block stream for all tenants, each tenant has its own data dir and Hive instances
+        metrics = Metrics()
+        bots = {}
+        for name, tenant_config in sorted(tenant_configs(config).items()):
+            logger.info("Starting tenant %s" % name)
+            bots[name] = DelegationOnboardBot(
+                tenant_config,
+                tenant_data_file(datadir, name),
+                create_hive(nodes),
+                broadcast_instance=create_hive(nodes),
+                fast_start=args.fast_start,
+                metrics=LabeledMetrics(metrics, (("tenant", name), )),
+                lookup_instance=create_hive(nodes)
+            )
+        bot = TenantGroup(bots, hive, config, metrics, lambda: create_hive(nodes))
+        tenant_bots = list(bots.values())
     else:
-        last_block_num = 0
+        bot = DelegationOnboardBot(
+            config,
+            data_file,
+            hive,
+            broadcast_instance=broadcast_hive,
+            fast_start=args.fast_start,
+            lookup_instance=create_hive(nodes)
+        )
+        tenant_bots = [bot]
+    if args.fast_start:
+        for tenant_bot in tenant_bots:
+            tenant_bot.start_background_reconcile(create_hive(nodes))
     
-    if "last_block_num" in data_db:
-        start_block = data_db["last_block_num"] + 1
+    block_scheduler = BlockScheduler(catchup_lag=config.get("catchup_lag", 100),
+                                     max_window=config.get("catchup_window", 2000),
+                                     run_seconds=config.get("catchup_run_seconds", 30))
+    block_scheduler.update_head(bot.hive.get_dynamic_global_properties(False))
+    last_block_num = bot.last_block_num
+    if last_block_num is not None:
+        start_block = last_block_num + 1
         if start_block == 35922615:
             start_block += 1
         logger.info("Start block_num: %d" % start_block)
-        
-        stop_block = start_block + 100
-        if stop_block > blockchain.get_current_block_num():
-            stop_block = blockchain.get_current_block_num()
     else:
-        start_block = None
-        stop_block = None
-    
-    if args.list_accounts:
-        t = PrettyTable(["account", "timestamp", "muted", "hp", "del. hp", "del. timestamp", "rc_comments", "del revoked"])
-        t.align = "l"            
-        for acc_name in data_db["accounts"]:
-            acc = data_db["accounts"][acc_name]
-            if acc["timestamp"] is None:
-                timestamp = ""
-            else:
-                timestamp = formatTimeString(acc["timestamp"])
-            if acc["delegation_timestamp"] is None:
-                del_timestamp = ""
-            else:
-                del_timestamp = formatTimeString(acc["delegation_timestamp"])
-            t.add_row([acc_name, timestamp, acc["muted"], acc["hp"], acc["delegated_hp"], del_timestamp, round(acc["rc_comments"], 3), acc["delegation_revoked"]])
-        print(t)
-        return
-    
+        start_block = block_scheduler.head_block_num
+
+    catchup_threads = config.get("catchup_threads", 4)
+    if catchup_threads > 1:
+        # every fetch thread gets its own instance, starting with a different node
+        bot.enable_catchup([create_hive(nodes, i) for i in range(catchup_threads)])
+
+    if "metrics_port" in config:
+        MetricsServer(bot.metrics, config["metrics_port"], host=config.get("metrics_host", "127.0.0.1"))
+    for tenant_bot in tenant_bots:
+        if "query_port" in tenant_bot.config:
+            QueryServer(tenant_bot.data_file, tenant_bot.config["query_port"],
+                        host=tenant_bot.config.get("query_host", "127.0.0.1"),
+                        delegation_length=tenant_bot.config["delegationLength"])
+
+    # atexit handlers do not run when the process is killed by a signal, e.g. by systemctl stop or docker stop
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    if args.profile:
+        profiler, timer = start_profile(*tenant_bots)
+        atexit.register(write_profile, profiler, timer, os.path.join(datadir, "profile.pstats"))
+
+    def save_snapshot_on_exit():
+        if bot.last_block_num is not None:
+            bot.save_snapshot(bot.last_block_num)
+        bot.close()
+    atexit.register(save_snapshot_on_exit)
+
+    def reconcile():
+        # Compare delegations and mutings with the chain
+        if bot.ready:
+            bot.reconcile()
+
+    def update_nodes():
+        if "nodes" in config:
+            return
+        nodelist.update_nodes()
+        node_pool.set_nodes(nodelist.get_hive_nodes())
+        node_pool.start_probe()
+
+    def switch_nodes():
+        # Switch all components to the fastest healthy node when a background probe has finished
+        nonlocal nodes
+        if not node_pool.finish_probe():
+            return
+        for url in node_pool.nodes:
+            stats = node_pool.stats[url]
+            if stats.latency is not None:
+                bot.metrics.set("node_latency_seconds", stats.latency, labels=(("node", url), ))
+            bot.metrics.set("node_error_rate", stats.error_rate, labels=(("node", url), ))
+            bot.metrics.set("node_head_lag_blocks", stats.head_lag, labels=(("node", url), ))
+        if node_pool.best() != nodes[0]:
+            nodes = node_pool.ranked()
+            store.set("node_list", nodes)
+            logger.info("Switching to node %s" % nodes[0])
+            bot.set_hive(create_hive(nodes), broadcast_instance=create_hive(nodes), lookup_instance=create_hive(nodes))
+            if catchup_threads > 1:
+                bot.enable_catchup([create_hive(nodes, i) for i in range(catchup_threads)])
+
+    def save_snapshot():
+        bot.save_snapshot(bot.last_block_num)
+
+    maintenance = Maintenance()
+    # startup has just reconciled and updated the nodes
+    maintenance.add(reconcile, config.get("reconcile_interval", 1200), block_num=start_block)
+    maintenance.add(update_nodes, 20 * 60 * 24, block_num=start_block)
+    maintenance.add(node_pool.start_probe, config.get("node_probe_interval", 100))
+    maintenance.add(switch_nodes, 1)
+    maintenance.add(save_snapshot, config.get("snapshot_interval", 1200))
+
     logger.info("starting delegation manager for onboarding..")
-    block_counter = None
-    last_print_stop_block = stop_block
     while True:
-        if start_block is not None and stop_block is not None:
-            if last_print_stop_block is not None and stop_block - last_print_stop_block > 1:
-                last_print_stop_block = stop_block
-        last_block_num = bot.run(start_block, stop_block)
-        # Update nodes once a day
-        if block_counter is None:
-            block_counter = last_block_num
-        elif last_block_num - block_counter > 20 * 60 * 24:
-            nodelist.update_nodes()
-            hive = Hive(node=nodelist.get_hive_nodes(), num_retries=5, call_num_retries=3, timeout=15)
-            
-            bot.hive = hive
-        
+        stop_block, catchup = block_scheduler.next_range(start_block)
+        if stop_block is None:
+            # wait for the next block instead of polling the node
+            time.sleep(block_scheduler.wait_time(start_block))
+            block_scheduler.update_head(bot.hive.get_dynamic_global_properties(False))
+            continue
+        if catchup:
+            logger.info("Catching up from block %d to %d" % (start_block, stop_block))
+        run_start = time.time()
+        last_block_num = bot.run(start_block, stop_block, catchup=catchup, head_block_num=block_scheduler.head_block_num)
+        if last_block_num is None or last_block_num < start_block:
+            time.sleep(block_scheduler.wait_time(start_block))
+            block_scheduler.update_head(bot.hive.get_dynamic_global_properties(False))
+            continue
+        block_scheduler.record_run(last_block_num - start_block + 1, time.time() - run_start)
+        maintenance.run_due(last_block_num)
         start_block = last_block_num + 1
-        
-        stop_block = start_block + 100
-        if stop_block > blockchain.get_current_block_num():
-            stop_block = blockchain.get_current_block_num()        
-        
-        store_data(data_file, "last_block_num", last_block_num)
-        time.sleep(3)
+        if not catchup:
+            time.sleep(block_scheduler.wait_time(start_block))
+        block_scheduler.update_head(bot.hive.get_dynamic_global_properties(False))
 
     
 if __name__ == "__main__":
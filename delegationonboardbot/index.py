@@ -0,0 +1,42 @@
+#!/usr/bin/python
+import heapq
+
+
+class ExpiryIndex(object):
+    """ Time ordered index of accounts and their expiry time
+
+        The index is a heap with lazy deletion: updating or removing an
+        account leaves its old heap entry in place, which is skipped when it
+        is popped. The heap is rebuilt when it holds too many stale entries.
+    """
+    def __init__(self):
+        self.heap = []
+        self.expiry = {}
+
+    def __len__(self):
+        return len(self.expiry)
+
+    def __contains__(self, account):
+        return account in self.expiry
+
+    def update(self, account, expiry):
+        if self.expiry.get(account) == expiry:
+            return
+        self.expiry[account] = expiry
+        heapq.heappush(self.heap, (expiry, account))
+        if len(self.heap) > 2 * len(self.expiry) + 100:
+            self.heap = [(expiry, account) for account, expiry in self.expiry.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, account):
+        self.expiry.pop(account, None)
+
+    def pop_due(self, now):
+        """Removes and returns all accounts whose expiry is before now"""
+        due = []
+        while len(self.heap) > 0 and self.heap[0][0] < now:
+            expiry, account = heapq.heappop(self.heap)
+            if self.expiry.get(account) == expiry:
+                del self.expiry[account]
+                due.append(account)
+        return due
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+    """ Append-only log of state changes
+
+        Each record is one json line. append only writes into the file
+        buffer; the file is fsynced when sync_records records were appended
+        since the last sync or when sync is called, so that the durability
+        costs are shared by a batch of records. A truncated last line, e.g.
+        from a crash during a write, is ignored when the journal is read.
+
+        :param str journal_file: path to the journal, None disables the journal
+        :param int sync_records: number of appended records after which the journal is fsynced
+    """
+    def __init__(self, journal_file, sync_records=1000):
+        self.journal_file = journal_file
+        self.sync_records = sync_records
+        self.unsynced = 0
+        self.f = None
+        if journal_file is not None:
+            self.f = open(journal_file, "a")
+
+    def append(self, record):
+        if self.f is None:
+            return
+        self.f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_records:
+            self.sync()
+
+    def sync(self):
+        if self.f is None or self.unsynced == 0:
+            return
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.unsynced = 0
+
+    def read(self):
+        """Returns all complete records of the journal"""
+        if self.f is None:
+            return []
+        self.f.flush()
+        records = []
+        with open(self.journal_file) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Ignoring incomplete record at the end of %s" % self.journal_file)
+                    break
+        return records
+
+    def reset(self, records=()):
+        """Atomically replaces the journal by records, e.g. after a checkpoint"""
+        if self.f is None:
+            return
+        self.f.close()
+        tmp_file = self.journal_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+        self.f = open(self.journal_file, "a")
+        self.unsynced = 0
+
+    def close(self):
+        if self.f is not None:
+            self.sync()
+            self.f.close()
+            self.f = None
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+import logging
+import queue
+import threading
+from beem.comment import Comment
+from beem.utils import construct_authorperm
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_accounts(hive, names, batch_size=1000):
+    """ Returns the find_accounts and find_rc_accounts entries of names
+
+        One find_accounts and one find_rc_accounts call is made per
+        batch_size accounts.
+    """
+    accounts = []
+    rc_accounts = []
+    for i in range(0, len(names), batch_size):
+        batch = names[i:i + batch_size]
+        accounts += hive.rpc.find_accounts({"accounts": batch}, api="database")["accounts"]
+        rc_accounts += hive.rpc.find_rc_accounts({"accounts": batch}, api="rc")["rc_accounts"]
+    return accounts, rc_accounts
+
+
+def fetch_capacity(hive, account):
+    """ Returns the find_accounts entry of account and the expiring delegations which return to it"""
+    acc = hive.rpc.find_accounts({"accounts": [account]}, api="database")["accounts"][0]
+    expirations = hive.rpc.find_vesting_delegation_expirations({"account": account}, api="database")["delegations"]
+    return acc, expirations
+
+
+def fetch_beneficiaries(hive, author, permlink):
+    """Returns the beneficiaries of a post"""
+    return Comment(construct_authorperm(author, permlink), blockchain_instance=hive)["beneficiaries"]
+
+
+class Lookups(object):
+    """ Runs RPC lookups in a background thread
+
+        Lookups are put into a bounded queue and run one after another by a
+        worker thread, which is started with the first lookup. A lookup is a
+        function which is called with the Hive instance of the worker and its
+        arguments. The outcome is handed back through process_results, which
+        calls callback(result, error) on the calling thread, so that only
+        that thread changes the bot state.
+
+        :param Hive hive: Hive instance of the worker, it should not be
+            used by other threads
+        :param int queue_size: maximum number of queued lookups
+    """
+    def __init__(self, hive, queue_size=1000):
+        self.hive = hive
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue()
+        self.thread = None
+
+    def set_hive(self, hive):
+        """Replaces the Hive instance, e.g. to switch to another node"""
+        self.hive = hive
+
+    def submit(self, func, args, callback=None):
+        """Queues func(hive, *args)"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.worker, name="lookups")
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put((func, args, callback))
+
+    def pending(self):
+        """Returns the number of queued lookups"""
+        return self.queue.qsize()
+
+    def worker(self):
+        while True:
+            func, args, callback = self.queue.get()
+            try:
+                self.results.put((callback, func(self.hive, *args), None))
+            except Exception as e:
+                logger.debug("%s failed: %s" % (func.__name__, str(e)))
+                self.results.put((callback, None, e))
+            finally:
+                self.queue.task_done()
+
+    def process_results(self):
+        """Calls the callbacks of all finished lookups"""
+        while not self.results.empty():
+            callback, result, error = self.results.get()
+            if callback is not None:
+                callback(result, error)
+
+    def wait(self):
+        """Waits until all queued lookups are finished and processes their results"""
+        self.queue.join()
+        self.process_results()
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "delegationonboardbot_"
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.]
+
+
+class Metrics(object):
+    """ In-process counters, gauges and histograms
+
+        Values are kept in plain dicts keyed by (name, labels), where labels
+        is a tuple of (label, value) pairs, so that an update costs one dict
+        operation. render() returns all values in the Prometheus text format.
+        Callback gauges are evaluated on each render.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.gauge_callbacks = {}
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels=()):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def set_callback(self, name, callback, labels=()):
+        """Sets a gauge whose value is returned by callback when the metrics are rendered"""
+        with self.lock:
+            self.gauge_callbacks[(name, labels)] = callback
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [buckets, [0] * (len(buckets) + 1), 0., 0]
+                self.histograms[key] = histogram
+            histogram[1][bisect.bisect_left(buckets, value)] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def format_labels(self, labels, extra=()):
+        labels = labels + extra
+        if len(labels) == 0:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (label, str(value).replace('"', '\\"')) for label, value in labels)
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict((key, [h[0], list(h[1]), h[2], h[3]]) for key, h in self.histograms.items())
+            gauges = dict(self.gauges)
+            gauge_callbacks = list(self.gauge_callbacks.items())
+        # the callbacks run outside of the lock, they may update other metrics
+        for key, callback in gauge_callbacks:
+            try:
+                gauges[key] = callback()
+            except Exception as e:
+                logger.debug("Could not read gauge %s: %s" % (key[0], str(e)))
+        lines = []
+        for metric_type, values in [("counter", counters), ("gauge", gauges)]:
+            for name in sorted(set(key[0] for key in values)):
+                if name in self.help:
+                    lines.append("# HELP %s%s %s" % (PREFIX, name, self.help[name]))
+                lines.append("# TYPE %s%s %s" % (PREFIX, name, metric_type))
+                for key in sorted(key for key in values if key[0] == name):
+                    lines.append("%s%s%s %s" % (PREFIX, name, self.format_labels(key[1]), repr(float(values[key]))))
+        for name in sorted(set(key[0] for key in histograms)):
+            if name in self.help:
+                lines.append("# HELP %s%s %s" % (PREFIX, name, self.help[name]))
+            lines.append("# TYPE %s%s histogram" % (PREFIX, name))
+            for key in sorted(key for key in histograms if key[0] == name):
+                buckets, counts, total, count = histograms[key]
+                cumulative = 0
+                for bucket, bucket_count in zip(buckets + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append("%s%s_bucket%s %d" % (PREFIX, name, self.format_labels(key[1], (("le", bucket), )), cumulative))
+                lines.append("%s%s_sum%s %s" % (PREFIX, name, self.format_labels(key[1]), repr(total)))
+                lines.append("%s%s_count%s %d" % (PREFIX, name, self.format_labels(key[1]), count))
+        return "\n".join(lines) + "\n"
+
+
+class LabeledMetrics(object):
+    """ Adds constant labels to all values which are written into metrics
+
+        Is used to keep the values of several bots apart in one Metrics instance.
+    """
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def describe(self, name, text):
+        self.metrics.describe(name, text)
+
+    def inc(self, name, value=1, labels=()):
+        self.metrics.inc(name, value, self.labels + labels)
+
+    def set(self, name, value, labels=()):
+        self.metrics.set(name, value, self.labels + labels)
+
+    def set_callback(self, name, callback, labels=()):
+        self.metrics.set_callback(name, callback, self.labels + labels)
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        self.metrics.observe(name, value, self.labels + labels, buckets)
+
+    def render(self):
+        return self.metrics.render()
+
+
+def rpc_method_name(payload):
+    if isinstance(payload, list):
+        if len(payload) == 0:
+            return "batch"
+        payload = payload[0]
+    if payload.get("method") == "call":
+        return "%s.%s" % (payload["params"][0], payload["params"][1])
+    return payload.get("method", "unknown")
+
+
+def instrument_rpc(hive, metrics):
+    """Counts the RPC calls of a Hive instance and measures their latency per method"""
+    rpc = hive.rpc
+    if rpc is None or getattr(rpc, "metrics_instrumented", False):
+        return
+    rpcexec = rpc.rpcexec
+
+    def timed_rpcexec(payload):
+        labels = (("method", rpc_method_name(payload)), )
+        start = time.time()
+        try:
+            return rpcexec(payload)
+        except Exception:
+            metrics.inc("rpc_errors_total", labels=labels)
+            raise
+        finally:
+            metrics.observe("rpc_latency_seconds", time.time() - start, labels=labels)
+    rpc.rpcexec = timed_rpcexec
+    rpc.metrics_instrumented = True
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """ Serves the metrics on http://host:port/metrics from a background thread
+
+        :param Metrics metrics: metrics which are served
+        :param int port: port of the HTTP server
+        :param str host: address of the HTTP server
+    """
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Metrics are served on http://%s:%d/metrics" % (host, self.server.server_port))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
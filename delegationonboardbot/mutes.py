@@ -0,0 +1,105 @@
+#!/usr/bin/python
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# follow actions which clear the whole mute list of the follower
+RESET_ACTIONS = ["reset_muted_list", "reset_all_lists"]
+
+
+def parse_follow(json_str):
+    """ Returns (follower, list of following, what) of a follow custom_json
+
+        Both the ["follow", {...}] and the older plain {...} form are
+        accepted. Returns None for other actions like reblog and for invalid json.
+    """
+    try:
+        data = json.loads(json_str)
+    except ValueError:
+        return None
+    if isinstance(data, list):
+        if len(data) != 2 or data[0] != "follow":
+            return None
+        data = data[1]
+    if not isinstance(data, dict) or "follower" not in data or "following" not in data:
+        return None
+    following = data["following"]
+    if not isinstance(following, list):
+        following = [following]
+    what = data.get("what", [])
+    if not isinstance(what, list):
+        what = [what]
+    return data["follower"], following, what
+
+
+class MuteTracker(object):
+    """ Follows the accounts which are muted by mute_account
+
+        The mute set is updated from the follow custom_json ops of
+        mute_account and stored together with the last processed block
+        number. A full fetch of the mute list is only needed when blocks were
+        missed, e.g. on the first start, after mute_account was changed or
+        after the mute list was reset on chain.
+
+        :param StateStore store: store of the mute set
+        :param str mute_account: account whose mutes are followed
+    """
+    def __init__(self, store, mute_account):
+        self.store = store
+        self.mute_account = mute_account
+        self.muted = store.load_mutes()
+        self.block_num = store.get("mute_block_num")
+        if store.get("mute_account") != mute_account:
+            self.block_num = None
+
+    def in_sync(self, last_block_num):
+        """Returns True when all mute ops up to last_block_num were processed"""
+        return self.block_num is not None and last_block_num is not None and self.block_num >= last_block_num
+
+    def resync(self, muted_accounts, block_num):
+        """Replaces the mute set by a full mute list which was fetched at block_num"""
+        self.muted = set(muted_accounts)
+        self.block_num = block_num
+        with self.store.transaction():
+            self.store.replace_mutes(self.muted)
+            self.store.set("mute_account", self.mute_account)
+            self.store.set("mute_block_num", block_num)
+
+    def checkpoint(self, block_num):
+        """Stores that all mute ops up to block_num were processed"""
+        if self.block_num is None or block_num is None or block_num <= self.block_num:
+            return
+        self.block_num = block_num
+        self.store.set("mute_block_num", block_num)
+
+    def process_op(self, op):
+        """ Applies a follow custom_json of mute_account and returns (muted, unmuted) accounts
+
+            The caller checks the author and the id of the op, so that the
+            json of other ops is never decoded.
+        """
+        follow = parse_follow(op["json"])
+        if follow is None:
+            return [], []
+        follower, following, what = follow
+        if follower != self.mute_account:
+            return [], []
+        if any(action in RESET_ACTIONS for action in what):
+            logger.info("Mute list of %s was reset, it is fetched again" % self.mute_account)
+            self.block_num = None
+            return [], []
+        muted = []
+        unmuted = []
+        for account in following:
+            if "ignore" in what:
+                if account not in self.muted:
+                    self.muted.add(account)
+                    self.store.add_mute(account)
+                    muted.append(account)
+            elif len(what) == 0 or what == ["blog"]:
+                if account in self.muted:
+                    self.muted.discard(account)
+                    self.store.remove_mute(account)
+                    unmuted.append(account)
+        return muted, unmuted
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+import json
+import logging
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class NodeStats(object):
+    """ Health statistics of one RPC node
+
+        Latency and error rate are exponential moving averages over the
+        probes, head_lag is the distance of the node to the highest head
+        block seen in the last probe.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.error_rate = 0.
+        self.head_block_num = None
+        self.head_lag = 0
+        self.probes = 0
+
+    def __repr__(self):
+        return "<NodeStats %s latency=%s error_rate=%.2f head_lag=%d>" % (self.url, self.latency, self.error_rate, self.head_lag)
+
+
+class NodePool(object):
+    """ Measures latency, error rate and head lag of a list of RPC nodes
+
+        Every probe sends one database_api.get_dynamic_global_properties
+        request to all nodes at once. The probe runs either in the calling
+        thread (probe) or in a background thread (start_probe), whose results
+        are applied together by finish_probe, so that the ranking is never
+        changed by a partial probe. ranked() returns the healthy nodes sorted by
+        latency followed by the unhealthy ones, so that a Hive instance
+        which is created with this list reads from the fastest healthy node
+        and fails over to the next ones.
+
+        :param list nodes: node urls
+        :param float timeout: timeout of a probe request in seconds
+        :param float alpha: weight of the newest probe in the moving averages
+        :param float max_error_rate: nodes above this error rate are unhealthy
+        :param int max_head_lag: nodes which are more blocks behind are unhealthy
+    """
+    def __init__(self, nodes, timeout=5, alpha=0.3, max_error_rate=0.5, max_head_lag=20):
+        self.stats = dict((url, NodeStats(url)) for url in nodes)
+        self.nodes = list(nodes)
+        self.timeout = timeout
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.max_head_lag = max_head_lag
+        # one session per probe thread
+        self.local = threading.local()
+        self.executor = None
+        self.future = None
+
+    def set_nodes(self, nodes):
+        """Replaces the node list, statistics of known nodes are kept"""
+        self.stats = dict((url, self.stats.get(url, NodeStats(url))) for url in nodes)
+        self.nodes = list(nodes)
+
+    def record(self, url, latency, ok, head_block_num=None):
+        """Adds the result of one request to the statistics of url"""
+        stats = self.stats[url]
+        stats.probes += 1
+        stats.error_rate = (1 - self.alpha) * stats.error_rate + self.alpha * (0. if ok else 1.)
+        if not ok:
+            return
+        if stats.latency is None:
+            stats.latency = latency
+        else:
+            stats.latency = (1 - self.alpha) * stats.latency + self.alpha * latency
+        if head_block_num is not None:
+            stats.head_block_num = head_block_num
+
+    def probe_node(self, url):
+        """Returns (url, latency, ok, head_block_num) of one request to url"""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        data = {"jsonrpc": "2.0", "method": "database_api.get_dynamic_global_properties", "params": {}, "id": 1}
+        start = time.time()
+        try:
+            r = self.local.session.post(url, data=json.dumps(data), timeout=self.timeout)
+            r.raise_for_status()
+            head_block_num = r.json()["result"]["head_block_number"]
+        except Exception as e:
+            logger.debug("Probe of %s failed: %s" % (url, str(e)))
+            return url, None, False, None
+        return url, time.time() - start, True, head_block_num
+
+    def probe_nodes(self, nodes):
+        """Probes nodes concurrently and returns their results"""
+        if len(nodes) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+            return list(executor.map(self.probe_node, nodes))
+
+    def probe(self):
+        """Probes all nodes and updates their statistics"""
+        self.apply(self.probe_nodes(self.nodes))
+
+    def start_probe(self):
+        """Starts a probe of all nodes in a background thread, unless one is running"""
+        if self.future is not None:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = self.executor.submit(self.probe_nodes, list(self.nodes))
+
+    def finish_probe(self):
+        """Applies the results of a finished background probe, returns False when none has finished"""
+        if self.future is None or not self.future.done():
+            return False
+        future = self.future
+        self.future = None
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.warning("Probe of the nodes failed: %s" % str(e))
+            return False
+        self.apply(results)
+        return True
+
+    def apply(self, results):
+        """Records probe results and updates the head lag, results of removed nodes are ignored"""
+        for url, latency, ok, head_block_num in results:
+            if url in self.stats:
+                self.record(url, latency, ok, head_block_num)
+        heads = [s.head_block_num for s in self.stats.values() if s.head_block_num is not None]
+        if len(heads) == 0:
+            return
+        max_head = max(heads)
+        for stats in self.stats.values():
+            if stats.head_block_num is None:
+                stats.head_lag = 0
+            else:
+                stats.head_lag = max_head - stats.head_block_num
+
+    def is_healthy(self, url):
+        stats = self.stats[url]
+        return stats.latency is not None and stats.error_rate <= self.max_error_rate and \
+            stats.head_lag <= self.max_head_lag
+
+    def ranked(self):
+        """Returns all nodes, healthy nodes sorted by latency first"""
+        healthy = sorted([url for url in self.nodes if self.is_healthy(url)], key=lambda url: self.stats[url].latency)
+        return healthy + [url for url in self.nodes if url not in healthy]
+
+    def best(self):
+        return self.ranked()[0]
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+from delegationonboardbot.record import MUTED, DELEGATION_REVOKED
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+REVOKE_LENGTH = "length"
+REVOKE_MAX_HP = "max_hp"
+REVOKE_MUTED = "muted"
+REVOKE_BENEFICIARY = "beneficiary"
+
+# smaller account lists are evaluated faster in python
+MIN_NUMPY_ACCOUNTS = 256
+
+
+class PolicyColumns(object):
+    """ Columnar copy of the account fields which are used by the delegation rules
+
+        Every account has a row in numpy arrays, which is written by update
+        whenever the account changes, so that evaluate_policy can run over
+        all accounts without reading the records. The arrays grow by
+        doubling. Without numpy, update does nothing.
+
+        :param int capacity: number of rows which are allocated at first
+    """
+    def __init__(self, capacity=1024):
+        # account name -> row
+        self.rows = {}
+        self.names = []
+        self.size = 0
+        if np is not None:
+            self.allocate(capacity)
+
+    def allocate(self, capacity):
+        for name, dtype in [("delegated_hp", np.float64), ("hp", np.float64), ("rc_comments", np.float64),
+                            ("flags", np.uint8), ("delegation_epoch", np.int64)]:
+            column = np.zeros(capacity, dtype=dtype)
+            if self.size > 0:
+                column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+
+    def update(self, name, record):
+        """Writes the policy fields of an AccountRecord into the row of name"""
+        if np is None:
+            return
+        row = self.rows.get(name)
+        if row is None:
+            if self.size == len(self.delegated_hp):
+                self.allocate(max(2 * self.size, 1024))
+            row = self.size
+            self.rows[name] = row
+            self.names.append(name)
+            self.size += 1
+        self.delegated_hp[row] = record.delegated_hp
+        self.hp[row] = record.hp
+        self.rc_comments[row] = record.rc_comments
+        self.flags[row] = record.flags
+        self.delegation_epoch[row] = -1 if record.delegation_epoch is None else record.delegation_epoch
+
+    def evaluate(self, names, config, now):
+        """Evaluates the rules for names, all accounts when names is None, see evaluate_policy"""
+        if names is None:
+            names = self.names
+            rows = slice(0, self.size)
+        else:
+            rows = np.fromiter((self.rows[name] for name in names), dtype=np.int64, count=len(names))
+        delegated_hp = self.delegated_hp[rows]
+        hp = self.hp[rows]
+        flags = self.flags[rows]
+        revoked = (flags & DELEGATION_REVOKED) != 0
+
+        grant = (delegated_hp <= 0) & ~revoked & (hp <= config["maxUserHP"]) & \
+            (self.rc_comments[rows] < config["minPostRC"])
+        active = (delegated_hp > 0) & ~revoked
+        if config["delegationLength"] > 0:
+            delegation_epoch = self.delegation_epoch[rows]
+            expired = active & (delegation_epoch >= 0) & \
+                (delegation_epoch + config["delegationLength"] * 24 * 60 * 60 < now)
+        else:
+            expired = np.zeros(len(names), dtype=bool)
+        if config["maxUserHP"] > 0:
+            over_max_hp = active & ~expired & (hp > config["maxUserHP"])
+        else:
+            over_max_hp = np.zeros(len(names), dtype=bool)
+        muted_active = active & ~expired & ~over_max_hp & ((flags & MUTED) != 0)
+
+        revoke = {}
+        for reason, mask in [(REVOKE_LENGTH, expired), (REVOKE_MAX_HP, over_max_hp), (REVOKE_MUTED, muted_active)]:
+            for i in np.flatnonzero(mask):
+                revoke[names[i]] = reason
+        return [names[i] for i in np.flatnonzero(grant)], revoke
+
+
+def evaluate_policy(accounts, names, config, now, columns=None):
+    """ Evaluates the delegation rules for the given accounts at once
+
+        An account receives a delegation when it has no delegation, was
+        never revoked, has not more own HP than maxUserHP and can broadcast
+        less than minPostRC comments. An active delegation is revoked when
+        it is older than delegationLength, when the account has more own HP
+        than maxUserHP or when it was muted (checked in this order).
+
+        The rules are evaluated with numpy over columns when they are given,
+        numpy is installed and enough accounts are evaluated.
+
+        :param dict accounts: account name -> AccountRecord
+        :param list names: accounts which should be evaluated, None for all accounts
+        :param dict config: bot config
+        :param float now: current time as epoch seconds
+        :param PolicyColumns columns: columnar copy of accounts
+        :returns: list of accounts which should receive a delegation and a
+            dict of accounts whose delegation should be revoked -> reason
+    """
+    if columns is None or np is None or (names is not None and len(names) < MIN_NUMPY_ACCOUNTS):
+        if names is None:
+            names = list(accounts.keys())
+        return evaluate_policy_python(accounts, names, config, now)
+    return columns.evaluate(names, config, now)
+
+
+def evaluate_policy_python(accounts, names, config, now):
+    """Same as evaluate_policy, without numpy"""
+    grant = []
+    revoke = {}
+    for name in names:
+        r = accounts[name]
+        if r.delegated_hp <= 0:
+            if not r.delegation_revoked and r.hp <= config["maxUserHP"] and r.rc_comments < config["minPostRC"]:
+                grant.append(name)
+            continue
+        if r.delegation_revoked:
+            continue
+        if config["delegationLength"] > 0 and r.delegation_epoch is not None and \
+                r.delegation_epoch + config["delegationLength"] * 24 * 60 * 60 < now:
+            revoke[name] = REVOKE_LENGTH
+        elif config["maxUserHP"] > 0 and r.hp > config["maxUserHP"]:
+            revoke[name] = REVOKE_MAX_HP
+        elif r.muted:
+            revoke[name] = REVOKE_MUTED
+    return grant, revoke
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# DelegationOnboardBot methods whose run time is summed up per call
+STAGES = ["run_checks", "process_stream", "process_active_accounts", "queue_unresolved_posts",
+          "process_beneficiary_queue", "refresh_accounts", "grant_delegations", "check_for_sufficient_hp", "reconcile",
+          "sweep"]
+
+
+class OpTimer(object):
+    """ Latency histograms of the op handlers and timers of the bot stages
+
+        Handler latencies are counted per op type in buckets of powers of
+        two microseconds. Stage times are summed up per stage, a stage
+        includes the stages which are called by it.
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record_op(self, op_type, seconds):
+        bucket = int(seconds * 1e6).bit_length()
+        histogram = self.histograms.setdefault(op_type, {})
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def record_stage(self, name, seconds):
+        with self.lock:
+            total, calls = self.stages.get(name, (0., 0))
+            self.stages[name] = (total + seconds, calls + 1)
+
+    def wrap_handler(self, op_type, handler):
+        def timed_handler(op, active_accounts):
+            start = time.perf_counter()
+            handler(op, active_accounts)
+            self.record_op(op_type, time.perf_counter() - start)
+        return timed_handler
+
+    def wrap_stage(self, name, func):
+        def timed_stage(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record_stage(name, time.perf_counter() - start)
+        return timed_stage
+
+    def instrument(self, bot):
+        """Replaces the op handlers and the stage methods of bot by timed ones"""
+        bot.op_handlers = dict((op_type, self.wrap_handler(op_type, bot.op_handlers[op_type])) for op_type in bot.op_handlers)
+        for name in STAGES:
+            setattr(bot, name, self.wrap_stage(name, getattr(bot, name)))
+
+    def percentile(self, histogram, fraction):
+        """Returns the upper bucket limit in microseconds below which fraction of the ops are"""
+        count = sum(histogram.values())
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= fraction * count:
+                return 2 ** bucket
+        return 0
+
+    def report(self):
+        lines = ["%-26s %8s %10s %10s" % ("stage", "calls", "total s", "mean ms")]
+        for name in sorted(self.stages, key=lambda name: -self.stages[name][0]):
+            total, calls = self.stages[name]
+            lines.append("%-26s %8d %10.3f %10.3f" % (name, calls, total, total / calls * 1000))
+        lines.append("")
+        lines.append("%-26s %8s %10s %10s %10s" % ("op type", "ops", "p50 us", "p99 us", "max us"))
+        for op_type in sorted(self.histograms):
+            histogram = self.histograms[op_type]
+            lines.append("%-26s %8d %10d %10d %10d" % (op_type, sum(histogram.values()), self.percentile(histogram, 0.5),
+                                                      self.percentile(histogram, 0.99), 2 ** max(histogram)))
+        for op_type in sorted(self.histograms):
+            histogram = self.histograms[op_type]
+            lines.append("")
+            lines.append("%s latency histogram" % op_type)
+            for bucket in sorted(histogram):
+                lines.append("  < %8d us %10d" % (2 ** bucket, histogram[bucket]))
+        return "\n".join(lines)
+
+
+def start_profile(*bots):
+    """Instruments the bots and starts cProfile, returns (profiler, timer)"""
+    timer = OpTimer()
+    for bot in bots:
+        timer.instrument(bot)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler, timer
+
+
+def write_profile(profiler, timer, profile_file, top=30):
+    """Stops profiler, dumps its stats into profile_file and prints the stage, op and cProfile report"""
+    profiler.disable()
+    profiler.dump_stats(profile_file)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+    print(timer.report())
+    print(stream.getvalue())
+    logger.info("cProfile stats were written to %s" % profile_file)
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+"""Read-only queries over the state store of a running or stopped bot
+
+Lists accounts with filters, sorting and paging, or the delegation totals:
+
+    python -m delegationonboardbot.query data.sqlite --state active --sort delegation_timestamp
+    python -m delegationonboardbot.query data.sqlite --state revoked --reason muted --format json
+    python -m delegationonboardbot.query data.sqlite --expiring-days 3 --delegation-length 28
+    python -m delegationonboardbot.query data.sqlite --totals
+
+With --serve PORT, the same queries are served as JSON on
+http://127.0.0.1:PORT/accounts?state=active&limit=100 and /totals.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from delegationonboardbot.metrics import ThreadingHTTPServer
+from delegationonboardbot.record import epoch_to_datetime
+from delegationonboardbot.store import ACCOUNT_FIELDS, row_to_account
+
+logger = logging.getLogger(__name__)
+
+STATES = ["all", "active", "revoked", "muted", "waiting"]
+SORT_FIELDS = ["name", "timestamp", "hp", "delegated_hp", "delegation_timestamp", "rc_comments", "revoke_timestamp"]
+COLUMNS = ["name", "timestamp", "weight", "muted", "hp", "delegated_hp", "delegation_timestamp", "rc_comments",
+           "delegation_revoked", "revoke_reason", "revoke_timestamp"]
+ACTIVE = "a.delegated_hp > 0 AND a.delegation_revoked = 0"
+
+
+class AccountQuery(object):
+    """ Read-only queries over the accounts of a StateStore file
+
+        The file is opened read-only, so that queries can run next to the
+        bot. Rows are returned as generators, which read them from sqlite
+        one after another.
+
+        :param str data_file: path to the sqlite file of the bot
+    """
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.conn = sqlite3.connect("file:%s?mode=ro" % data_file, uri=True, check_same_thread=False)
+
+    def close(self):
+        self.conn.close()
+
+    def load_accounts(self):
+        """Returns all accounts as AccountRecord, like StateStore.load_accounts"""
+        return dict((row[0], row_to_account(row))
+                    for row in self.conn.execute("SELECT name, %s FROM accounts" % ", ".join(ACCOUNT_FIELDS)))
+
+    def accounts(self, state="all", reason=None, expiring_days=None, delegation_length=28, sort="name",
+                 descending=False, limit=None, offset=0):
+        """ Returns the matching accounts as dicts with the COLUMNS keys
+
+            :param str state: one of STATES, waiting are accounts which never received a delegation
+            :param str reason: only revoked accounts with this revoke reason
+            :param float expiring_days: only active delegations which expire in the next expiring_days days
+            :param int delegation_length: delegationLength in days, used for expiring_days
+            :param str sort: one of SORT_FIELDS
+        """
+        if state not in STATES:
+            raise ValueError("state must be one of %s" % ", ".join(STATES))
+        if sort not in SORT_FIELDS:
+            raise ValueError("sort must be one of %s" % ", ".join(SORT_FIELDS))
+        conditions = []
+        params = []
+        if state == "active":
+            conditions.append(ACTIVE)
+        elif state == "revoked":
+            conditions.append("a.delegation_revoked = 1")
+        elif state == "muted":
+            conditions.append("a.muted = 1")
+        elif state == "waiting":
+            conditions.append("a.delegated_hp <= 0 AND a.delegation_revoked = 0")
+        if reason is not None:
+            conditions.append("a.delegation_revoked = 1 AND r.reason = ?")
+            params.append(reason)
+        if expiring_days is not None:
+            conditions.append(ACTIVE + " AND a.delegation_timestamp <= ?")
+            params.append(int(time.time() + (expiring_days - delegation_length) * 24 * 60 * 60))
+        sql = ("SELECT a.name, a.timestamp, a.weight, a.muted, a.hp, a.delegated_hp, a.delegation_timestamp, "
+               "a.rc_comments, a.delegation_revoked, r.reason, r.timestamp FROM accounts a "
+               "LEFT JOIN revocations r ON r.name = a.name")
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        sort_column = "r.timestamp" if sort == "revoke_timestamp" else "a." + sort
+        sql += " ORDER BY %s %s, a.name" % (sort_column, "DESC" if descending else "ASC")
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        for row in self.conn.execute(sql, params):
+            account = dict(zip(COLUMNS, row))
+            account["muted"] = bool(account["muted"])
+            account["delegation_revoked"] = bool(account["delegation_revoked"])
+            yield account
+
+    def totals(self):
+        """Returns the number of accounts per state and the committed HP"""
+        row = self.conn.execute("SELECT COUNT(*), SUM(delegated_hp > 0 AND delegation_revoked = 0), "
+                                "SUM(CASE WHEN delegated_hp > 0 AND delegation_revoked = 0 THEN delegated_hp ELSE 0 END), "
+                                "SUM(delegation_revoked), SUM(muted) FROM accounts").fetchone()
+        totals = {"accounts": row[0], "active_delegations": row[1] or 0, "committed_hp": row[2] or 0.,
+                  "revoked": row[3] or 0, "muted": row[4] or 0, "revoked_by_reason": {}}
+        for reason, count in self.conn.execute("SELECT r.reason, COUNT(*) FROM revocations r JOIN accounts a "
+                                               "ON a.name = r.name WHERE a.delegation_revoked = 1 GROUP BY r.reason"):
+            totals["revoked_by_reason"][reason] = count
+        return totals
+
+
+def format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return "%.3f" % value
+    return str(value)
+
+
+def format_account(account, output_format):
+    """Returns one output line for an account dict"""
+    if output_format == "json":
+        return json.dumps(account)
+    values = dict(account)
+    for key in ["timestamp", "delegation_timestamp", "revoke_timestamp"]:
+        if values[key] is not None:
+            values[key] = epoch_to_datetime(values[key]).strftime("%Y-%m-%dT%H:%M:%S")
+    if output_format == "tsv":
+        return "\t".join(format_value(values[key]) for key in COLUMNS)
+    return "%-20s %-19s %6s %5s %10s %8s %-19s %11s %7s %-11s" % (
+        values["name"], format_value(values["timestamp"]), format_value(values["weight"]), values["muted"],
+        format_value(values["hp"]), format_value(values["delegated_hp"]), format_value(values["delegation_timestamp"]),
+        format_value(values["rc_comments"]), values["delegation_revoked"], format_value(values["revoke_reason"]))
+
+
+def print_accounts(accounts, output_format="table"):
+    """Prints the accounts line by line, so that the output starts before all rows are read"""
+    if output_format == "table":
+        print("%-20s %-19s %6s %5s %10s %8s %-19s %11s %7s %-11s" % (
+            "account", "timestamp", "weight", "muted", "hp", "del. hp", "del. timestamp", "rc_comments", "revoked",
+            "reason"))
+    elif output_format == "tsv":
+        print("\t".join(COLUMNS))
+    for account in accounts:
+        print(format_account(account, output_format))
+
+
+class QueryServer(object):
+    """ Serves the queries as JSON on http://host:port/accounts and /totals
+
+        Every request thread opens its own read-only connection. The query
+        parameters of /accounts are the arguments of AccountQuery.accounts,
+        the rows are written in chunks while they are read.
+
+        :param str data_file: path to the sqlite file of the bot
+        :param int port: port of the HTTP server
+        :param str host: address of the HTTP server
+        :param int delegation_length: delegationLength in days, used for expiring_days
+        :param int max_limit: maximum number of accounts per request
+    """
+    def __init__(self, data_file, port, host="127.0.0.1", delegation_length=28, max_limit=1000):
+        local = threading.local()
+
+        def get_query():
+            if not hasattr(local, "query"):
+                local.query = AccountQuery(data_file)
+            return local.query
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                url = urlparse(handler.path)
+                params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+                if not os.path.isfile(data_file):
+                    # the state is created by the bot, it is not created by a reader
+                    handler.send_error(404, "%s does not exist" % data_file)
+                    return
+                try:
+                    if url.path == "/totals":
+                        handler.send_json_start()
+                        handler.wfile.write(json.dumps(get_query().totals()).encode("utf-8"))
+                    elif url.path == "/accounts":
+                        accounts = get_query().accounts(
+                            state=params.get("state", "all"), reason=params.get("reason"),
+                            expiring_days=float(params["expiring_days"]) if "expiring_days" in params else None,
+                            delegation_length=delegation_length, sort=params.get("sort", "name"),
+                            descending=params.get("order", "asc") == "desc",
+                            limit=min(int(params.get("limit", 100)), max_limit), offset=int(params.get("offset", 0)))
+                        first = next(accounts, None)
+                        handler.send_json_start()
+                        handler.wfile.write(b"[")
+                        if first is not None:
+                            handler.wfile.write(json.dumps(first).encode("utf-8"))
+                            for account in accounts:
+                                handler.wfile.write(b",\n" + json.dumps(account).encode("utf-8"))
+                        handler.wfile.write(b"]\n")
+                    else:
+                        handler.send_error(404)
+                except ValueError as e:
+                    handler.send_error(400, str(e))
+
+            def send_json_start(handler):
+                handler.send_response(200)
+                handler.send_header("Content-Type", "application/json")
+                handler.send_header("Connection", "close")
+                handler.end_headers()
+
+            def log_message(handler, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="query")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Account queries are served on http://%s:%d/accounts" % (host, self.server.server_port))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only account queries over the state of delegationonboardbot")
+    parser.add_argument("data_file", help="data.sqlite file of the bot")
+    parser.add_argument("--state", help="Account state", choices=STATES, default="all")
+    parser.add_argument("--reason", help="Only revoked accounts with this reason (length, max_hp, muted, beneficiary)")
+    parser.add_argument("--expiring-days", help="Only delegations which expire within this number of days", type=float)
+    parser.add_argument("--delegation-length", help="delegationLength of the config in days", type=int, default=28)
+    parser.add_argument("--sort", help="Sort field", choices=SORT_FIELDS, default="name")
+    parser.add_argument("--desc", help="Sort in descending order", action="store_true")
+    parser.add_argument("--limit", help="Maximum number of accounts", type=int)
+    parser.add_argument("--offset", help="Number of skipped accounts", type=int, default=0)
+    parser.add_argument("--format", help="Output format", choices=["table", "tsv", "json"], default="table")
+    parser.add_argument("--totals", help="Prints the number of accounts per state and the committed HP", action="store_true")
+    parser.add_argument("--serve", help="Serves the queries as JSON on this port", type=int)
+    parser.add_argument("--host", help="Address of the query server", default="127.0.0.1")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.serve is not None:
+        QueryServer(args.data_file, args.serve, host=args.host, delegation_length=args.delegation_length)
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            return
+    query = AccountQuery(args.data_file)
+    if args.totals:
+        print(json.dumps(query.totals(), indent=2))
+        return
+    print_accounts(query.accounts(state=args.state, reason=args.reason, expiring_days=args.expiring_days,
+                                  delegation_length=args.delegation_length, sort=args.sort, descending=args.desc,
+                                  limit=args.limit, offset=args.offset), args.format)
+
+
+if __name__ == "__main__":
+    main()
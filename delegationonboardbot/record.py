@@ -0,0 +1,149 @@
+#!/usr/bin/python
+import calendar
+import os
+import struct
+from datetime import datetime
+
+MUTED = 1
+DELEGATION_REVOKED = 2
+
+SNAPSHOT_MAGIC = b"DOBS"
+SNAPSHOT_VERSION = 1
+
+
+def datetime_to_epoch(value):
+    if value is None:
+        return None
+    return calendar.timegm(value.utctimetuple())
+
+
+def epoch_to_datetime(value):
+    if value is None:
+        return None
+    return datetime.utcfromtimestamp(value)
+
+
+class AccountRecord(object):
+    """ State of a referred account
+
+        Timestamps are stored as epoch seconds and the muted and
+        delegation_revoked flags as bits of flags. The timestamp and
+        delegation_timestamp properties convert from and to naive UTC
+        datetimes.
+    """
+    __slots__ = ["timestamp_epoch", "weight", "flags", "rc", "hp", "delegated_hp", "delegation_epoch", "rc_comments"]
+    # timestamp_epoch, delegation_epoch, weight, rc, hp, delegated_hp, rc_comments, flags
+    packer = struct.Struct("<qqiddddB")
+
+    def __init__(self, timestamp=None, weight=None, muted=False, rc=0, hp=0, delegated_hp=0,
+                 delegation_timestamp=None, rc_comments=0, delegation_revoked=False):
+        self.timestamp_epoch = datetime_to_epoch(timestamp)
+        self.weight = weight
+        self.flags = 0
+        self.rc = rc
+        self.hp = hp
+        self.delegated_hp = delegated_hp
+        self.delegation_epoch = datetime_to_epoch(delegation_timestamp)
+        self.rc_comments = rc_comments
+        self.muted = muted
+        self.delegation_revoked = delegation_revoked
+
+    @property
+    def timestamp(self):
+        return epoch_to_datetime(self.timestamp_epoch)
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self.timestamp_epoch = datetime_to_epoch(value)
+
+    @property
+    def delegation_timestamp(self):
+        return epoch_to_datetime(self.delegation_epoch)
+
+    @delegation_timestamp.setter
+    def delegation_timestamp(self, value):
+        self.delegation_epoch = datetime_to_epoch(value)
+
+    @property
+    def muted(self):
+        return bool(self.flags & MUTED)
+
+    @muted.setter
+    def muted(self, value):
+        if value:
+            self.flags |= MUTED
+        else:
+            self.flags &= ~MUTED
+
+    @property
+    def delegation_revoked(self):
+        return bool(self.flags & DELEGATION_REVOKED)
+
+    @delegation_revoked.setter
+    def delegation_revoked(self, value):
+        if value:
+            self.flags |= DELEGATION_REVOKED
+        else:
+            self.flags &= ~DELEGATION_REVOKED
+
+    def pack(self):
+        return self.packer.pack(-1 if self.timestamp_epoch is None else self.timestamp_epoch,
+                                -1 if self.delegation_epoch is None else self.delegation_epoch,
+                                -1 if self.weight is None else self.weight,
+                                self.rc, self.hp, self.delegated_hp, self.rc_comments, self.flags)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        timestamp_epoch, delegation_epoch, weight, rc, hp, delegated_hp, rc_comments, flags = cls.packer.unpack_from(data, offset)
+        record = cls.__new__(cls)
+        record.timestamp_epoch = None if timestamp_epoch < 0 else timestamp_epoch
+        record.delegation_epoch = None if delegation_epoch < 0 else delegation_epoch
+        record.weight = None if weight < 0 else weight
+        record.rc = rc
+        record.hp = hp
+        record.delegated_hp = delegated_hp
+        record.rc_comments = rc_comments
+        record.flags = flags
+        return record
+
+    @classmethod
+    def from_dict(cls, account):
+        """Converts an account dict of older versions"""
+        return cls(**account)
+
+
+def write_snapshot(snapshot_file, accounts):
+    """ Writes all account records into a binary snapshot file
+
+        Each record is stored as the length of its name, the name and the
+        packed record. The file is replaced atomically.
+    """
+    tmp_file = snapshot_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack("<BI", SNAPSHOT_VERSION, len(accounts)))
+        for name in accounts:
+            encoded = name.encode("utf-8")
+            f.write(struct.pack("<B", len(encoded)) + encoded + accounts[name].pack())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, snapshot_file)
+
+
+def read_snapshot(snapshot_file):
+    """Reads all account records from a binary snapshot file"""
+    with open(snapshot_file, "rb") as f:
+        data = f.read()
+    if data[:4] != SNAPSHOT_MAGIC:
+        raise ValueError("%s is not an account snapshot" % snapshot_file)
+    version, count = struct.unpack_from("<BI", data, 4)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot version %d" % version)
+    offset = 9
+    accounts = {}
+    for i in range(count):
+        length = data[offset]
+        name = data[offset + 1:offset + 1 + length].decode("utf-8")
+        offset += 1 + length
+        accounts[name] = AccountRecord.unpack(data, offset)
+        offset += AccountRecord.packer.size
+    return accounts
@@ -0,0 +1,357 @@
+#!/usr/bin/python
+"""Offline replay of a block archive against the delegation policy
+
+A block archive is a JSONL file (optionally .gz or .zst compressed) with one
+block_api block per line. The blocks are streamed through the op handlers
+of DelegationOnboardBot without any node: accounts are read from a recorded
+state (data.sqlite or a binary account snapshot), broadcasts are simulated
+and the block time is used as clock. The granted and revoked delegations
+and the committed HP are reported over time.
+
+Record an archive:
+    python -m delegationonboardbot.replay record blocks.jsonl.gz 45000000 45028800
+
+Replay it with a changed config:
+    python -m delegationonboardbot.replay replay config.json blocks.jsonl.gz --snapshot data.sqlite
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import signal
+import time
+from beem import Hive
+from beem.nodelist import NodeList
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot, OP_TYPES, exit_on_sigterm, setup_logging
+from delegationonboardbot.chain import ChainParams
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.lookup import Lookups
+from delegationonboardbot.metrics import Metrics
+from delegationonboardbot.mutes import MuteTracker
+from delegationonboardbot.profiling import start_profile, write_profile
+from delegationonboardbot.query import AccountQuery
+from delegationonboardbot.record import read_snapshot, datetime_to_epoch
+from delegationonboardbot.store import StateStore
+from delegationonboardbot.stream import BlockStream
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def open_archive(archive_file, mode="rt"):
+    """Opens a plain, gzip or zstandard compressed block archive"""
+    if archive_file.endswith(".gz"):
+        return gzip.open(archive_file, mode)
+    if archive_file.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("zstandard is needed for %s" % archive_file)
+        f = open(archive_file, mode.replace("t", "b"))
+        if "w" in mode:
+            stream = zstandard.ZstdCompressor().stream_writer(f)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+        if "b" in mode:
+            return stream
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(archive_file, mode)
+
+
+def block_num_of(block):
+    if "block_num" in block:
+        return block["block_num"]
+    return int(block["block_id"][:8], 16)
+
+
+def write_archive(archive_file, block_stream, start, stop):
+    """Writes the blocks from start to stop (including) into a block archive"""
+    count = 0
+    with open_archive(archive_file, "wt") as f:
+        block_num = start
+        while block_num <= stop:
+            blocks = block_stream.get_blocks(block_num, min(block_stream.batch_size, stop - block_num + 1))
+            if len(blocks) == 0:
+                break
+            for block in blocks:
+                block["block_num"] = block_num
+                f.write(json.dumps(block) + "\n")
+                block_num += 1
+                count += 1
+    return count
+
+
+class ArchiveStream(BlockStream):
+    """ Streams the ops of a block archive
+
+        The archive is read sequentially, so blocks must be requested in
+        increasing order. next_block_num is the number of the next block in
+        the archive, or None at its end.
+    """
+    def __init__(self, archive_file, op_names=None, batch_size=50):
+        BlockStream.__init__(self, None, op_names, batch_size)
+        self.archive = open_archive(archive_file)
+        self.next_block = None
+        self.read_next()
+
+    def read_next(self):
+        line = self.archive.readline()
+        while line.strip() == "" and line != "":
+            line = self.archive.readline()
+        if line == "":
+            self.next_block = None
+            self.next_block_num = None
+            self.archive.close()
+            return
+        self.next_block = json.loads(line)
+        self.next_block_num = block_num_of(self.next_block)
+
+    def get_blocks(self, start, count):
+        while self.next_block is not None and self.next_block_num < start:
+            self.read_next()
+        blocks = []
+        while self.next_block is not None and self.next_block_num == start + len(blocks) and len(blocks) < count:
+            blocks.append(self.next_block)
+            self.read_next()
+        return blocks
+
+
+class SimulatedBroadcaster(object):
+    """Broadcaster replacement which reports every op as successful"""
+    def __init__(self):
+        self.results = queue.Queue()
+        self.delegations = 0
+        self.transfers = 0
+
+    def set_account(self, account):
+        pass
+
+    def delegate(self, delegatee, vests, callback=None):
+        self.delegations += 1
+        self.results.put(callback)
+
+    def transfer(self, to, amount, asset, memo, callback=None):
+        self.transfers += 1
+        self.results.put(callback)
+
+    def pending(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def process_results(self):
+        while not self.results.empty():
+            callback = self.results.get()
+            if callback is not None:
+                callback(True)
+
+    def wait(self):
+        self.process_results()
+
+
+class ReplayBot(DelegationOnboardBot):
+    """ DelegationOnboardBot which runs without a node
+
+        Account data are never refreshed, the delegations of the real
+        delegationAccount in the archive are ignored and the time of the
+        last streamed block is used as clock.
+
+        :param dict config: bot config
+        :param dict accounts: account name -> AccountRecord
+        :param float hive_per_mvest: HIVE per MVESTS, used for HP/VESTS conversions
+        :param str data_file: sqlite file for the bot state, in memory by default
+    """
+    def __init__(self, config, accounts, hive_per_mvest=500., data_file=":memory:"):
+        self.config = dict(config)
+        self.config["no_broadcast"] = False
+        self.config.setdefault("print_log_at_block", 28800)
+        self.data_file = data_file
+        self.store = StateStore(data_file)
+        self.metrics = Metrics()
+        self.store.metrics = self.metrics
+        self.accounts = accounts
+        # the replayed state is not persisted
+        self.journal = Journal(None)
+        self.dirty_accounts = set()
+        self.open_intents = {}
+        self.block_num = None
+        self.mute_tracker = MuteTracker(self.store, self.config["muteAccount"])
+        self.last_block_num = None
+        self.add_maintenance_tasks()
+        self.hive = None
+        self.op_handlers = dict((op_type, getattr(self, "handle_" + op_type)) for op_type in OP_TYPES)
+        self.log_data = {"start_time": 0, "last_block_num": None, "new_commands": 0, "start_block_num": 0,
+                         "stop_block_num": 0, "time_for_blocks": 0, "op_count": 0}
+        self.catchup_stream = None
+        self.chain = ChainParams.from_values(hive_per_mvest, 1e6, 1.)
+        self.broadcaster = SimulatedBroadcaster()
+        # never used, accounts are not refreshed
+        self.lookups = Lookups(None)
+        self.pending_accounts = set()
+        self.unresolved_posts = {}
+        self.ready = True
+        self.startup_future = None
+        self.snapshot_valid = False
+        self.clock = None
+        self.op_count = 0
+        self.granted = 0
+        self.revoked = 0
+        self.committed_hp = sum(acc.delegated_hp for acc in accounts.values()
+                                if acc.delegated_hp > 0 and not acc.delegation_revoked)
+        self.build_index()
+
+    def now(self):
+        if self.clock is None:
+            return time.time()
+        return datetime_to_epoch(self.clock)
+
+    def process_op(self, op, active_accounts):
+        self.clock = op["timestamp"]
+        self.op_count += 1
+        DelegationOnboardBot.process_op(self, op, active_accounts)
+
+    def refresh_accounts(self, account_names, callback=None, batch_size=1000):
+        if callback is not None:
+            callback([account for account in account_names if account in self.accounts])
+
+    def check_for_sufficient_hp(self):
+        pass
+
+    def queue_unresolved_posts(self):
+        # posts without a comment_options op have no beneficiaries
+        for author, permlink in self.unresolved_posts:
+            self.check_beneficiaries(author, [])
+        self.unresolved_posts = {}
+
+    def process_beneficiary_queue(self):
+        pass
+
+    def handle_delegate_vesting_shares(self, op, active_accounts):
+        pass
+
+    def on_delegation_added(self, account, timestamp, ok, msg, hp=None):
+        if ok:
+            self.granted += 1
+            self.committed_hp += self.config["delegationAmount"] if hp is None else hp
+        DelegationOnboardBot.on_delegation_added(self, account, timestamp, ok, msg, hp)
+
+    def on_delegation_removed(self, account, ok, msg, reason=None):
+        if ok:
+            self.revoked += 1
+            self.committed_hp -= self.accounts[account].delegated_hp
+        DelegationOnboardBot.on_delegation_removed(self, account, ok, msg, reason)
+
+
+def replay(bot, stream, run_blocks=20, report_interval=24 * 60 * 60):
+    """ Streams all blocks of an archive through bot
+
+        Blocks are processed in ranges of run_blocks blocks like in the live
+        bot. Returns a list of (block time, block_num, granted, revoked,
+        committed HP) samples, one per report_interval seconds of block time,
+        and the number of processed blocks.
+    """
+    samples = []
+    blocks = 0
+    next_report = None
+    while stream.next_block_num is not None:
+        start_block = stream.next_block_num
+        bot.run_checks()
+        with bot.store.transaction():
+            active_accounts = {}
+            last_block_num = bot.process_stream(stream, start_block, start_block + run_blocks - 1, active_accounts)
+            bot.process_active_accounts(active_accounts)
+        bot.process_results()
+        bot.last_block_num = last_block_num
+        blocks += last_block_num - start_block + 1
+        if bot.clock is None:
+            continue
+        now = bot.now()
+        if next_report is None:
+            next_report = now
+        if now >= next_report:
+            samples.append((bot.clock, last_block_num, bot.granted, bot.revoked, bot.committed_hp))
+            next_report += report_interval
+    if bot.clock is not None:
+        samples.append((bot.clock, last_block_num, bot.granted, bot.revoked, bot.committed_hp))
+    return samples, blocks
+
+
+def load_accounts(snapshot_file):
+    """ Reads the accounts from a data.sqlite state file or a binary account snapshot
+
+        The state file is opened read-only, so that it can be replayed
+        next to the running bot.
+    """
+    if snapshot_file.endswith(".sqlite"):
+        query = AccountQuery(snapshot_file)
+        try:
+            return query.load_accounts()
+        finally:
+            query.close()
+    return read_snapshot(snapshot_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logconfig", help="Logger Config file in JSON format", default='logger.json')
+    subparsers = parser.add_subparsers(dest="command")
+    record_parser = subparsers.add_parser("record", help="Writes a block range into a block archive")
+    record_parser.add_argument("archive", help="Block archive (.jsonl, .jsonl.gz or .jsonl.zst)")
+    record_parser.add_argument("start", type=int)
+    record_parser.add_argument("stop", type=int)
+    replay_parser = subparsers.add_parser("replay", help="Replays a block archive")
+    replay_parser.add_argument("config", help="Config file in JSON format")
+    replay_parser.add_argument("archive", help="Block archive (.jsonl, .jsonl.gz or .jsonl.zst)")
+    replay_parser.add_argument("--snapshot", help="data.sqlite or account snapshot with the initial accounts", default="data.sqlite")
+    replay_parser.add_argument("--hive-per-mvest", type=float, default=500.)
+    replay_parser.add_argument("--run-blocks", help="Number of blocks which are processed per run", type=int, default=20)
+    replay_parser.add_argument("--report-hours", type=float, default=24)
+    replay_parser.add_argument("--verbose", help="Log every simulated broadcast", action="store_true")
+    replay_parser.add_argument("--profile", help="Writes cProfile stats into this file and prints op latencies")
+    args = parser.parse_args()
+
+    setup_logging(default_path=args.logconfig)
+
+    if args.command == "record":
+        nodelist = NodeList()
+        nodelist.update_nodes()
+        hive = Hive(node=nodelist.get_hive_nodes(), num_retries=5, call_num_retries=3, timeout=15)
+        count = write_archive(args.archive, BlockStream(hive), args.start, args.stop)
+        print("%d blocks written to %s" % (count, args.archive))
+        return
+    if args.command != "replay":
+        parser.print_help()
+        return
+
+    if not args.verbose:
+        logging.getLogger("delegationonboardbot.delegationonboardbot").setLevel(logging.WARNING)
+    config = json.loads(open(os.path.abspath(args.config)).read())
+    accounts = load_accounts(args.snapshot)
+    bot = ReplayBot(config, accounts, hive_per_mvest=args.hive_per_mvest)
+    stream = ArchiveStream(args.archive, OP_TYPES, batch_size=args.run_blocks)
+    if args.profile:
+        # the profile is also written when the replay is stopped with Ctrl+C or SIGTERM
+        signal.signal(signal.SIGTERM, exit_on_sigterm)
+        profiler, timer = start_profile(bot)
+    start = time.time()
+    try:
+        samples, blocks = replay(bot, stream, run_blocks=args.run_blocks, report_interval=args.report_hours * 60 * 60)
+    finally:
+        if args.profile:
+            write_profile(profiler, timer, args.profile)
+    duration = time.time() - start
+
+    print("%-20s %10s %8s %8s %14s" % ("block time", "block_num", "granted", "revoked", "committed HP"))
+    for clock, block_num, granted, revoked, committed_hp in samples:
+        print("%-20s %10d %8d %8d %14.3f" % (clock.strftime("%Y-%m-%dT%H:%M:%S"), block_num, granted, revoked, committed_hp))
+    print("%d accounts, %d blocks, %d ops in %.2f s: %.0f blocks/s, %.0f ops/s" % (
+        len(accounts), blocks, bot.op_count, duration, blocks / max(duration, 1e-9), bot.op_count / max(duration, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
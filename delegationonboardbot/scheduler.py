@@ -0,0 +1,105 @@
+#!/usr/bin/python
+import logging
+import time
+from beem.utils import formatTimeString
+from delegationonboardbot.record import datetime_to_epoch
+
+logger = logging.getLogger(__name__)
+
+# seconds between two Hive blocks
+BLOCK_INTERVAL = 3
+
+
+class BlockScheduler(object):
+    """ Sizes the block ranges of the main loop and waits for new blocks at the head
+
+        Behind the head, a range is sized from the measured processing rate
+        so that one run takes about run_seconds, with at least catchup_lag
+        and at most max_window blocks. At the head, all new blocks are
+        processed at once, and the next head poll waits until the next block
+        is due from the timestamp of the last head block.
+
+        :param int catchup_lag: ranges which are more blocks behind the head are processed in catch-up mode
+        :param int max_window: maximum number of blocks per run
+        :param float run_seconds: target duration of a catch-up run
+        :param float alpha: smoothing factor of the processing rate
+    """
+    def __init__(self, catchup_lag=100, max_window=2000, run_seconds=30, alpha=0.3):
+        self.catchup_lag = catchup_lag
+        self.max_window = max_window
+        self.run_seconds = run_seconds
+        self.alpha = alpha
+        # processed blocks per second
+        self.rate = None
+        self.head_block_num = None
+        self.head_time = None
+
+    def record_run(self, blocks, seconds):
+        if blocks <= 0 or seconds <= 0:
+            return
+        rate = blocks / seconds
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = self.alpha * rate + (1 - self.alpha) * self.rate
+
+    def update_head(self, props):
+        """Stores head block number and time from the dynamic global properties"""
+        self.head_block_num = props["head_block_number"]
+        self.head_time = datetime_to_epoch(formatTimeString(props["time"]))
+
+    def next_range(self, start_block):
+        """ Returns (stop_block, catchup) for a range starting at start_block
+
+            stop_block is None when start_block is not produced yet.
+        """
+        lag = self.head_block_num - start_block + 1
+        if lag <= 0:
+            return None, False
+        if lag <= self.catchup_lag:
+            return self.head_block_num, False
+        if self.rate is None:
+            window = self.max_window
+        else:
+            window = int(self.rate * self.run_seconds)
+        window = max(self.catchup_lag, min(window, self.max_window))
+        return min(start_block + window - 1, self.head_block_num), True
+
+    def wait_time(self, block_num, now=None):
+        """Returns the seconds until block_num is expected from the time of the last head block"""
+        if now is None:
+            now = time.time()
+        due = self.head_time + (block_num - self.head_block_num) * BLOCK_INTERVAL
+        # the block needs some time to reach the node
+        return min(max(due - now + 0.5, 0.2), BLOCK_INTERVAL)
+
+
+class Maintenance(object):
+    """ Runs maintenance tasks on their own block cadence
+
+        A task runs when interval blocks were processed since its last run,
+        and always on its first call or when no block number is known. Tasks
+        which are given by name are looked up on obj when they run, so that
+        instrumented methods are used.
+
+        :param obj: object whose methods are run by name
+    """
+    def __init__(self, obj=None):
+        self.obj = obj
+        # [task, interval, block_num of the last run]
+        self.tasks = []
+
+    def add(self, task, interval, block_num=None):
+        """Adds a method name of obj or a function, block_num is used as block of the last run"""
+        self.tasks.append([task, interval, block_num])
+
+    def run_due(self, block_num):
+        for task in self.tasks:
+            func, interval, last_block_num = task
+            if last_block_num is not None and block_num is not None and block_num - last_block_num < interval:
+                continue
+            task[2] = block_num
+            if isinstance(func, str):
+                getattr(self.obj, func)()
+            else:
+                func()
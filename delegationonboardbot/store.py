@@ -0,0 +1,180 @@
+#!/usr/bin/python
+import sqlite3
+import shelve
+import json
+import logging
+import time
+from contextlib import contextmanager
+from delegationonboardbot.record import AccountRecord
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_FIELDS = ["timestamp", "weight", "muted", "rc", "hp", "delegated_hp", "delegation_timestamp",
+                  "rc_comments", "delegation_revoked"]
+
+
+def account_to_row(name, account):
+    return (name, account.timestamp_epoch, account.weight, int(account.muted), account.rc, account.hp,
+            account.delegated_hp, account.delegation_epoch, account.rc_comments, int(account.delegation_revoked))
+
+
+def row_to_account(row):
+    account = AccountRecord(weight=row[2], muted=bool(row[3]), rc=row[4], hp=row[5], delegated_hp=row[6],
+                            rc_comments=row[8], delegation_revoked=bool(row[9]))
+    account.timestamp_epoch = row[1]
+    account.delegation_epoch = row[7]
+    return account
+
+
+class StateStore(object):
+    """ Stores the bot state in a sqlite file
+
+        Accounts are stored as one row per account, so that a changed
+        account can be written without rewriting all others. All other
+        values are stored as json in a key/value table.
+
+        :param str data_file: path to the sqlite file
+    """
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.conn = sqlite3.connect(data_file)
+        # readers like the query module do not block the bot and are not blocked by it
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.batch_depth = 0
+        # Metrics instance, which receives the commit latency
+        self.metrics = None
+        self.conn.execute("CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, timestamp INTEGER, "
+                          "weight INTEGER, muted INTEGER, rc REAL, hp REAL, delegated_hp REAL, "
+                          "delegation_timestamp INTEGER, rc_comments REAL, delegation_revoked INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS beneficiary_queue (author TEXT, permlink TEXT, "
+                          "attempts INTEGER, next_try INTEGER, PRIMARY KEY (author, permlink))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS mutes (account TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS revocations (name TEXT PRIMARY KEY, reason TEXT, timestamp INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS accounts_delegation ON accounts "
+                          "(delegation_revoked, delegation_timestamp)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS revocations_reason ON revocations (reason)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """ Collects all writes inside the with block into one transaction
+
+            Nested calls are merged into the outermost transaction. Writes are
+            also committed when an exception is raised, as they may reflect
+            broadcasts which are already on chain.
+        """
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.commit()
+
+    def commit(self):
+        start = time.time()
+        self.conn.commit()
+        if self.metrics is not None:
+            self.metrics.observe("store_commit_seconds", time.time() - start)
+
+    def _commit(self):
+        if self.batch_depth == 0:
+            self.commit()
+
+    def get(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        self._commit()
+
+    def keys(self):
+        return [row[0] for row in self.conn.execute("SELECT key FROM kv")]
+
+    def load_accounts(self):
+        accounts = {}
+        for row in self.conn.execute("SELECT name, %s FROM accounts" % ", ".join(ACCOUNT_FIELDS)):
+            accounts[row[0]] = row_to_account(row)
+        return accounts
+
+    def store_account(self, name, account):
+        self.conn.execute("INSERT OR REPLACE INTO accounts (name, %s) VALUES (?, %s)" % (
+            ", ".join(ACCOUNT_FIELDS), ", ".join(["?"] * len(ACCOUNT_FIELDS))), account_to_row(name, account))
+        self._commit()
+
+    def store_accounts(self, accounts):
+        self.conn.executemany("INSERT OR REPLACE INTO accounts (name, %s) VALUES (?, %s)" % (
+            ", ".join(ACCOUNT_FIELDS), ", ".join(["?"] * len(ACCOUNT_FIELDS))),
+            [account_to_row(name, accounts[name]) for name in accounts])
+        self._commit()
+
+    def store_revocation(self, name, reason, timestamp):
+        """Stores why and when the delegation to name was removed"""
+        self.conn.execute("INSERT OR REPLACE INTO revocations (name, reason, timestamp) VALUES (?, ?, ?)",
+                          (name, reason, int(timestamp)))
+        self._commit()
+
+    def queue_beneficiary_check(self, author, permlink, next_try, attempts=0):
+        self.conn.execute("INSERT OR REPLACE INTO beneficiary_queue (author, permlink, attempts, next_try) "
+                          "VALUES (?, ?, ?, ?)", (author, permlink, attempts, int(next_try)))
+        self._commit()
+
+    def remove_beneficiary_check(self, author, permlink):
+        self.conn.execute("DELETE FROM beneficiary_queue WHERE author = ? AND permlink = ?", (author, permlink))
+        self._commit()
+
+    def get_due_beneficiary_checks(self, now, limit=20):
+        """Returns (author, permlink, attempts) of the checks with next_try <= now"""
+        return self.conn.execute("SELECT author, permlink, attempts FROM beneficiary_queue WHERE next_try <= ? "
+                                 "ORDER BY next_try LIMIT ?", (int(now), limit)).fetchall()
+
+    def load_mutes(self):
+        return set(row[0] for row in self.conn.execute("SELECT account FROM mutes"))
+
+    def add_mute(self, account):
+        self.conn.execute("INSERT OR IGNORE INTO mutes (account) VALUES (?)", (account, ))
+        self._commit()
+
+    def remove_mute(self, account):
+        self.conn.execute("DELETE FROM mutes WHERE account = ?", (account, ))
+        self._commit()
+
+    def replace_mutes(self, accounts):
+        self.conn.execute("DELETE FROM mutes")
+        self.conn.executemany("INSERT OR IGNORE INTO mutes (account) VALUES (?)", [(account, ) for account in accounts])
+        self._commit()
+
+    def is_empty(self):
+        if self.conn.execute("SELECT 1 FROM accounts LIMIT 1").fetchone() is not None:
+            return False
+        return self.conn.execute("SELECT 1 FROM kv LIMIT 1").fetchone() is None
+
+    def migrate_shelve(self, shelve_file):
+        """ Imports the content of an old shelve data file
+
+            The migration is only done when the store is still empty and
+            the shelve file exists. Returns True when data was imported.
+        """
+        if not self.is_empty():
+            return False
+        try:
+            data_db = shelve.open(shelve_file, flag="r")
+        except Exception:
+            return False
+        logger.info("Migrating %s into %s" % (shelve_file, self.data_file))
+        with self.transaction():
+            for key in data_db:
+                if key == "accounts":
+                    accounts = data_db[key]
+                    self.store_accounts(dict((name, AccountRecord.from_dict(accounts[name])) for name in accounts))
+                else:
+                    self.set(key, data_db[key])
+        data_db.close()
+        return True
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+from beem.utils import formatTimeString
+from beemapi.exceptions import NoMethodWithName, NoApiWithName, ApiNotSupported
+
+logger = logging.getLogger(__name__)
+
+
+def block_ops(block, block_num, op_names=None):
+    """ Yields the operations of a raw block_api block as op dicts
+
+        Operations whose type is not in op_names are skipped before their
+        op dict is built. The op dicts are similar to the ones returned by
+        beem's Blockchain.stream.
+
+        :param dict block: block as returned by block_api.get_block_range
+        :param int block_num: block number of the block
+        :param set op_names: op types without the _operation suffix, None for all
+    """
+    timestamp = None
+    transaction_ids = block.get("transaction_ids", [])
+    for trx_num, trx in enumerate(block["transactions"]):
+        for op_in_trx, op in enumerate(trx["operations"]):
+            if isinstance(op, dict):
+                op_type = op["type"]
+                value = op["value"]
+            else:
+                op_type = op[0]
+                value = op[1]
+            if op_type.endswith("_operation"):
+                op_type = op_type[:-10]
+            if op_names is not None and op_type not in op_names:
+                continue
+            if timestamp is None:
+                timestamp = formatTimeString(block["timestamp"])
+            op_dict = dict(value)
+            op_dict["type"] = op_type
+            op_dict["block_num"] = block_num
+            op_dict["timestamp"] = timestamp
+            op_dict["trx_num"] = trx_num
+            op_dict["op_in_trx"] = op_in_trx
+            if trx_num < len(transaction_ids):
+                op_dict["trx_id"] = transaction_ids[trx_num]
+            yield op_dict
+
+
+class BlockStream(object):
+    """ Streams the non-virtual operations of a block range
+
+        Blocks are fetched with block_api.get_block_range, batch_size blocks
+        per call. When the node does not support it, each block is fetched
+        with block_api.get_block. Only ops with a type from op_names are
+        turned into op dicts.
+
+        :param Hive hive: Hive instance
+        :param list op_names: op types which should be returned, None for all
+        :param int batch_size: number of blocks which are fetched per call
+    """
+    def __init__(self, hive, op_names=None, batch_size=50):
+        self.hive = hive
+        if op_names is not None:
+            op_names = set(op_names)
+        self.op_names = op_names
+        self.batch_size = batch_size
+        self.use_block_range = True
+        self.last_block_num = None
+
+    def get_blocks(self, start, count):
+        if self.use_block_range:
+            try:
+                return self.hive.rpc.get_block_range({"starting_block_num": start, "count": count}, api="block")["blocks"]
+            except (NoMethodWithName, NoApiWithName, ApiNotSupported):
+                logger.warning("block_api.get_block_range is not supported, blocks are fetched one by one")
+                self.use_block_range = False
+        blocks = []
+        for block_num in range(start, start + count):
+            ret = self.hive.rpc.get_block({"block_num": block_num}, api="block")
+            if not ret or "block" not in ret:
+                break
+            blocks.append(ret["block"])
+        return blocks
+
+    def stream(self, start, stop):
+        """Yields all ops from block start to block stop (including)"""
+        self.last_block_num = start - 1
+        block_num = start
+        while block_num <= stop:
+            blocks = self.get_blocks(block_num, min(self.batch_size, stop - block_num + 1))
+            if len(blocks) == 0:
+                break
+            for block in blocks:
+                for op in block_ops(block, block_num, self.op_names):
+                    yield op
+                self.last_block_num = block_num
+                block_num += 1
+
+
+class ParallelBlockStream(BlockStream):
+    """ Streams a block range by fetching block batches concurrently
+
+        Each Hive instance is used by one fetch thread at a time, so that the
+        batches are spread over several nodes. Batches are fetched ahead of
+        time, but the ops are returned strictly in block order.
+
+        :param list hive_instances: one Hive instance per fetch thread
+        :param list op_names: op types which should be returned, None for all
+        :param int batch_size: number of blocks which are fetched per call
+        :param int prefetch: number of batches which are fetched ahead
+            (default is twice the number of Hive instances)
+    """
+    def __init__(self, hive_instances, op_names=None, batch_size=50, prefetch=None):
+        BlockStream.__init__(self, hive_instances[0], op_names, batch_size)
+        self.free_streams = queue.Queue()
+        for hive in hive_instances:
+            self.free_streams.put(BlockStream(hive, op_names, batch_size))
+        self.threads = len(hive_instances)
+        self.prefetch = prefetch or 2 * self.threads
+
+    def fetch(self, start, count):
+        block_stream = self.free_streams.get()
+        try:
+            return block_stream.get_blocks(start, count)
+        finally:
+            self.free_streams.put(block_stream)
+
+    def stream(self, start, stop):
+        """Yields all ops from block start to block stop (including)"""
+        self.last_block_num = start - 1
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            batches = deque()
+            next_block_num = start
+            while next_block_num <= stop or len(batches) > 0:
+                while next_block_num <= stop and len(batches) < self.prefetch:
+                    count = min(self.batch_size, stop - next_block_num + 1)
+                    batches.append((next_block_num, count, executor.submit(self.fetch, next_block_num, count)))
+                    next_block_num += count
+                block_num, count, future = batches.popleft()
+                blocks = future.result()
+                for block in blocks:
+                    for op in block_ops(block, block_num, self.op_names):
+                        yield op
+                    self.last_block_num = block_num
+                    block_num += 1
+                if len(blocks) < count:
+                    # the node has not all blocks yet, the next batches cannot be used
+                    for batch in batches:
+                        batch[2].cancel()
+                    break
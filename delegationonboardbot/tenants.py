@@ -0,0 +1,222 @@
+#!/usr/bin/python
+import logging
+import os
+from contextlib import ExitStack
+from beem.blockchain import Blockchain
+from delegationonboardbot.utils import print_block_log
+from delegationonboardbot.stream import BlockStream, ParallelBlockStream
+from delegationonboardbot.metrics import instrument_rpc
+
+logger = logging.getLogger(__name__)
+
+# op field with the account which decides about the tenants of an op,
+# custom_json ops are routed by their first auth, create_claimed_account ops to all tenants
+ROUTING_FIELDS = {"comment": "author", "comment_options": "author", "vote": "voter", "transfer": "from",
+                  "delegate_vesting_shares": "delegator"}
+OP_TYPES = list(ROUTING_FIELDS.keys()) + ["custom_json", "create_claimed_account"]
+
+
+def tenant_configs(config):
+    """ Returns tenant name -> config of a multi-tenant config
+
+        Every entry of config["tenants"] is merged into the top-level
+        values, so that shared values like nodes or wallet_password need to
+        be given only once.
+    """
+    shared = dict((key, value) for key, value in config.items() if key != "tenants")
+    configs = {}
+    for name in config["tenants"]:
+        tenant_config = dict(shared)
+        tenant_config.update(config["tenants"][name])
+        configs[name] = tenant_config
+    return configs
+
+
+def tenant_data_file(datadir, name, create=True):
+    """ Returns the sqlite file of a tenant, every tenant has its own directory in datadir
+
+        The directory is created when create is set, readers like
+        --list-accounts leave it out.
+    """
+    tenant_dir = os.path.join(datadir, name)
+    if create and not os.path.exists(tenant_dir):
+        os.makedirs(tenant_dir)
+    return os.path.join(tenant_dir, "data.sqlite")
+
+
+class TenantGroup(object):
+    """ Runs several DelegationOnboardBot tenants on one shared block stream
+
+        Every block is fetched and parsed once. Each op is routed through
+        an account -> tenants index to the tenants which track the account
+        or use it as delegationAccount or muteAccount. The tenants keep their
+        own state, wallet, broadcaster and config. A tenant whose state is
+        ahead of the shared stream skips the blocks it has processed already.
+
+        Provides the methods of DelegationOnboardBot which are used by main.
+
+        :param dict bots: tenant name -> DelegationOnboardBot
+        :param Hive hived_instance: Hive instance for the shared stream
+        :param dict config: shared config
+        :param Metrics metrics: metrics of the shared stream
+        :param hive_factory: returns a new Hive instance, used for the tenants when the node is switched
+    """
+    def __init__(self, bots, hived_instance, config, metrics, hive_factory):
+        self.bots = bots
+        self.config = config
+        self.metrics = metrics
+        self.hive_factory = hive_factory
+        self.catchup_stream = None
+        self.log_data = {"start_time": 0, "last_block_num": None, "new_commands": 0, "start_block_num": 0,
+                         "stop_block_num": 0, "time_for_blocks": 0, "op_count": 0}
+        self.set_stream_hive(hived_instance)
+        self.build_index()
+
+    @property
+    def ready(self):
+        return all(bot.ready for bot in self.bots.values())
+
+    @property
+    def last_block_num(self):
+        """Returns the last block which was processed by all tenants"""
+        block_nums = [bot.last_block_num for bot in self.bots.values() if bot.last_block_num is not None]
+        if len(block_nums) == 0:
+            return None
+        return min(block_nums)
+
+    def set_stream_hive(self, hived_instance):
+        self.hive = hived_instance
+        instrument_rpc(self.hive, self.metrics)
+        self.blockchain = Blockchain(mode='head', blockchain_instance=self.hive)
+        self.block_stream = BlockStream(self.hive, OP_TYPES, batch_size=self.config.get("stream_batch_size", 50))
+
+    def set_hive(self, hived_instance, broadcast_instance=None, lookup_instance=None):
+        """Switches the shared stream to hived_instance and every tenant to new instances from hive_factory"""
+        self.set_stream_hive(hived_instance)
+        for bot in self.bots.values():
+            bot.set_hive(self.hive_factory(), broadcast_instance=self.hive_factory(), lookup_instance=self.hive_factory())
+
+    def enable_catchup(self, hive_instances):
+        for hive in hive_instances:
+            instrument_rpc(hive, self.metrics)
+        self.catchup_stream = ParallelBlockStream(hive_instances, OP_TYPES,
+                                                  batch_size=self.config.get("stream_batch_size", 50))
+
+    def build_index(self):
+        self.index = {}
+        for bot in self.bots.values():
+            for account in bot.accounts:
+                self.index_account(account, bot)
+            self.index_account(bot.config["delegationAccount"], bot)
+            self.index_account(bot.config["muteAccount"], bot)
+        self.indexed_accounts = sum(len(bot.accounts) for bot in self.bots.values())
+
+    def index_account(self, account, bot):
+        bots = self.index.setdefault(account, [])
+        if bot not in bots:
+            bots.append(bot)
+
+    def route(self, op):
+        """Returns the tenants of an op"""
+        op_type = op["type"]
+        if op_type == "custom_json":
+            if len(op["required_posting_auths"]) > 0:
+                account = op["required_posting_auths"][0]
+            elif len(op["required_auths"]) > 0:
+                account = op["required_auths"][0]
+            else:
+                return []
+        elif op_type == "create_claimed_account":
+            return list(self.bots.values())
+        else:
+            account = op[ROUTING_FIELDS[op_type]]
+        return self.index.get(account, [])
+
+    def run(self, start_block, stop_block, catchup=False, head_block_num=None):
+        if head_block_num is None:
+            head_block_num = self.blockchain.get_current_block_num()
+        current_block = head_block_num
+        for bot in self.bots.values():
+            if not bot.prepare_run(current_block):
+                return
+        if stop_block is None or stop_block > current_block:
+            stop_block = current_block
+        if start_block is None:
+            start_block = current_block
+        self.metrics.set("head_block_num", current_block)
+        self.metrics.set("head_lag_blocks", current_block - start_block + 1)
+        if catchup and self.catchup_stream is not None:
+            block_stream = self.catchup_stream
+        else:
+            block_stream = self.block_stream
+
+        for bot in self.bots.values():
+            bot.run_checks()
+        if sum(len(bot.accounts) for bot in self.bots.values()) != self.indexed_accounts:
+            # referred accounts were added on startup or by a reconciliation
+            self.build_index()
+
+        self.log_data["start_block_num"] = start_block
+        self.log_data["stop_block_num"] = stop_block
+        with ExitStack() as stack:
+            for bot in self.bots.values():
+                stack.enter_context(bot.store.transaction())
+            active_accounts = dict((bot, {}) for bot in self.bots.values())
+            last_block_num = self.process_stream(block_stream, start_block, stop_block, active_accounts)
+            for bot in self.bots.values():
+                bot.process_active_accounts(active_accounts[bot])
+        for bot in self.bots.values():
+            bot.finish_run(last_block_num)
+        return last_block_num
+
+    def process_stream(self, block_stream, start_block, stop_block, active_accounts):
+        """Routes all ops of a block range to the tenants and returns the last processed block number"""
+        flush_blocks = self.config.get("broadcast_flush_blocks", 10)
+        flush_block_num = start_block + flush_blocks
+        op_counts = {}
+        for op in block_stream.stream(start_block, stop_block):
+            self.log_data = print_block_log(self.log_data, op, self.config["print_log_at_block"])
+            if op["block_num"] >= flush_block_num:
+                for bot in self.bots.values():
+                    bot.journal.sync()
+                    bot.broadcaster.flush()
+                flush_block_num = op["block_num"] + flush_blocks
+            op_counts[op["type"]] = op_counts.get(op["type"], 0) + 1
+            for bot in self.route(op):
+                if bot.last_block_num is not None and op["block_num"] <= bot.last_block_num:
+                    continue
+                bot.block_num = op["block_num"]
+                bot.process_results()
+                if op["type"] == "create_claimed_account":
+                    self.process_create_claimed_account(bot, op, active_accounts[bot])
+                else:
+                    bot.process_op(op, active_accounts[bot])
+        for op_type in op_counts:
+            self.metrics.inc("ops_total", op_counts[op_type], labels=(("type", op_type), ))
+        if block_stream.last_block_num is not None and block_stream.last_block_num >= start_block:
+            self.metrics.inc("blocks_total", block_stream.last_block_num - start_block + 1)
+            self.metrics.set("last_block_num", block_stream.last_block_num)
+        return block_stream.last_block_num
+
+    def process_create_claimed_account(self, bot, op, active_accounts):
+        """Passes a create_claimed_account op to bot and adds a new referred account to the index"""
+        account = op["new_account_name"]
+        known = account in bot.accounts
+        bot.process_op(op, active_accounts)
+        if not known and account in bot.accounts:
+            self.index_account(account, bot)
+            self.indexed_accounts += 1
+
+    def reconcile(self):
+        for bot in self.bots.values():
+            bot.reconcile()
+
+    def save_snapshot(self, block_num):
+        """Checkpoints every tenant at its own last block and writes its snapshot, block_num is not used"""
+        for bot in self.bots.values():
+            if bot.last_block_num is not None:
+                bot.save_snapshot(bot.last_block_num)
+
+    def close(self):
+        for bot in self.bots.values():
+            bot.close()
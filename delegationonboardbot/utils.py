@@ -1,12 +1,16 @@
 #!/usr/bin/python
 import time
-import shelve
 import json
 import logging
 import argparse
 import os
 import sys
 from beem.account import Account
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from beem.constants import STEEM_VOTING_MANA_REGENERATION_SECONDS
+from delegationonboardbot.store import StateStore
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -21,6 +25,7 @@ def print_block_log(log_data, op, print_log_at_block=100):
     start_block_num = log_data["start_block_num"]
     stop_block_num = log_data["stop_block_num"]
     time_for_blocks = log_data["time_for_blocks"]
+    op_count = log_data.get("op_count", 0) + 1
     
     if last_block_num is None:
         start_time = time.time()
@@ -28,6 +33,10 @@ def print_block_log(log_data, op, print_log_at_block=100):
     if (op["block_num"] - last_block_num) > print_log_at_block:
         time_for_blocks = time.time() - start_time
         logger.info("---------------------")
+        if time_for_blocks > 0:
+            logger.info("Throughput: %.2f blocks/s -- %.2f ops/s" % ((op["block_num"] - last_block_num) / time_for_blocks,
+                                                                 op_count / time_for_blocks))
+        op_count = 0
         # print extended log when block log difference is greater than 100
         if print_log_at_block > 100 and (stop_block_num - start_block_num) > 0:
             percentage_done = (op["block_num"] - start_block_num) / (stop_block_num - start_block_num) * 100
@@ -43,6 +52,7 @@ def print_block_log(log_data, op, print_log_at_block=100):
     log_data["start_time"] = start_time
     log_data["last_block_num"] = last_block_num
     log_data["time_for_blocks"] = time_for_blocks
+    log_data["op_count"] = op_count
     return log_data
 
 
@@ -58,15 +68,48 @@ def check_config(config, necessary_fields, hive):
         raise Exception("Broken config, shutdown bot...")
     logger.info("config was found.")
 
+def get_current_rc_mana(rc_account):
+    """Returns the regenerated current RC mana of a find_rc_accounts entry"""
+    max_mana = int(rc_account["max_rc"])
+    last_mana = int(rc_account["rc_manabar"]["current_mana"])
+    diff_in_seconds = time.time() - rc_account["rc_manabar"]["last_update_time"]
+    current_mana = int(last_mana + diff_in_seconds * max_mana / STEEM_VOTING_MANA_REGENERATION_SECONDS)
+    if current_mana > max_mana:
+        current_mana = max_mana
+    return current_mana
+
+def get_beneficiaries(extensions):
+    """Returns the beneficiaries list from the extensions of a comment_options op"""
+    for extension in extensions:
+        if isinstance(extension, dict):
+            value = extension["value"]
+        else:
+            value = extension[1]
+        if "beneficiaries" in value:
+            return value["beneficiaries"]
+    return []
+
+def create_session(retries=5):
+    """Returns a requests session with connection pooling, which retries failed requests"""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 def store_data(data_file, parameter, value):
-    data_db = shelve.open(data_file)
-    data_db[parameter] = value
-    data_db.close()
+    store = StateStore(data_file)
+    if parameter == "accounts":
+        store.store_accounts(value)
+    else:
+        store.set(parameter, value)
+    store.close()
 
 def read_data(data_file):
-    data = {}
-    data_db = shelve.open(data_file)
-    for key in data_db:
-        data[key] = data_db[key]
-    data_db.close()
+    store = StateStore(data_file)
+    data = {"accounts": store.load_accounts()}
+    for key in store.keys():
+        data[key] = store.get(key)
+    store.close()
     return data
\ No newline at end of file
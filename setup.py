@@ -76,6 +76,10 @@ if __name__ == '__main__':
             'Intended Audience :: Developers',
         ],
         install_requires=requires,
+        extras_require={
+            'numpy': ['numpy'],
+            'zstd': ['zstandard'],
+        },
         entry_points={
             'console_scripts': [
                 'delegationonboardbot=delegationonboardbot.delegationonboardbot:main',
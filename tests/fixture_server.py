@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Local HTTP servers which replace the external APIs in the tests"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from delegationonboardbot.metrics import ThreadingHTTPServer
+
+
+class FixtureServer(object):
+    """ Runs an HTTP server on a free local port in a background thread
+
+        Subclasses implement handle_get and handle_post, which return
+        (status, body). All requests are collected in requests.
+    """
+    def __init__(self):
+        self.requests = []
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                fixture.requests.append(("GET", handler.path, None))
+                handler.respond(*fixture.handle_get(handler.path))
+
+            def do_POST(handler):
+                body = handler.rfile.read(int(handler.headers["Content-Length"]))
+                fixture.requests.append(("POST", handler.path, body))
+                handler.respond(*fixture.handle_post(handler.path, body))
+
+            def respond(handler, status, body):
+                if body is None:
+                    # closes the connection without a response
+                    handler.close_connection = True
+                    return
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                handler.send_response(status)
+                handler.send_header("Content-Type", "application/json")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle_get(self, path):
+        return 404, {"error": "not found"}
+
+    def handle_post(self, path, body):
+        return 404, {"error": "not found"}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ReferrerServer(FixtureServer):
+    """ Serves /api/referrer/<account>?offset=&limit= like hiveonboard.com
+
+        items are the referred accounts in the order of creation.
+        newest_first sets the order of the API. With malformed set, the
+        response body is returned as it is.
+
+        :param list items: dicts with account, timestamp (ms) and weight
+    """
+    def __init__(self, items=None, newest_first=True):
+        self.items = list(items or [])
+        self.newest_first = newest_first
+        self.malformed = None
+        FixtureServer.__init__(self)
+
+    def add(self, account, timestamp, weight=300):
+        self.items.append({"account": account, "timestamp": timestamp, "weight": weight})
+
+    def handle_get(self, path):
+        url = urlparse(path)
+        if not url.path.startswith("/api/referrer/"):
+            return 404, {"error": "not found"}
+        if self.malformed is not None:
+            return 200, self.malformed
+        params = parse_qs(url.query)
+        offset = int(params["offset"][0])
+        limit = int(params["limit"][0])
+        items = list(reversed(self.items)) if self.newest_first else self.items
+        return 200, {"items": items[offset:offset + limit]}
+
+    def offsets(self):
+        """Returns the offsets of all page requests"""
+        return [int(parse_qs(urlparse(path).query)["offset"][0]) for method, path, body in self.requests]
+
+
+class RpcServer(FixtureServer):
+    """ Answers database_api.get_dynamic_global_properties like a Hive node
+
+        Every response is delayed by latency seconds. error_rate is the
+        share of requests which fail with a server error, failures are
+        spread evenly over the requests. With down set, connections are
+        closed without a response.
+    """
+    def __init__(self, head_block_number=1000, latency=0., error_rate=0.):
+        self.head_block_number = head_block_number
+        self.latency = latency
+        self.error_rate = error_rate
+        self.down = False
+        self.count = 0
+        FixtureServer.__init__(self)
+
+    def handle_post(self, path, body):
+        time.sleep(self.latency)
+        if self.down:
+            return 200, None
+        self.count += 1
+        if int(self.count * self.error_rate) > int((self.count - 1) * self.error_rate):
+            return 500, {"error": "internal error"}
+        request = json.loads(body)
+        if request["method"] != "database_api.get_dynamic_global_properties":
+            return 200, {"jsonrpc": "2.0", "id": request["id"], "error": {"message": "unknown method"}}
+        return 200, {"jsonrpc": "2.0", "id": request["id"], "result": {"head_block_number": self.head_block_number}}
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import unittest
+from beem import Hive
+from beem.account import Account
+from beemgraphenebase.account import PrivateKey
+from delegationonboardbot.broadcast import Broadcaster
+from tests.fixture_server import FixtureServer
+
+WIF = "5KQwrPbwdL6PhXujxW37FSSQZ1JiwsST4cqQzDeyXtP79zkvFD3"
+HEAD_BLOCK_NUM = 50000000
+
+
+def delegatee(op):
+    """Returns the delegatee of an op in the condenser or the appbase format"""
+    value = op[1] if isinstance(op, list) else op["value"]
+    return value.get("delegatee")
+
+
+class Chain(object):
+    """ State which is shared by the nodes of a test
+
+        Broadcasted transactions are applied and collected in transactions.
+        The responses to the next lost_responses broadcasts are lost, after
+        the transaction was applied. With unreachable set, broadcasts are
+        lost before they are applied. Transactions with a delegation to an
+        account in rejected_delegatees fail with an assert. With
+        find_transaction unset, the transaction status API is not available.
+    """
+    def __init__(self):
+        self.transactions = []
+        self.lost_responses = 0
+        self.unreachable = False
+        self.rejected_delegatees = set()
+        self.find_transaction = True
+
+    def known(self, trx):
+        return any(t["signatures"] == trx["signatures"] for t in self.transactions)
+
+
+class BroadcastNode(FixtureServer):
+    """Answers the calls which are needed to sign and broadcast a transaction on chain"""
+    def __init__(self, chain):
+        self.chain = chain
+        FixtureServer.__init__(self)
+
+    def handle_post(self, path, body):
+        chain = self.chain
+        request = json.loads(body)
+        method, params = request["method"], request.get("params")
+        if method == "call":
+            method, params = "%s.%s" % (params[0], params[1]), params[2]
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        if method.endswith(".broadcast_transaction"):
+            trx = params[0] if isinstance(params, list) else params["trx"]
+            if chain.unreachable:
+                return 200, None
+            if chain.known(trx) and chain.lost_responses == 0:
+                response["error"] = {"code": -32003, "message": "Duplicate transaction check failed"}
+                return 200, response
+            if chain.rejected_delegatees.intersection([delegatee(op) for op in trx["operations"]]):
+                response["error"] = {"code": -32003, "message": "10 assert_exception: Assert Exception\n"
+                                                                "Account does not exist"}
+                return 200, response
+            if not chain.known(trx):
+                chain.transactions.append(trx)
+            if chain.lost_responses > 0:
+                chain.lost_responses -= 1
+                return 200, None
+            response["result"] = {}
+            return 200, response
+        if method.endswith(".find_transaction"):
+            params = params[0] if isinstance(params, list) else params
+            if not chain.find_transaction:
+                response["error"] = {"code": -32003, "message": "Could not find API transaction_status_api"}
+                return 200, response
+            known = any(t["expiration"] == params["expiration"] for t in chain.transactions)
+            response["result"] = {"status": "within_reversible_block" if known else "unknown"}
+            return 200, response
+        response["result"] = self.result(method, params)
+        return 200, response
+
+    def result(self, method, params):
+        if method == "database_api.get_config":
+            return {"HIVE_CHAIN_ID": "beeab0de" + "0" * 56, "HIVE_BLOCKCHAIN_VERSION": "1.27.0",
+                    "HIVE_ADDRESS_PREFIX": "STM", "HIVE_BLOCK_INTERVAL": 3}
+        if method == "database_api.get_dynamic_global_properties":
+            return {"head_block_number": HEAD_BLOCK_NUM, "last_irreversible_block_num": HEAD_BLOCK_NUM,
+                    "head_block_id": "02faf080" + "0" * 32,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())}
+        if method == "database_api.find_accounts":
+            key = str(PrivateKey(WIF).pubkey)
+            auth = {"weight_threshold": 1, "account_auths": [], "key_auths": [[key, 1]]}
+            return {"accounts": [{"name": name, "owner": auth, "active": auth, "posting": auth, "memo_key": key}
+                                 for name in params["accounts"]]}
+        return {}
+
+
+class TestBroadcaster(unittest.TestCase):
+    def setUp(self):
+        self.chain = Chain()
+        self.nodes = [BroadcastNode(self.chain), BroadcastNode(self.chain)]
+        hive = Hive(node=[node.url for node in self.nodes], num_retries=0, keys=[WIF])
+        self.broadcaster = Broadcaster(Account("delegationacc", blockchain_instance=hive), None)
+        self.results = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.close()
+
+    def delegate(self, *delegatees):
+        for delegatee in delegatees:
+            self.broadcaster.delegate(delegatee, 1000,
+                                      lambda ok, delegatee=delegatee: self.results.append((delegatee, ok)))
+        self.broadcaster.wait()
+        return [r[1] for r in sorted(self.results)]
+
+    def broadcasts(self):
+        """Returns the number of ops of each broadcasted transaction"""
+        return [len(json.loads(body)["params"][2][0]["operations"]) for node in self.nodes
+                for method, path, body in node.requests if b"broadcast_transaction" in body]
+
+    def test_batch(self):
+        self.assertEqual(self.delegate("a", "b", "c"), [True, True, True])
+        self.assertEqual(self.broadcasts(), [3])
+        self.assertEqual(len(self.chain.transactions), 1)
+
+    def test_accepted_before_error(self):
+        # the transaction is found on the node, the ops are not broadcasted again
+        self.chain.lost_responses = 10
+        self.assertEqual(self.delegate("a", "b", "c"), [True, True, True])
+        self.assertEqual(self.broadcasts(), [3])
+        self.assertEqual(len(self.chain.transactions), 1)
+
+    def test_duplicate(self):
+        # the same signed transaction is broadcasted again and rejected as duplicate
+        self.chain.lost_responses = 1
+        self.chain.find_transaction = False
+        self.assertEqual(self.delegate("a", "b", "c"), [True, True, True])
+        self.assertEqual(self.broadcasts(), [3, 3])
+        self.assertEqual(len(self.chain.transactions), 1)
+
+    def test_transport_error(self):
+        # ops are not retried one by one after an error which is not a rejection
+        self.chain.unreachable = True
+        self.assertEqual(self.delegate("a", "b", "c"), [False, False, False])
+        self.assertEqual(set(self.broadcasts()), set([3]))
+        self.assertEqual(self.chain.transactions, [])
+
+    def test_rejected(self):
+        self.chain.rejected_delegatees.add("b")
+        self.assertEqual(self.delegate("a", "b", "c"), [True, False, True])
+        self.assertEqual(self.broadcasts(), [3, 1, 1, 1])
+        self.assertEqual([delegatee(t["operations"][0]) for t in self.chain.transactions], ["a", "c"])
+
+
+if __name__ == '__main__':
+    unittest.main()
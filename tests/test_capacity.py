@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+import unittest
+from beem import Hive
+from delegationonboardbot.capacity import CapacityPlanner, DAY, RETURN_DAYS
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.lookup import Lookups
+from delegationonboardbot.metrics import Metrics
+from delegationonboardbot.store import StateStore
+from tests.fixture_server import FixtureServer
+
+# HIVE per VESTS
+HIVE_PER_VESTS = 0.0005
+
+
+def vests(amount):
+    return {"amount": str(int(amount * 1e6)), "precision": 6, "nai": "@@000000037"}
+
+
+class FakeChain(object):
+    def vests_to_hp(self, value):
+        return float(value) * HIVE_PER_VESTS
+
+    def hp_to_vests(self, hp):
+        return float(hp) / HIVE_PER_VESTS
+
+
+class CapacityNode(FixtureServer):
+    """Answers find_accounts and find_vesting_delegation_expirations for the delegation account"""
+    def __init__(self, account):
+        self.account = account
+        self.expirations = []
+        self.error = None
+        FixtureServer.__init__(self)
+
+    def handle_post(self, path, body):
+        request = json.loads(body)
+        response = {"jsonrpc": "2.0", "id": request["id"]}
+        if request["method"] == "database_api.get_config":
+            response["result"] = {"HIVE_CHAIN_ID": "beeab0de" + "0" * 56, "HIVE_BLOCKCHAIN_VERSION": "1.27.0",
+                                  "HIVE_ADDRESS_PREFIX": "STM", "HIVE_BLOCK_INTERVAL": 3}
+        elif self.error is not None:
+            response["error"] = {"code": -32003, "message": self.error}
+        elif request["method"] == "database_api.find_accounts":
+            response["result"] = {"accounts": [self.account]}
+        elif request["method"] == "database_api.find_vesting_delegation_expirations":
+            response["result"] = {"delegations": self.expirations}
+        else:
+            response["error"] = {"code": -32003, "message": "unknown method"}
+        return 200, response
+
+
+class FakeBroadcaster(object):
+    def __init__(self):
+        self.delegations = []
+
+    def delegate(self, account, vesting_shares, callback):
+        self.delegations.append((account, vesting_shares, callback))
+
+
+class TestCapacityPlanner(unittest.TestCase):
+    def setUp(self):
+        self.now = 1600000000
+        self.planner = CapacityPlanner()
+
+    def test_unknown(self):
+        self.planner.update("a", 30, self.now + DAY)
+        self.assertIsNone(self.planner.available_hp)
+        self.assertIsNone(self.planner.projected_available_hp(self.now, 7))
+
+    def test_available(self):
+        # the ledger does not lower the undelegated HP from the chain
+        self.planner.update("a", 30, self.now + 10 * DAY)
+        self.planner.set_account(100, [])
+        self.assertEqual(self.planner.committed_hp, 30)
+        self.assertEqual(self.planner.available_hp, 100)
+        self.planner.reserve(30)
+        self.assertEqual(self.planner.available_hp, 70)
+        self.planner.release(30)
+        self.planner.record_grant(self.now, 30)
+        self.assertEqual(self.planner.available_hp, 70)
+        self.planner.set_account(70, [])
+        self.assertEqual(self.planner.available_hp, 70)
+
+    def test_returning(self):
+        self.planner.set_account(100, [(self.now - 60, 50), (self.now + DAY, 20), (self.now + 8 * DAY, 40)])
+        # returns after the expiry and the return period
+        self.planner.update("a", 30, self.now + DAY)
+        self.planner.update("b", 10, self.now + 3 * DAY)
+        self.assertEqual(self.planner.returning_hp(self.now, 1), 20)
+        self.assertEqual(self.planner.returning_hp(self.now, RETURN_DAYS + 2), 50)
+        self.assertEqual(self.planner.returning_hp(self.now, RETURN_DAYS + 4), 100)
+        self.assertEqual(self.planner.projected_available_hp(self.now, RETURN_DAYS + 2), 150)
+        self.planner.record_grant(self.now, 7 * 7)
+        self.assertEqual(self.planner.projected_available_hp(self.now, RETURN_DAYS + 2), 150 - 49 - 49)
+
+
+class TestAvailableHp(unittest.TestCase):
+    def setUp(self):
+        # 500 HP own, 440 HP delegated, also to accounts which are not tracked by the bot
+        self.node = CapacityNode({"name": "delegationacc", "vesting_shares": vests(1000000),
+                                  "delegated_vesting_shares": vests(880000)})
+        bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+        bot.config = {"delegationAccount": "delegationacc", "hpWarning": 100, "delegationAmount": 40,
+                      "no_broadcast": False}
+        bot.hive = Hive(offline=True)
+        bot.lookups = Lookups(Hive(node=self.node.url, num_retries=0))
+        bot.chain = FakeChain()
+        bot.metrics = Metrics()
+        bot.store = StateStore(":memory:")
+        bot.journal = Journal(None)
+        bot.open_intents = {}
+        bot.block_num = None
+        bot.ready = True
+        bot.pending_accounts = set()
+        bot.broadcaster = FakeBroadcaster()
+        bot.planner = CapacityPlanner()
+        bot.messages = []
+        bot.notify_admin = bot.messages.append
+        self.bot = bot
+
+    def tearDown(self):
+        self.node.close()
+
+    def check(self):
+        self.bot.check_for_sufficient_hp()
+        self.bot.lookups.wait()
+
+    def test_delegated_to_other_accounts(self):
+        self.bot.planner.update("onboarded1", 30)
+        self.check()
+        self.assertAlmostEqual(self.bot.planner.available_hp, 60)
+        self.assertEqual(len(self.bot.messages), 1)
+        self.assertIn("available HIVE POWER of @delegationacc is 60.000 HP", self.bot.messages[0])
+
+    def test_add_delegation_guard(self):
+        self.check()
+        self.assertTrue(self.bot.add_delegation("onboarded1", None))
+        self.assertFalse(self.bot.add_delegation("onboarded2", None))
+        self.assertEqual([d[0] for d in self.bot.broadcaster.delegations], ["onboarded1"])
+
+    def test_returning_delegations(self):
+        # removed delegations return after 5 days, the warning is not sent twice
+        expiration = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(time.time() + 2 * DAY))
+        self.node.expirations = [{"delegator": "delegationacc", "vesting_shares": vests(200000),
+                                     "expiration": expiration}]
+        self.bot.config["hpWarning"] = 50
+        self.bot.config["capacity_horizon_days"] = 3
+        self.check()
+        self.assertEqual(self.bot.messages, [])
+        self.assertAlmostEqual(self.bot.planner.projected_available_hp(time.time(), 3), 160)
+        self.assertAlmostEqual(self.bot.planner.projected_available_hp(time.time(), 1), 60)
+
+
+    def test_rpc_on_lookup_thread(self):
+        threads = []
+        handle_post = self.node.handle_post
+
+        def recording_handle_post(path, body):
+            threads.append(threading.current_thread())
+            return handle_post(path, body)
+
+        self.node.handle_post = recording_handle_post
+        self.bot.check_for_sufficient_hp()
+        self.bot.lookups.queue.join()
+        # the result is applied when the bot processes the lookup results
+        self.assertIsNone(self.bot.planner.available_hp)
+        self.assertEqual(len(threads), 2)
+        self.bot.lookups.process_results()
+        self.assertAlmostEqual(self.bot.planner.available_hp, 60)
+
+    def test_rpc_error(self):
+        self.check()
+        self.node.error = "Could not find account"
+        self.check()
+        # the last known HP is kept
+        self.assertAlmostEqual(self.bot.planner.available_hp, 60)
+        self.assertEqual(len(self.bot.messages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import copy
+import random
+import time
+import unittest
+from datetime import datetime, timedelta
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.index import ExpiryIndex
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.metrics import Metrics
+from delegationonboardbot.policy import evaluate_policy_python, REVOKE_LENGTH, REVOKE_MAX_HP
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.store import StateStore
+
+CONFIG = {"delegationLength": 28, "maxUserHP": 50, "minPostRC": 10, "delegationAmount": 30, "no_broadcast": False,
+          "adminAccount": "adminacc", "delegationLengthMsg": "", "delegationMaxMsg": ""}
+DAY = 24 * 60 * 60
+
+
+class TestExpiryIndex(unittest.TestCase):
+    def test_pop_due(self):
+        index = ExpiryIndex()
+        index.update("a", 10)
+        index.update("b", 5)
+        index.update("c", 20)
+        # the old entry of a is skipped
+        index.update("a", 30)
+        index.remove("c")
+        self.assertEqual(index.pop_due(10), ["b"])
+        self.assertEqual(index.pop_due(30), [])
+        self.assertEqual(index.pop_due(31), ["a"])
+        self.assertEqual(len(index), 0)
+
+    def test_compaction(self):
+        index = ExpiryIndex()
+        for i in range(1000):
+            index.update("a", i)
+        self.assertLessEqual(len(index.heap), 102)
+        self.assertEqual(index.pop_due(1000), ["a"])
+
+
+class TestIndexAfterChanges(unittest.TestCase):
+    """The expiry index and the max HP bucket must select the same accounts as a full sweep"""
+    def setUp(self):
+        self.rnd = random.Random(11)
+        bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+        bot.config = dict(CONFIG)
+        bot.store = StateStore(":memory:")
+        bot.journal = Journal(None)
+        bot.metrics = Metrics()
+        bot.open_intents = {}
+        bot.dirty_accounts = set()
+        bot.pending_accounts = set()
+        bot.block_num = None
+        bot.messages = []
+        bot.notify_admin = bot.messages.append
+        # a fixed clock, so that no delegation expires between the sweep and the index lookup
+        clock = time.time()
+        bot.now = lambda: clock
+        now = datetime.utcfromtimestamp(clock)
+        bot.accounts = {}
+        for i in range(500):
+            acc = AccountRecord(timestamp=now - timedelta(days=60), weight=300, hp=self.rnd.choice([0, 5, 50, 200]))
+            if self.rnd.random() < 0.5:
+                acc.delegated_hp = 30
+                acc.delegation_timestamp = now - timedelta(days=self.rnd.uniform(0, 40))
+                acc.delegation_revoked = self.rnd.random() < 0.2
+            bot.accounts["onboarded%d" % i] = acc
+        bot.build_index()
+        self.bot = bot
+
+    def assertIndexMatchesSweep(self):
+        bot = self.bot
+        now = bot.now()
+        for days in [0, 1, 10, 30]:
+            # the length rule alone
+            config = dict(bot.config, maxUserHP=0)
+            expired = [account for account, reason in evaluate_policy_python(
+                bot.accounts, list(bot.accounts), config, now + days * DAY)[1].items() if reason == REVOKE_LENGTH]
+            self.assertEqual(sorted(copy.deepcopy(bot.expiry_index).pop_due(now + days * DAY)), sorted(expired))
+        # the max HP rule alone
+        config = dict(bot.config, delegationLength=0)
+        over_max_hp = [account for account, reason in evaluate_policy_python(
+            bot.accounts, list(bot.accounts), config, now)[1].items() if reason == REVOKE_MAX_HP]
+        self.assertEqual(sorted(bot.over_max_hp), sorted(over_max_hp))
+
+    def test_grants_and_revokes(self):
+        bot = self.bot
+        self.assertIndexMatchesSweep()
+        names = list(bot.accounts)
+        for i in range(300):
+            account = self.rnd.choice(names)
+            acc = bot.accounts[account]
+            action = self.rnd.choice(["grant", "revoke", "failed", "hp"])
+            if action == "grant":
+                timestamp = datetime.utcfromtimestamp(bot.now()) - timedelta(days=self.rnd.uniform(0, 40))
+                bot.on_delegation_added(account, timestamp, True, None, hp=30)
+            elif action == "revoke":
+                bot.on_delegation_removed(account, acc.delegated_hp > 0, None, REVOKE_LENGTH)
+            elif action == "failed":
+                bot.on_delegation_added(account, datetime.utcfromtimestamp(bot.now()), False, None, hp=30)
+            else:
+                acc.hp = self.rnd.choice([0, 5, 50, 200])
+                bot.index_account(account)
+            self.assertIndexMatchesSweep()
+        self.assertEqual(bot.planner.committed_hp,
+                         sum(acc.delegated_hp for acc in bot.accounts.values()
+                             if acc.delegated_hp > 0 and not acc.delegation_revoked))
+
+    def test_check_delegation_age(self):
+        bot = self.bot
+        removed = []
+        bot.remove_delegation = lambda account, msg=None, reason=None: removed.append((account, reason))
+        config = dict(bot.config, maxUserHP=0)
+        expected = [(account, reason) for account, reason in evaluate_policy_python(
+            bot.accounts, list(bot.accounts), config, bot.now())[1].items() if reason == REVOKE_LENGTH]
+        bot.check_delegation_age()
+        self.assertGreater(len(removed), 0)
+        self.assertEqual(sorted(removed), sorted(expected))
+        # the removed accounts are only selected again after a new grant
+        removed[:] = []
+        bot.check_delegation_age()
+        self.assertEqual(removed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import sqlite3
+import unittest
+from datetime import datetime
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.store import StateStore
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.tmp_dir, "journal.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_append_read(self):
+        journal = Journal(self.journal_file)
+        journal.append({"type": "block", "block_num": 1})
+        journal.append({"type": "account", "account": "a", "record": "00"})
+        self.assertEqual(journal.read(), [{"type": "block", "block_num": 1},
+                                          {"type": "account", "account": "a", "record": "00"}])
+        journal.close()
+        self.assertEqual(len(Journal(self.journal_file).read()), 2)
+
+    def test_batched_sync(self):
+        journal = Journal(self.journal_file, sync_records=3)
+        journal.append({"n": 1})
+        journal.append({"n": 2})
+        self.assertEqual(journal.unsynced, 2)
+        journal.append({"n": 3})
+        self.assertEqual(journal.unsynced, 0)
+        journal.append({"n": 4})
+        journal.sync()
+        self.assertEqual(journal.unsynced, 0)
+        journal.close()
+
+    def test_truncated_last_line(self):
+        journal = Journal(self.journal_file)
+        journal.append({"n": 1})
+        journal.append({"n": 2})
+        journal.close()
+        with open(self.journal_file, "a") as f:
+            f.write('{"n": 3, "acc')
+        self.assertEqual(Journal(self.journal_file).read(), [{"n": 1}, {"n": 2}])
+
+    def test_reset(self):
+        journal = Journal(self.journal_file)
+        for i in range(10):
+            journal.append({"n": i})
+        journal.reset([{"n": "kept"}])
+        self.assertEqual(journal.read(), [{"n": "kept"}])
+        self.assertFalse(os.path.exists(self.journal_file + ".tmp"))
+        journal.append({"n": "new"})
+        self.assertEqual(journal.read(), [{"n": "kept"}, {"n": "new"}])
+        journal.close()
+
+    def test_disabled(self):
+        journal = Journal(None)
+        journal.append({"n": 1})
+        journal.sync()
+        journal.reset([{"n": 2}])
+        self.assertEqual(journal.read(), [])
+        journal.close()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+def packed(accounts):
+    return dict((name, accounts[name].pack()) for name in accounts)
+
+
+class TestRecovery(unittest.TestCase):
+    """Recovers the bot state from journals which were cut after every record"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.initial = {"a": AccountRecord(timestamp=datetime(2021, 1, 1), weight=300, hp=5),
+                        "b": AccountRecord(timestamp=datetime(2021, 1, 2), weight=300, hp=100)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def bot(self, name):
+        """Returns a bot with the initial accounts, which were stored at block 100"""
+        bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+        bot.store = StateStore(os.path.join(self.tmp_dir, name + ".sqlite"))
+        if bot.store.is_empty():
+            with bot.store.transaction():
+                bot.store.store_accounts(self.initial)
+                bot.store.set("last_block_num", 100)
+        bot.accounts = bot.store.load_accounts()
+        bot.last_block_num = bot.store.get("last_block_num")
+        bot.journal = Journal(os.path.join(self.tmp_dir, name + ".journal"))
+        bot.open_intents = {}
+        bot.dirty_accounts = set()
+        bot.snapshot_valid = True
+        bot.checkpoint_block_num = None
+        bot.block_num = None
+        return bot
+
+    def close(self, bot):
+        bot.journal.close()
+        bot.store.close()
+
+    def write_journal(self):
+        """Journals two blocks, returns the journal lines and the expected state after each line"""
+        bot = self.bot("writer")
+        states = []
+
+        def journaled():
+            states.append((packed(bot.accounts), bot.last_block_num, sorted(bot.open_intents)))
+
+        bot.block_num = 101
+        bot.accounts["a"].delegated_hp = 30
+        bot.accounts["a"].delegation_timestamp = datetime(2021, 2, 1)
+        bot.save_account("a")
+        journaled()
+        bot.journal_intent("add_delegation", "a")
+        journaled()
+        bot.accounts["c"] = AccountRecord(timestamp=datetime(2021, 2, 1), weight=300)
+        bot.save_account("c")
+        journaled()
+        bot.journal_block(101)
+        bot.last_block_num = 101
+        journaled()
+        bot.block_num = 102
+        bot.journal_result("a", True)
+        journaled()
+        bot.accounts["b"].muted = True
+        bot.save_account("b")
+        journaled()
+        bot.journal_intent("remove_delegation", "b")
+        journaled()
+        bot.journal_block(102)
+        bot.last_block_num = 102
+        journaled()
+        self.close(bot)
+        with open(bot.journal.journal_file) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), len(states))
+        return lines, states
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp_dir, name + ".journal"), "w") as f:
+            f.write(content)
+
+    def recover(self, name):
+        """Recovers a restarted bot, returns its state"""
+        bot = self.bot(name)
+        accounts = bot.store.load_accounts()
+        bot.recover(accounts)
+        state = (packed(accounts), bot.store.get("last_block_num"), sorted(bot.open_intents))
+        self.assertEqual(packed(bot.store.load_accounts()), state[0])
+        self.close(bot)
+        return state
+
+    def test_cut_journal(self):
+        lines, states = self.write_journal()
+        for n in range(len(lines) + 1):
+            expected = states[n - 1] if n > 0 else (packed(self.initial), 100, [])
+            contents = ["".join(lines[:n])]
+            if n < len(lines):
+                # torn last line
+                contents.append("".join(lines[:n]) + lines[n][:len(lines[n]) // 2])
+            for i, content in enumerate(contents):
+                name = "cut%d_%d" % (n, i)
+                self.write(name, content)
+                self.assertEqual(self.recover(name), expected, name)
+                # the compacted journal is recovered to the same state
+                self.assertEqual(self.recover(name), expected, name)
+                # as well as the whole journal again, e.g. after a crash before the journal was compacted
+                self.write(name, content)
+                self.assertEqual(self.recover(name), expected, name)
+
+    def test_checkpoint_after_commit(self):
+        bot = self.bot("checkpoint")
+        bot.block_num = 101
+        bot.accounts["a"].hp = 50
+        bot.save_account("a")
+        bot.journal_intent("add_delegation", "b")
+        bot.journal_block(101)
+        reader = sqlite3.connect(os.path.join(self.tmp_dir, "checkpoint.sqlite"))
+        reset = bot.journal.reset
+        committed = []
+
+        def checked_reset(records=()):
+            committed.append(reader.execute("SELECT value FROM kv WHERE key = 'last_block_num'").fetchone()[0])
+            reset(records)
+
+        def failing_commit():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        bot.journal.reset = checked_reset
+        commit = bot.store.commit
+        bot.store.commit = failing_commit
+        # the journal is kept when the commit fails
+        self.assertRaises(sqlite3.OperationalError, bot.checkpoint, 101)
+        self.assertEqual(committed, [])
+        self.assertEqual([r["type"] for r in bot.journal.read()], ["account", "intent", "block"])
+        bot.store.commit = commit
+        bot.checkpoint(101)
+        # the journal is compacted after the commit is visible to other connections
+        self.assertEqual(committed, ["101"])
+        self.assertEqual([r["type"] for r in bot.journal.read()], ["intent"])
+        reader.close()
+        self.close(bot)
+        bot = self.bot("checkpoint")
+        self.assertEqual(bot.accounts["a"].hp, 50)
+        self.close(bot)
+        self.assertEqual(self.recover("checkpoint")[1:], (101, ["b"]))
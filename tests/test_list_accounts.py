@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+from delegationonboardbot import delegationonboardbot
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.store import StateStore
+
+
+class TestListAccounts(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.datadir, "config.json")
+        with open(self.config_file, "w") as f:
+            f.write(json.dumps({"referrerAccount": "dappacc"}))
+        self.data_file = os.path.join(self.datadir, "data.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def list_accounts(self):
+        argv = sys.argv
+        sys.argv = ["delegationonboardbot", self.config_file, "--datadir", self.datadir, "--list-accounts",
+                    "--logconfig", os.path.join(self.datadir, "logger.json")]
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output):
+                delegationonboardbot.main()
+        finally:
+            sys.argv = argv
+        return output.getvalue()
+
+    def files(self):
+        return dict((name, os.path.getsize(os.path.join(self.datadir, name))) for name in os.listdir(self.datadir))
+
+    def test_list(self):
+        store = StateStore(self.data_file)
+        store.store_accounts({"onboarded1": AccountRecord(timestamp=datetime(2021, 1, 1), weight=300, hp=5)})
+        store.close()
+        with open(self.data_file, "rb") as f:
+            content = f.read()
+        self.assertIn("onboarded1", self.list_accounts())
+        with open(self.data_file, "rb") as f:
+            self.assertEqual(f.read(), content)
+
+    def test_no_migration(self):
+        data_db = shelve.open(os.path.join(self.datadir, "data.db"))
+        data_db["accounts"] = {}
+        data_db.close()
+        files = self.files()
+        self.list_accounts()
+        self.assertNotIn("data.sqlite", os.listdir(self.datadir))
+        self.assertEqual(self.files(), files)
+
+
+    def test_missing_tenant(self):
+        with open(self.config_file, "w") as f:
+            f.write(json.dumps({"tenants": {"dapp1": {"referrerAccount": "dappacc1"},
+                                            "dapp2": {"referrerAccount": "dappacc2"}}}))
+        os.makedirs(os.path.join(self.datadir, "dapp1"))
+        store = StateStore(os.path.join(self.datadir, "dapp1", "data.sqlite"))
+        store.store_accounts({"onboarded1": AccountRecord(timestamp=datetime(2021, 1, 1), weight=300, hp=5)})
+        store.close()
+        with self.assertLogs("delegationonboardbot.delegationonboardbot", level="WARNING") as logs:
+            self.assertIn("onboarded1", self.list_accounts())
+        self.assertIn("Tenant dapp2 has no state", logs.output[0])
+        self.assertNotIn("dapp2", os.listdir(self.datadir))
+
+
+if __name__ == '__main__':
+    unittest.main()
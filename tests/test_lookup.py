@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from delegationonboardbot.lookup import Lookups
+
+
+class TestLookups(unittest.TestCase):
+    def test_results_on_calling_thread(self):
+        lookups = Lookups("hive")
+        threads = []
+        results = []
+
+        def lookup(hive, value):
+            threads.append(threading.current_thread())
+            return hive, value
+
+        def callback(result, error):
+            results.append((result, error, threading.current_thread()))
+
+        lookups.submit(lookup, (1, ), callback)
+        lookups.submit(lookup, (2, ), callback)
+        lookups.wait()
+        self.assertEqual([(r, e) for r, e, t in results], [(("hive", 1), None), (("hive", 2), None)])
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertTrue(all(t is threading.current_thread() for r, e, t in results))
+        self.assertEqual(lookups.pending(), 0)
+
+    def test_error(self):
+        lookups = Lookups(None)
+        results = []
+
+        def lookup(hive):
+            raise ValueError("node down")
+
+        lookups.submit(lookup, (), lambda result, error: results.append((result, error)))
+        lookups.wait()
+        self.assertIsNone(results[0][0])
+        self.assertIsInstance(results[0][1], ValueError)
+
+    def test_thread_is_started_on_demand(self):
+        lookups = Lookups(None)
+        lookups.process_results()
+        self.assertIsNone(lookups.thread)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from delegationonboardbot.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        metrics = Metrics()
+        metrics.describe("blocks", "Processed blocks")
+        metrics.inc("blocks", 2)
+        metrics.set("head_lag", 3, labels=(("tenant", "dapp1"), ))
+        metrics.set_callback("queue_depth", lambda: 5)
+        metrics.observe("commit_seconds", 0.002)
+        text = metrics.render()
+        self.assertIn("# HELP delegationonboardbot_blocks Processed blocks", text)
+        self.assertIn("delegationonboardbot_blocks 2.0", text)
+        self.assertIn('delegationonboardbot_head_lag{tenant="dapp1"} 3.0', text)
+        self.assertIn("delegationonboardbot_queue_depth 5.0", text)
+        self.assertIn('delegationonboardbot_commit_seconds_bucket{le="0.005"} 1', text)
+
+    def test_gauges_are_set_under_lock(self):
+        # render copies the gauges while it holds the lock
+        metrics = Metrics()
+        with metrics.lock:
+            thread = threading.Thread(target=metrics.set, args=("gauge", 1))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(metrics.gauges, {})
+        thread.join()
+        self.assertIn("delegationonboardbot_gauge 1.0", metrics.render())
+
+if __name__ == '__main__':
+    unittest.main()
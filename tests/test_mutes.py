@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+from delegationonboardbot.mutes import parse_follow, MuteTracker
+from delegationonboardbot.store import StateStore
+
+
+def follow_op(follower, following, what):
+    return {"json": '["follow",{"follower":"%s","following":"%s","what":%s}]' % (
+        follower, following, str(what).replace("'", '"'))}
+
+
+class TestParseFollow(unittest.TestCase):
+    def test_follow_list_form(self):
+        self.assertEqual(parse_follow('["follow",{"follower":"muteacc","following":"spammer","what":["ignore"]}]'),
+                         ("muteacc", ["spammer"], ["ignore"]))
+
+    def test_plain_form(self):
+        self.assertEqual(parse_follow('{"follower":"muteacc","following":["a","b"],"what":"ignore"}'),
+                         ("muteacc", ["a", "b"], ["ignore"]))
+
+    def test_missing_what(self):
+        self.assertEqual(parse_follow('["follow",{"follower":"muteacc","following":"a"}]'), ("muteacc", ["a"], []))
+
+    def test_ignored(self):
+        self.assertIsNone(parse_follow('["reblog",{"account":"a","author":"b","permlink":"c"}]'))
+        self.assertIsNone(parse_follow('["follow",{"follower":"muteacc"}]'))
+        self.assertIsNone(parse_follow('["follow"]'))
+        self.assertIsNone(parse_follow('[1, 2, 3]'))
+        self.assertIsNone(parse_follow('"follow"'))
+        self.assertIsNone(parse_follow('{"follower": '))
+
+
+class TestMuteTracker(unittest.TestCase):
+    def setUp(self):
+        self.store = StateStore(":memory:")
+        self.tracker = MuteTracker(self.store, "muteacc")
+
+    def test_not_in_sync_before_resync(self):
+        self.assertFalse(self.tracker.in_sync(100))
+        self.tracker.resync(["a", "b"], 100)
+        self.assertTrue(self.tracker.in_sync(100))
+        self.assertFalse(self.tracker.in_sync(101))
+        self.tracker.checkpoint(101)
+        self.assertTrue(self.tracker.in_sync(101))
+
+    def test_mute_and_unmute(self):
+        self.tracker.resync(["a"], 100)
+        self.assertEqual(self.tracker.process_op(follow_op("muteacc", "b", ["ignore"])), (["b"], []))
+        self.assertEqual(self.tracker.process_op(follow_op("muteacc", "b", ["ignore"])), ([], []))
+        self.assertEqual(self.tracker.process_op(follow_op("muteacc", "a", [])), ([], ["a"]))
+        self.assertEqual(self.tracker.process_op(follow_op("muteacc", "c", ["blog"])), ([], []))
+        self.assertEqual(self.tracker.muted, set(["b"]))
+        self.assertEqual(self.store.load_mutes(), set(["b"]))
+
+    def test_other_follower(self):
+        self.tracker.resync([], 100)
+        self.assertEqual(self.tracker.process_op(follow_op("someone", "b", ["ignore"])), ([], []))
+        self.assertEqual(self.tracker.muted, set())
+
+    def test_reset_needs_resync(self):
+        self.tracker.resync(["a"], 100)
+        self.assertEqual(self.tracker.process_op(follow_op("muteacc", "", ["reset_muted_list"])), ([], []))
+        self.assertFalse(self.tracker.in_sync(100))
+
+    def test_state_is_stored(self):
+        self.tracker.resync(["a"], 100)
+        self.tracker.process_op(follow_op("muteacc", "b", ["ignore"]))
+        self.tracker.checkpoint(120)
+        tracker = MuteTracker(self.store, "muteacc")
+        self.assertEqual(tracker.muted, set(["a", "b"]))
+        self.assertTrue(tracker.in_sync(120))
+        # a changed muteAccount needs a new mute list
+        self.assertFalse(MuteTracker(self.store, "othermuteacc").in_sync(120))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from delegationonboardbot.nodes import NodePool
+from tests.fixture_server import RpcServer
+
+
+class TestNodePool(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def server(self, **kwargs):
+        server = RpcServer(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def wait_for_probe(self, pool, timeout=5):
+        start = time.time()
+        while not pool.finish_probe():
+            if time.time() - start > timeout:
+                self.fail("background probe did not finish")
+            time.sleep(0.01)
+
+    def test_ranking(self):
+        slow = self.server(latency=0.1)
+        fast = self.server()
+        medium = self.server(latency=0.05)
+        pool = NodePool([slow.url, fast.url, medium.url])
+        for i in range(3):
+            pool.probe()
+        self.assertEqual(pool.ranked(), [fast.url, medium.url, slow.url])
+        self.assertEqual(pool.best(), fast.url)
+
+    def test_failing_nodes_last(self):
+        failing = self.server(error_rate=1.)
+        down = self.server()
+        down.down = True
+        flaky = self.server(latency=0.05, error_rate=0.25)
+        ok = self.server(latency=0.1)
+        pool = NodePool([failing.url, down.url, flaky.url, ok.url], timeout=1)
+        for i in range(8):
+            pool.probe()
+        self.assertFalse(pool.is_healthy(failing.url))
+        self.assertFalse(pool.is_healthy(down.url))
+        self.assertTrue(pool.is_healthy(flaky.url))
+        self.assertGreater(pool.stats[flaky.url].error_rate, 0)
+        self.assertEqual(pool.ranked(), [flaky.url, ok.url, failing.url, down.url])
+
+    def test_head_lag(self):
+        lagging = self.server(head_block_number=900)
+        ok = self.server(latency=0.05)
+        pool = NodePool([lagging.url, ok.url], max_head_lag=20)
+        pool.probe()
+        self.assertEqual(pool.stats[lagging.url].head_lag, 100)
+        self.assertEqual(pool.ranked(), [ok.url, lagging.url])
+
+    def test_failover(self):
+        first = self.server()
+        second = self.server(latency=0.05)
+        pool = NodePool([second.url, first.url], timeout=1)
+        pool.probe()
+        self.assertEqual(pool.best(), first.url)
+        first.down = True
+        probes = 0
+        while pool.best() == first.url:
+            pool.probe()
+            probes += 1
+            self.assertLess(probes, 5)
+        self.assertEqual(pool.ranked(), [second.url, first.url])
+        # the node is used again when it has recovered
+        first.down = False
+        for i in range(5):
+            pool.probe()
+        self.assertEqual(pool.best(), first.url)
+
+    def test_concurrent(self):
+        servers = [self.server(latency=0.3) for i in range(5)]
+        pool = NodePool([server.url for server in servers])
+        start = time.time()
+        pool.probe()
+        self.assertLess(time.time() - start, 1.)
+        self.assertTrue(all(pool.is_healthy(server.url) for server in servers))
+
+    def test_background_probe(self):
+        slow = self.server(latency=0.3)
+        fast = self.server(latency=0.1)
+        pool = NodePool([slow.url, fast.url])
+        start = time.time()
+        pool.start_probe()
+        # a running probe is not started twice
+        pool.start_probe()
+        self.assertLess(time.time() - start, 0.1)
+        self.assertFalse(pool.finish_probe())
+        # nothing is recorded before the probe has finished
+        self.assertEqual(pool.stats[fast.url].probes, 0)
+        self.wait_for_probe(pool)
+        self.assertEqual(pool.ranked(), [fast.url, slow.url])
+        self.assertEqual(slow.count + fast.count, 2)
+        self.assertFalse(pool.finish_probe())
+
+    def test_background_probe_removed_node(self):
+        removed = self.server(latency=0.1)
+        kept = self.server()
+        pool = NodePool([removed.url, kept.url])
+        pool.start_probe()
+        pool.set_nodes([kept.url])
+        self.wait_for_probe(pool)
+        self.assertEqual(list(pool.stats.keys()), [kept.url])
+        self.assertEqual(pool.ranked(), [kept.url])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from datetime import datetime, timedelta
+from delegationonboardbot import policy
+from delegationonboardbot.policy import evaluate_policy, evaluate_policy_python, PolicyColumns, \
+    REVOKE_LENGTH, REVOKE_MAX_HP, REVOKE_MUTED
+from delegationonboardbot.record import AccountRecord, datetime_to_epoch
+
+CONFIG = {"maxUserHP": 50, "minPostRC": 10, "delegationLength": 28}
+NOW = datetime(2021, 6, 1, 12, 0, 0)
+
+
+def baseline_decision(acc, config, utcnow):
+    """The checks of the original bot for one account, in the order of run() and the activity check"""
+    if config["delegationLength"] > 0 and acc.delegated_hp != 0 and not acc.delegation_revoked:
+        if (utcnow - acc.delegation_timestamp).total_seconds() / 60 / 60 / 24 > config["delegationLength"]:
+            return REVOKE_LENGTH
+    if config["maxUserHP"] > 0 and acc.delegated_hp != 0 and not acc.delegation_revoked:
+        if acc.hp > config["maxUserHP"]:
+            return REVOKE_MAX_HP
+    if acc.muted and acc.delegated_hp > 0 and not acc.delegation_revoked:
+        return REVOKE_MUTED
+    if acc.delegated_hp > 0 or acc.delegation_revoked or acc.hp > config["maxUserHP"]:
+        return None
+    if acc.rc_comments < config["minPostRC"]:
+        return "grant"
+    return None
+
+
+def baseline_policy(accounts, names, config, utcnow):
+    grant = []
+    revoke = {}
+    for name in names:
+        decision = baseline_decision(accounts[name], config, utcnow)
+        if decision == "grant":
+            grant.append(name)
+        elif decision is not None:
+            revoke[name] = decision
+    return sorted(grant), revoke
+
+
+def random_account(rnd, config):
+    acc = AccountRecord(weight=300, hp=rnd.choice([0, 5, config["maxUserHP"], config["maxUserHP"] + 0.001, 200]),
+                        rc_comments=rnd.choice([0, rnd.uniform(0, 20), config["minPostRC"]]),
+                        muted=rnd.random() < 0.2, delegation_revoked=rnd.random() < 0.2)
+    if rnd.random() < 0.6:
+        acc.delegated_hp = 30
+        days = rnd.choice([rnd.uniform(0, 40), config["delegationLength"]])
+        acc.delegation_timestamp = NOW - timedelta(seconds=int(days * 24 * 60 * 60))
+    return acc
+
+
+class TestPolicy(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(7)
+        self.accounts = dict(("onboarded%d" % i, random_account(rnd, CONFIG)) for i in range(2000))
+        self.now = datetime_to_epoch(NOW)
+
+    def columns(self):
+        columns = PolicyColumns(16)
+        for name, acc in self.accounts.items():
+            columns.update(name, acc)
+        return columns
+
+    def assertDecisions(self, result, expected):
+        self.assertEqual((sorted(result[0]), result[1]), expected)
+
+    def test_boundaries(self):
+        expiring = AccountRecord(hp=5, delegated_hp=30,
+                                 delegation_timestamp=NOW - timedelta(days=CONFIG["delegationLength"]))
+        expired = AccountRecord(hp=5, delegated_hp=30,
+                                delegation_timestamp=NOW - timedelta(days=CONFIG["delegationLength"], seconds=1))
+        at_max = AccountRecord(hp=CONFIG["maxUserHP"], rc_comments=0)
+        accounts = {"expiring": expiring, "expired": expired, "at_max": at_max}
+        grant, revoke = evaluate_policy_python(accounts, list(accounts), CONFIG, self.now)
+        self.assertEqual(grant, ["at_max"])
+        self.assertEqual(revoke, {"expired": REVOKE_LENGTH})
+
+    def test_python(self):
+        names = list(self.accounts)
+        self.assertDecisions(evaluate_policy_python(self.accounts, names, CONFIG, self.now),
+                             baseline_policy(self.accounts, names, CONFIG, NOW))
+
+    def test_disabled_rules(self):
+        config = {"maxUserHP": 0, "minPostRC": 10, "delegationLength": 0}
+        names = list(self.accounts)
+        self.assertDecisions(evaluate_policy(self.accounts, None, config, self.now, self.columns()),
+                             baseline_policy(self.accounts, names, config, NOW))
+        self.assertDecisions(evaluate_policy_python(self.accounts, names, config, self.now),
+                             baseline_policy(self.accounts, names, config, NOW))
+
+    @unittest.skipIf(policy.np is None, "numpy is not installed")
+    def test_columns(self):
+        columns = self.columns()
+        names = list(self.accounts)
+        expected = baseline_policy(self.accounts, names, CONFIG, NOW)
+        self.assertDecisions(columns.evaluate(None, CONFIG, self.now), expected)
+        self.assertDecisions(evaluate_policy(self.accounts, None, CONFIG, self.now, columns), expected)
+        subset = names[::3]
+        self.assertDecisions(columns.evaluate(subset, CONFIG, self.now),
+                             baseline_policy(self.accounts, subset, CONFIG, NOW))
+
+    @unittest.skipIf(policy.np is None, "numpy is not installed")
+    def test_incremental_update(self):
+        columns = self.columns()
+        rnd = random.Random(8)
+        for name in rnd.sample(list(self.accounts), 500):
+            self.accounts[name] = random_account(rnd, CONFIG)
+            columns.update(name, self.accounts[name])
+        for i in range(100):
+            self.accounts["new%d" % i] = random_account(rnd, CONFIG)
+            columns.update("new%d" % i, self.accounts["new%d" % i])
+        self.assertDecisions(columns.evaluate(None, CONFIG, self.now),
+                             baseline_policy(self.accounts, list(self.accounts), CONFIG, NOW))
+
+    @unittest.skipIf(policy.np is None, "numpy is not installed")
+    def test_numpy_matches_python(self):
+        rnd = random.Random(9)
+        for config in [CONFIG, {"maxUserHP": 0, "minPostRC": 10, "delegationLength": 28},
+                       {"maxUserHP": 50, "minPostRC": 10, "delegationLength": 0},
+                       {"maxUserHP": 5, "minPostRC": 0, "delegationLength": 1}]:
+            accounts = {}
+            length = config["delegationLength"] * 24 * 60 * 60
+            for i in range(1000):
+                acc = random_account(rnd, config)
+                if acc.delegated_hp > 0:
+                    # at, just before and just after the end of the delegation, or without a timestamp
+                    acc.delegation_epoch = rnd.choice([self.now - length, self.now - length - 1,
+                                                       self.now - length + 1, None, acc.delegation_epoch])
+                accounts["onboarded%d" % i] = acc
+            columns = PolicyColumns(16)
+            for name, acc in accounts.items():
+                columns.update(name, acc)
+            names = list(accounts)
+            for subset in [names, names[::2], rnd.sample(names, policy.MIN_NUMPY_ACCOUNTS)]:
+                expected = evaluate_policy_python(accounts, subset, config, self.now)
+                self.assertEqual(columns.evaluate(subset, config, self.now), expected)
+                self.assertEqual(evaluate_policy(accounts, subset, config, self.now, columns), expected)
+            self.assertEqual(evaluate_policy(accounts, None, config, self.now, columns),
+                             evaluate_policy_python(accounts, names, config, self.now))
+
+
+if __name__ == '__main__':
+    unittest.main()
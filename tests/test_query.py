@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from delegationonboardbot.query import QueryServer
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.store import StateStore
+
+
+class TestQueryServer(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.datadir, "data.sqlite")
+        self.server = QueryServer(self.data_file, 0)
+        self.url = "http://127.0.0.1:%d" % self.server.server.server_port
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.datadir)
+
+    def test_missing_data_file(self):
+        with self.assertRaises(HTTPError) as cm:
+            urlopen(self.url + "/accounts")
+        self.assertEqual(cm.exception.code, 404)
+        self.assertEqual(os.listdir(self.datadir), [])
+        store = StateStore(self.data_file)
+        store.store_accounts({"onboarded1": AccountRecord(timestamp=datetime(2021, 1, 1), weight=300, hp=5)})
+        store.close()
+        accounts = json.loads(urlopen(self.url + "/accounts").read())
+        self.assertEqual([account["name"] for account in accounts], ["onboarded1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime, timedelta
+from beem import Hive
+from delegationonboardbot.chain import ChainParams
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.metrics import Metrics
+from delegationonboardbot.mutes import MuteTracker
+from delegationonboardbot.policy import REVOKE_MUTED
+from delegationonboardbot.record import AccountRecord, datetime_to_epoch
+from delegationonboardbot.store import StateStore
+
+CONFIG = {"delegationAccount": "delegationacc", "muteAccount": "muteacc", "delegationLength": 28, "maxUserHP": 50,
+          "minPostRC": 10, "delegationLengthMsg": "", "delegationMaxMsg": "", "delegationMuteMsg": ""}
+NOW = datetime(2021, 6, 1, 12, 0, 0)
+
+
+def delegation(delegatee, hp, days):
+    """A list_vesting_delegations entry, one VESTS is one HP"""
+    return {"delegator": "delegationacc", "delegatee": delegatee, "vesting_shares": "%.6f VESTS" % hp,
+            "min_delegation_time": (NOW - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+        bot.config = dict(CONFIG)
+        bot.hive = Hive(offline=True)
+        bot.chain = ChainParams.from_values(1e6, 1e6, 1.)
+        bot.store = StateStore(":memory:")
+        bot.journal = Journal(None)
+        bot.metrics = Metrics()
+        bot.mute_tracker = MuteTracker(bot.store, "muteacc")
+        bot.open_intents = {}
+        bot.dirty_accounts = set()
+        bot.pending_accounts = set()
+        bot.block_num = None
+        bot.last_block_num = 100
+        bot.now = lambda: datetime_to_epoch(NOW)
+        bot.removed = []
+        bot.remove_delegation = lambda account, msg=None, reason=None: bot.removed.append((account, reason))
+        recent = NOW - timedelta(days=1)
+        bot.accounts = {
+            # the delegation was changed on chain
+            "diverged": AccountRecord(hp=5, delegated_hp=30, delegation_timestamp=recent),
+            # the removal failed, the delegation is still on chain
+            "still_delegated": AccountRecord(hp=5, delegated_hp=0, delegation_revoked=True),
+            # the delegation was removed on chain
+            "removed": AccountRecord(hp=5, delegated_hp=30, delegation_timestamp=recent),
+            # the account was unmuted and muted while the bot was stopped
+            "unmuted": AccountRecord(hp=5, muted=True),
+            "muted": AccountRecord(hp=5, delegated_hp=30, delegation_timestamp=recent),
+            "unchanged": AccountRecord(hp=5, delegated_hp=30, delegation_timestamp=recent),
+            # a broadcast is queued for the account, it is not corrected
+            "pending": AccountRecord(hp=5, delegated_hp=30, delegation_timestamp=recent),
+        }
+        bot.pending_accounts.add("pending")
+        bot.build_index()
+        self.bot = bot
+
+    def test_reconcile(self):
+        bot = self.bot
+        bot.reconcile([delegation("diverged", 50, 2), delegation("still_delegated", 30, 3),
+                       delegation("muted", 30, 1), delegation("unchanged", 30, 1)], ["muted"])
+        accounts = bot.accounts
+        self.assertAlmostEqual(accounts["diverged"].delegated_hp, 50)
+        self.assertEqual(accounts["diverged"].delegation_timestamp, NOW - timedelta(days=2))
+        self.assertAlmostEqual(accounts["still_delegated"].delegated_hp, 30)
+        self.assertFalse(accounts["still_delegated"].delegation_revoked)
+        self.assertEqual(accounts["still_delegated"].delegation_timestamp, NOW - timedelta(days=3))
+        self.assertEqual(accounts["removed"].delegated_hp, 0)
+        self.assertTrue(accounts["removed"].delegation_revoked)
+        self.assertFalse(accounts["unmuted"].muted)
+        self.assertTrue(accounts["muted"].muted)
+        self.assertEqual(accounts["pending"].delegated_hp, 30)
+        self.assertFalse(accounts["pending"].delegation_revoked)
+        self.assertEqual(set(bot.removed), set([("muted", REVOKE_MUTED)]))
+        self.assertEqual(bot.dirty_accounts, set(["diverged", "still_delegated", "removed", "unmuted", "muted"]))
+        self.assertEqual(bot.mute_tracker.muted, set(["muted"]))
+        # the index follows the corrected delegations
+        self.assertAlmostEqual(bot.planner.committed_hp, 50 + 30 + 30 + 30 + 30)
+        self.assertNotIn("removed", bot.expiry_index)
+        self.assertIn("still_delegated", bot.expiry_index)
+
+        # the corrected accounts are stored at the next checkpoint
+        changed = bot.dirty_accounts
+        bot.checkpoint(100)
+        stored = bot.store.load_accounts()
+        self.assertEqual(set(stored), changed)
+        for account in changed:
+            self.assertEqual(stored[account].pack(), accounts[account].pack())
+
+        # a second pass over the same chain state changes nothing
+        bot.dirty_accounts = set()
+        bot.removed = []
+        bot.reconcile([delegation("diverged", 50, 2), delegation("still_delegated", 30, 3),
+                       delegation("muted", 30, 1), delegation("unchanged", 30, 1)], ["muted"])
+        self.assertEqual(bot.dirty_accounts, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
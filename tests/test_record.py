@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from delegationonboardbot.record import AccountRecord, write_snapshot, read_snapshot
+from delegationonboardbot.store import StateStore
+
+
+def fields(acc):
+    return dict((key, getattr(acc, key)) for key in AccountRecord.__slots__)
+
+
+def sample_accounts():
+    return {
+        "full": AccountRecord(timestamp=datetime(2021, 5, 1, 10, 30, 15), weight=300, muted=True, rc=1.5e9, hp=12.25,
+                              delegated_hp=30.5, delegation_timestamp=datetime(2021, 5, 2, 8, 0, 1),
+                              rc_comments=3.75, delegation_revoked=True),
+        # accounts which never got a delegation or whose timestamp is not known
+        "no_timestamps": AccountRecord(weight=None),
+        "no_delegation": AccountRecord(timestamp=datetime(1970, 1, 1), weight=0, hp=5),
+        "revoked": AccountRecord(timestamp=datetime(2021, 5, 1), weight=100, delegation_revoked=True),
+        "x" * 255: AccountRecord(timestamp=datetime(2021, 5, 1), weight=100, muted=True),
+    }
+
+
+class TestAccountRecord(unittest.TestCase):
+    def test_pack_unpack(self):
+        for name, acc in sample_accounts().items():
+            record = AccountRecord.unpack(acc.pack())
+            self.assertEqual(fields(record), fields(acc), name)
+            self.assertEqual(record.timestamp, acc.timestamp)
+            self.assertEqual(record.delegation_timestamp, acc.delegation_timestamp)
+            self.assertEqual(record.muted, acc.muted)
+            self.assertEqual(record.delegation_revoked, acc.delegation_revoked)
+
+    def test_none_timestamps(self):
+        record = AccountRecord.unpack(AccountRecord().pack())
+        self.assertIsNone(record.timestamp)
+        self.assertIsNone(record.delegation_timestamp)
+        self.assertIsNone(record.weight)
+        # the epoch itself is a valid timestamp
+        record = AccountRecord.unpack(AccountRecord(timestamp=datetime(1970, 1, 1)).pack())
+        self.assertEqual(record.timestamp, datetime(1970, 1, 1))
+
+    def test_flags(self):
+        acc = AccountRecord(muted=True, delegation_revoked=True)
+        acc.muted = False
+        self.assertFalse(acc.muted)
+        self.assertTrue(acc.delegation_revoked)
+        acc.delegation_revoked = False
+        self.assertEqual(acc.flags, 0)
+
+    def test_from_dict(self):
+        acc = AccountRecord.from_dict({"timestamp": datetime(2021, 5, 1), "weight": 300, "muted": False, "rc": 0,
+                                       "hp": 3, "delegated_hp": 30, "delegation_timestamp": None,
+                                       "rc_comments": 0, "delegation_revoked": False})
+        self.assertEqual(acc.timestamp, datetime(2021, 5, 1))
+        self.assertIsNone(acc.delegation_epoch)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.snapshot_file = os.path.join(self.path, "accounts.snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        accounts = sample_accounts()
+        write_snapshot(self.snapshot_file, accounts)
+        self.assertFalse(os.path.exists(self.snapshot_file + ".tmp"))
+        snapshot = read_snapshot(self.snapshot_file)
+        self.assertEqual(sorted(snapshot), sorted(accounts))
+        for name in accounts:
+            self.assertEqual(fields(snapshot[name]), fields(accounts[name]), name)
+
+    def test_empty(self):
+        write_snapshot(self.snapshot_file, {})
+        self.assertEqual(read_snapshot(self.snapshot_file), {})
+
+    def test_invalid(self):
+        with open(self.snapshot_file, "wb") as f:
+            f.write(b"SQLite format 3\x00")
+        self.assertRaises(ValueError, read_snapshot, self.snapshot_file)
+
+
+class TestStoredAccounts(unittest.TestCase):
+    def test_round_trip(self):
+        store = StateStore(":memory:")
+        accounts = sample_accounts()
+        store.store_accounts(accounts)
+        stored = store.load_accounts()
+        self.assertEqual(sorted(stored), sorted(accounts))
+        for name in accounts:
+            self.assertEqual(fields(stored[name]), fields(accounts[name]), name)
+        # a changed account replaces its row
+        accounts["no_timestamps"].delegation_timestamp = datetime(2021, 6, 1)
+        accounts["no_timestamps"].delegated_hp = 30
+        store.store_account("no_timestamps", accounts["no_timestamps"])
+        self.assertEqual(fields(store.load_accounts()["no_timestamps"]), fields(accounts["no_timestamps"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import unittest
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.store import StateStore
+from delegationonboardbot.utils import create_session
+from tests.fixture_server import ReferrerServer
+
+PAGE_SIZE = 20
+
+
+def make_bot(server):
+    bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+    bot.config = {"referrerAccount": "dappacc", "referrer_page_size": PAGE_SIZE}
+    bot.onboard_api = server.url + "/api/referrer/dappacc"
+    bot.session = create_session()
+    bot.store = StateStore(":memory:")
+    return bot
+
+
+class ReferrerPagingMixin(object):
+    newest_first = True
+
+    def setUp(self):
+        self.server = ReferrerServer(newest_first=self.newest_first)
+        for i in range(95):
+            self.server.add("onboarded%d" % i, 1600000000000 + i * 1000)
+        self.bot = make_bot(self.server)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_full_fetch(self):
+        items, cursor = self.bot.fetch_referrer({"timestamp": 0, "offset": 0})
+        self.assertEqual(sorted(item["account"] for item in items), sorted("onboarded%d" % i for i in range(95)))
+        self.assertEqual(cursor["timestamp"], 1600000000000 + 94 * 1000)
+
+    def test_incremental_fetch(self):
+        items, cursor = self.bot.fetch_referrer({"timestamp": 0, "offset": 0})
+        for i in range(95, 100):
+            self.server.add("onboarded%d" % i, 1600000000000 + i * 1000)
+        self.server.requests = []
+        items, cursor = self.bot.fetch_referrer(cursor)
+        accounts = set(item["account"] for item in items)
+        self.assertTrue(set("onboarded%d" % i for i in range(95, 100)).issubset(accounts))
+        # only the pages around the new accounts are fetched again
+        self.assertLessEqual(len(accounts), 2 * PAGE_SIZE)
+        self.assertLessEqual(len(self.server.requests), 4)
+        self.assertEqual(cursor["timestamp"], 1600000000000 + 99 * 1000)
+
+    def test_nothing_new(self):
+        items, cursor = self.bot.fetch_referrer({"timestamp": 0, "offset": 0})
+        self.server.requests = []
+        items, new_cursor = self.bot.fetch_referrer(cursor)
+        self.assertEqual(new_cursor, cursor)
+        self.assertLessEqual(len(self.server.requests), 4)
+
+    def test_get_referrer_stores_cursor(self):
+        accounts = self.bot.get_referrer({})
+        self.assertEqual(len(accounts), 95)
+        self.assertEqual(accounts["onboarded3"].weight, 300)
+        self.assertEqual(self.bot.store.get("referrer_cursor")["timestamp"], 1600000000000 + 94 * 1000)
+        self.server.add("onboarded95", 1600000000000 + 95 * 1000)
+        accounts = self.bot.get_referrer(accounts)
+        self.assertEqual(len(accounts), 96)
+
+
+class TestNewestFirst(ReferrerPagingMixin, unittest.TestCase):
+    newest_first = True
+
+    def test_pages(self):
+        self.bot.fetch_referrer({"timestamp": 0, "offset": 0})
+        self.assertEqual(self.server.offsets(), [0, 20, 40, 60, 80, 95])
+
+
+class TestOldestFirst(ReferrerPagingMixin, unittest.TestCase):
+    newest_first = False
+
+    def test_pages(self):
+        items, cursor = self.bot.fetch_referrer({"timestamp": 0, "offset": 0})
+        self.assertEqual(cursor["offset"], 95)
+        self.server.add("onboarded95", 1600000000000 + 95 * 1000)
+        self.server.requests = []
+        self.bot.fetch_referrer(cursor)
+        # first page to detect the order, then one page before the known end
+        self.assertEqual(self.server.offsets(), [0, 75, 95, 96])
+
+
+class TestMalformedResponses(unittest.TestCase):
+    def setUp(self):
+        self.server = ReferrerServer([{"account": "onboarded0", "timestamp": 1600000000000, "weight": 300}])
+        self.bot = make_bot(self.server)
+        self.accounts = self.bot.get_referrer({})
+        self.cursor = self.bot.store.get("referrer_cursor")
+
+    def tearDown(self):
+        self.server.close()
+
+    def check_fallback(self, body):
+        self.server.malformed = body
+        accounts = self.bot.get_referrer(dict(self.accounts))
+        self.assertEqual(list(accounts.keys()), ["onboarded0"])
+        self.assertEqual(self.bot.store.get("referrer_cursor"), self.cursor)
+        self.assertEqual(self.bot.try_fetch_referrer(self.cursor), ([], self.cursor))
+
+    def test_invalid_json(self):
+        self.check_fallback(b"<html>maintenance</html>")
+
+    def test_missing_items(self):
+        self.check_fallback({"error": "rate limited"})
+
+    def test_invalid_items(self):
+        self.check_fallback({"items": {"account": "onboarded1"}})
+        self.check_fallback({"items": [{"account": "onboarded1"}]})
+        self.check_fallback({"items": [{"account": "onboarded1", "timestamp": None, "weight": 300}]})
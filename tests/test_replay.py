@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.replay import load_accounts
+from delegationonboardbot.store import StateStore
+
+
+class TestLoadAccounts(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, "data.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_next_to_running_bot(self):
+        store = StateStore(self.data_file)
+        store.store_accounts({"a": AccountRecord(timestamp=datetime(2021, 1, 1), weight=300, delegated_hp=30),
+                              "b": AccountRecord(timestamp=datetime(2021, 1, 2), weight=300)})
+        # a write transaction of the bot is open
+        with store.transaction():
+            store.store_account("c", AccountRecord(timestamp=datetime(2021, 1, 3), weight=300))
+            accounts = load_accounts(self.data_file)
+        self.assertEqual(sorted(accounts), ["a", "b"])
+        self.assertEqual(accounts["a"].delegated_hp, 30)
+        store.close()
+
+    def test_read_only(self):
+        self.assertRaises(sqlite3.OperationalError, load_accounts, self.data_file)
+        self.assertFalse(os.path.exists(self.data_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from delegationonboardbot.scheduler import BlockScheduler, BLOCK_INTERVAL
+
+GENESIS_TIME = 1622548800
+
+
+class Chain(object):
+    """A chain which produces a block every BLOCK_INTERVAL seconds, starting with head_block_num at GENESIS_TIME"""
+    def __init__(self, head_block_num):
+        self.first_block_num = head_block_num
+
+    def head_block_num(self, now):
+        return self.first_block_num + int((now - GENESIS_TIME) // BLOCK_INTERVAL)
+
+    def props(self, now):
+        head_block_num = self.head_block_num(now)
+        head_time = GENESIS_TIME + (head_block_num - self.first_block_num) * BLOCK_INTERVAL
+        return {"head_block_number": head_block_num,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(head_time))}
+
+
+class TestBlockScheduler(unittest.TestCase):
+    def scheduler(self, head_block_num=10000):
+        scheduler = BlockScheduler(catchup_lag=100, max_window=2000, run_seconds=30, alpha=0.5)
+        scheduler.update_head(Chain(head_block_num).props(GENESIS_TIME))
+        return scheduler
+
+    def test_window_grows_and_shrinks(self):
+        scheduler = self.scheduler(head_block_num=100000)
+        # without a measured rate, the first catch-up run uses the full window
+        self.assertEqual(scheduler.next_range(1000), (2999, True))
+        # 10 blocks/s fill run_seconds with 300 blocks
+        scheduler.record_run(300, 30)
+        self.assertEqual(scheduler.next_range(1000), (1299, True))
+        windows = []
+        for i in range(10):
+            scheduler.record_run(10000, 1)
+            stop_block, catchup = scheduler.next_range(1000)
+            windows.append(stop_block - 1000 + 1)
+        self.assertEqual(windows, sorted(windows))
+        self.assertEqual(windows[-1], 2000)
+        windows = []
+        for i in range(20):
+            scheduler.record_run(1, 10)
+            stop_block, catchup = scheduler.next_range(1000)
+            windows.append(stop_block - 1000 + 1)
+        self.assertEqual(windows, sorted(windows, reverse=True))
+        self.assertEqual(windows[-1], 100)
+
+    def test_ignored_runs(self):
+        scheduler = self.scheduler(head_block_num=100000)
+        scheduler.record_run(300, 30)
+        scheduler.record_run(0, 5)
+        scheduler.record_run(10, 0)
+        self.assertEqual(scheduler.rate, 10)
+
+    def test_window_ends_at_head(self):
+        scheduler = self.scheduler(head_block_num=10000)
+        self.assertEqual(scheduler.next_range(9000), (10000, True))
+        # near the head, all blocks are processed in one run without catch-up mode
+        self.assertEqual(scheduler.next_range(9901), (10000, False))
+        self.assertEqual(scheduler.next_range(10000), (10000, False))
+        self.assertEqual(scheduler.next_range(10001), (None, False))
+
+    def test_wait_time(self):
+        scheduler = self.scheduler(head_block_num=10000)
+        # the next block is due BLOCK_INTERVAL seconds after the head block
+        self.assertAlmostEqual(scheduler.wait_time(10001, now=GENESIS_TIME), BLOCK_INTERVAL)
+        self.assertAlmostEqual(scheduler.wait_time(10001, now=GENESIS_TIME + 1), 2.5)
+        # an overdue block is polled again after a short time
+        self.assertAlmostEqual(scheduler.wait_time(10001, now=GENESIS_TIME + 10), 0.2)
+        # the wait is never longer than one block
+        self.assertAlmostEqual(scheduler.wait_time(10010, now=GENESIS_TIME), BLOCK_INTERVAL)
+
+    def run_loop(self, chain, start_block, stop_block, seconds_per_block):
+        """ Runs the main loop against chain and returns the processed blocks, the ranges and the head polls
+
+            seconds_per_block(block_num) is the processing time of a block.
+        """
+        now = GENESIS_TIME
+        scheduler = self.scheduler(chain.head_block_num(now))
+        blocks = []
+        ranges = []
+        polls = 0
+        while start_block <= stop_block:
+            range_stop, catchup = scheduler.next_range(start_block)
+            polls += 1
+            if range_stop is None:
+                now += scheduler.wait_time(start_block, now=now)
+                scheduler.update_head(chain.props(now))
+                continue
+            self.assertLessEqual(range_stop, chain.head_block_num(now))
+            seconds = sum(seconds_per_block(block_num) for block_num in range(start_block, range_stop + 1))
+            blocks += range(start_block, range_stop + 1)
+            ranges.append((start_block, range_stop, catchup))
+            now += seconds
+            scheduler.record_run(range_stop - start_block + 1, seconds)
+            start_block = range_stop + 1
+            if not catchup:
+                now += scheduler.wait_time(start_block, now=now)
+            scheduler.update_head(chain.props(now))
+        return blocks, ranges, polls
+
+    def test_catch_up_and_follow_head(self):
+        chain = Chain(head_block_num=50000)
+        # slow blocks first, then fast blocks
+        blocks, ranges, polls = self.run_loop(chain, 40000, 50400,
+                                              lambda block_num: 0.1 if block_num < 44000 else 0.001)
+        # every block is processed once and in order
+        self.assertEqual(blocks, list(range(40000, 50401)))
+        catchup_sizes = [stop - start + 1 for start, stop, catchup in ranges if catchup]
+        self.assertGreater(len(catchup_sizes), 0)
+        for size in catchup_sizes:
+            self.assertGreaterEqual(size, 100)
+            self.assertLessEqual(size, 2000)
+        # the window follows the processing rate: about 300 blocks at 10 blocks/s, the maximum when fast
+        self.assertIn(300, catchup_sizes)
+        self.assertIn(2000, catchup_sizes)
+        # at the head, the loop waits for the next block instead of polling in a tight loop
+        head_ranges = [r for r in ranges if not r[2]]
+        self.assertGreater(len(head_ranges), 100)
+        self.assertLess(polls, 3 * len(ranges))
+        for start, stop, catchup in head_ranges[-100:]:
+            self.assertEqual(stop - start + 1, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
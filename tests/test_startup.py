@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot
+from delegationonboardbot.mutes import MuteTracker
+from delegationonboardbot.scheduler import Maintenance
+from delegationonboardbot.store import StateStore
+
+
+class TestBackgroundReconcile(unittest.TestCase):
+    def setUp(self):
+        bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+        bot.config = {"startup_retry_interval": 20}
+        bot.store = StateStore(":memory:")
+        bot.mute_tracker = MuteTracker(bot.store, "muteacc")
+        bot.last_block_num = 100
+        bot.ready = False
+        bot.startup_future = None
+        bot.startup_hive = None
+        bot.maintenance = Maintenance(bot)
+        bot.maintenance.add("retry_background_reconcile", bot.config["startup_retry_interval"])
+        self.calls = []
+
+        def fetch_startup_data(cursor, fetch_mutings):
+            self.calls.append(cursor)
+            raise ValueError("node down")
+
+        bot.fetch_startup_data = fetch_startup_data
+        self.bot = bot
+
+    def wait(self):
+        start = time.time()
+        while not self.bot.startup_future.done():
+            self.assertLess(time.time() - start, 5)
+            time.sleep(0.01)
+
+    def test_retry_on_maintenance_cadence(self):
+        self.bot.start_background_reconcile("hive")
+        executor = self.bot.startup_executor
+        self.wait()
+        self.bot.maintenance.run_due(100)
+        self.bot.finish_startup()
+        # the failed executor is shut down, the reconciliation is not restarted with every block
+        self.assertTrue(executor._shutdown)
+        self.assertIsNone(self.bot.startup_future)
+        for block_num in range(101, 120):
+            self.bot.maintenance.run_due(block_num)
+            self.bot.finish_startup()
+        self.assertEqual(len(self.calls), 1)
+        self.bot.maintenance.run_due(120)
+        self.assertIsNot(self.bot.startup_executor, executor)
+        self.wait()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.bot.startup_hive, "hive")
+        self.bot.finish_startup()
+        self.assertFalse(self.bot.ready)
+
+
+class TestSigterm(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_atexit_handlers_run(self):
+        saved_file = os.path.join(self.tmp_dir, "saved")
+        script = "\n".join([
+            "import atexit, os, signal, time",
+            "from delegationonboardbot.delegationonboardbot import exit_on_sigterm",
+            "atexit.register(lambda: open(%r, 'w').write('saved'))" % saved_file,
+            "signal.signal(signal.SIGTERM, exit_on_sigterm)",
+            "os.kill(os.getpid(), signal.SIGTERM)",
+            "time.sleep(10)"])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.run([sys.executable, "-c", script], cwd=root, timeout=60)
+        self.assertEqual(process.returncode, 143)
+        self.assertTrue(os.path.exists(saved_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
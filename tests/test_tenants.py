@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+from datetime import datetime
+from beem import Hive
+from delegationonboardbot.chain import ChainParams
+from delegationonboardbot.delegationonboardbot import DelegationOnboardBot, OP_TYPES
+from delegationonboardbot.journal import Journal
+from delegationonboardbot.metrics import Metrics
+from delegationonboardbot.mutes import MuteTracker
+from delegationonboardbot.record import AccountRecord
+from delegationonboardbot.store import StateStore
+from delegationonboardbot.tenants import TenantGroup
+
+START_BLOCK = 1000
+TIMESTAMP = datetime(2021, 6, 1, 12, 0, 0)
+
+
+def tenant(name, accounts):
+    """Returns a bot with the state of a tenant, which records the ops it processes"""
+    bot = DelegationOnboardBot.__new__(DelegationOnboardBot)
+    bot.config = {"delegationAccount": "delegation" + name, "muteAccount": "mute" + name,
+                  "referrerAccount": "referrer" + name, "delegationLength": 28, "maxUserHP": 50, "minPostRC": 10,
+                  "delegationMuteMsg": ""}
+    bot.hive = Hive(offline=True)
+    bot.chain = ChainParams.from_values(1e6, 1e6, 1.)
+    bot.store = StateStore(":memory:")
+    bot.journal = Journal(None)
+    bot.metrics = Metrics()
+    bot.mute_tracker = MuteTracker(bot.store, bot.config["muteAccount"])
+    bot.mute_tracker.resync([], START_BLOCK - 1)
+    bot.open_intents = {}
+    bot.dirty_accounts = set()
+    bot.pending_accounts = set()
+    bot.block_num = None
+    bot.last_block_num = START_BLOCK - 1
+    bot.accounts = dict((account, AccountRecord(timestamp=TIMESTAMP, weight=300)) for account in accounts)
+    bot.build_index()
+    bot.op_handlers = dict((op_type, getattr(bot, "handle_" + op_type)) for op_type in OP_TYPES)
+    bot.process_results = lambda: None
+    bot.seen = []
+    process_op = bot.process_op
+
+    def record_op(op, active_accounts):
+        bot.seen.append(op["trx_num"])
+        process_op(op, active_accounts)
+    bot.process_op = record_op
+    return bot
+
+
+class ListStream(object):
+    def __init__(self, ops):
+        self.ops = ops
+        self.last_block_num = None
+
+    def stream(self, start_block, stop_block):
+        for op in self.ops:
+            if start_block <= op["block_num"] <= stop_block:
+                self.last_block_num = op["block_num"]
+                yield op
+
+
+class TestTenantRouting(unittest.TestCase):
+    def setUp(self):
+        self.bots = {"a": tenant("a", ["alice", "shared"]), "b": tenant("b", ["bob", "shared"])}
+        group = TenantGroup.__new__(TenantGroup)
+        group.bots = self.bots
+        group.config = {"print_log_at_block": 100}
+        group.metrics = Metrics()
+        group.log_data = {"start_time": 0, "last_block_num": None, "new_commands": 0, "start_block_num": 0,
+                          "stop_block_num": 0, "time_for_blocks": 0, "op_count": 0}
+        group.build_index()
+        self.group = group
+        self.ops = []
+
+    def add_op(self, op_type, **op):
+        op.update({"type": op_type, "block_num": START_BLOCK + len(self.ops) // 3, "trx_num": len(self.ops),
+                   "timestamp": TIMESTAMP})
+        self.ops.append(op)
+        return op["trx_num"]
+
+    def custom_json(self, account, json_id, data):
+        return self.add_op("custom_json", id=json_id, json=json.dumps(data), required_auths=[],
+                           required_posting_auths=[account])
+
+    def stream(self):
+        active_accounts = dict((bot, {}) for bot in self.bots.values())
+        last_block_num = self.group.process_stream(ListStream(self.ops), START_BLOCK, START_BLOCK + 100,
+                                                   active_accounts)
+        self.assertEqual(last_block_num, self.ops[-1]["block_num"])
+        return dict((name, sorted(active_accounts[bot])) for name, bot in self.bots.items())
+
+    def test_routing(self):
+        a, b = self.bots["a"], self.bots["b"]
+        vote_a = self.add_op("vote", voter="alice", author="bob", permlink="p", weight=10000)
+        transfer_b = self.add_op("transfer", **{"from": "bob", "to": "alice", "amount": "1.000 HIVE", "memo": ""})
+        vote_shared = self.add_op("vote", voter="shared", author="alice", permlink="p", weight=10000)
+        # accounts which are not referred by a tenant are not routed
+        self.add_op("vote", voter="carol", author="alice", permlink="p", weight=10000)
+        self.custom_json("carol", "follow", ["follow", {"follower": "carol", "following": "bob", "what": ["ignore"]}])
+        # the mute account of a mutes an account of b
+        mute_a = self.custom_json("mutea", "follow", ["follow", {"follower": "mutea", "following": "bob",
+                                                                 "what": ["ignore"]}])
+        mute_b = self.custom_json("muteb", "follow", ["follow", {"follower": "muteb", "following": "shared",
+                                                                 "what": ["ignore"]}])
+        delegation_b = self.add_op("delegate_vesting_shares", delegator="delegationb", delegatee="shared",
+                                   vesting_shares="30.000000 VESTS")
+        # a new account of the referrer of a, it is routed to a afterwards
+        created = self.add_op("create_claimed_account", creator="referrera", new_account_name="dave",
+                              json_metadata=json.dumps({"beneficiaries": [{"name": "referrera", "weight": 300,
+                                                                           "label": "referrer"}]}))
+        vote_dave = self.add_op("vote", voter="dave", author="alice", permlink="p", weight=10000)
+
+        active = self.stream()
+        self.assertEqual(a.seen, [vote_a, vote_shared, mute_a, created, vote_dave])
+        self.assertEqual(b.seen, [transfer_b, vote_shared, mute_b, delegation_b, created])
+        self.assertEqual(active, {"a": ["alice", "dave", "shared"], "b": ["bob", "shared"]})
+        self.assertEqual(sorted(a.accounts), ["alice", "dave", "shared"])
+        self.assertEqual(sorted(b.accounts), ["bob", "shared"])
+        # the mute list of a does not change the accounts of b
+        self.assertNotIn("bob", a.accounts)
+        self.assertFalse(b.accounts["bob"].muted)
+        self.assertTrue(b.accounts["shared"].muted)
+        self.assertFalse(a.accounts["shared"].muted)
+        self.assertAlmostEqual(b.accounts["shared"].delegated_hp, 30)
+        self.assertEqual(a.accounts["shared"].delegated_hp, 0)
+        self.assertEqual(self.group.index["dave"], [a])
+
+    def test_tenant_ahead(self):
+        # b has processed the first block already
+        self.bots["b"].last_block_num = START_BLOCK
+        first = self.add_op("vote", voter="shared", author="alice", permlink="p", weight=10000)
+        self.add_op("vote", voter="alice", author="bob", permlink="p", weight=10000)
+        self.add_op("vote", voter="bob", author="alice", permlink="p", weight=10000)
+        second = self.add_op("vote", voter="shared", author="alice", permlink="p", weight=10000)
+        self.stream()
+        self.assertEqual(self.bots["a"].seen, [first, 1, second])
+        self.assertEqual(self.bots["b"].seen, [second])
+
+
+if __name__ == '__main__':
+    unittest.main()